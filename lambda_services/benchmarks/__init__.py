@@ -0,0 +1,3 @@
+"""
+Offline benchmarks and fakes for the ingest and query services.
+"""
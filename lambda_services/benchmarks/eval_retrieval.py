@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Retrieval quality and latency regression suite.
+
+Runs a labelled query set (query -> relevant filenames) through
+search_documents for every combination of --top-k, --hybrid and
+--context-chars, and reports per configuration:
+
+- recall@k, MRR and nDCG@k over the ranked filenames
+- per-query latency (mean, p50, p95)
+- the prompt tokens format_context would build from the results, at about
+  four characters per token
+
+Backends:
+- fake (default): a synthetic corpus is ingested into the in-process fakes.
+  Without --queries the labels are generated too: each query is a run of
+  words from one document, which is the relevant one. Quality numbers are
+  deterministic for a given seed.
+- live: the services' own OPENSEARCH_ENDPOINT and Bedrock clients, for a
+  local or test cluster that already holds documents. Needs --queries.
+
+Each configuration runs --repeats times; latencies are the median over the
+repeats, and the quality numbers come from the first run.
+
+With --baseline, the run is compared against an earlier report per
+configuration, and the script exits with status 1 if quality drops by more
+than --max-quality-drop, p95 latency grows by more than --max-latency-increase
+(and --latency-slack-ms), or prompt tokens grow by more than
+--max-token-increase. With --latency-report-only, latency regressions are
+printed but don't fail the run.
+
+    python benchmarks/eval_retrieval.py --output eval_baseline.json
+    # ... make a change ...
+    python benchmarks/eval_retrieval.py --baseline eval_baseline.json
+"""
+
+import os
+import sys
+import io
+import json
+import math
+import time
+import random
+import argparse
+import statistics
+import itertools
+import contextlib
+
+LAMBDA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    LAMBDA_ROOT,
+    os.path.join(LAMBDA_ROOT, 'query_function'),
+    os.path.join(LAMBDA_ROOT, 'image_conversion_service'),
+]
+
+from benchmarks.run_benchmarks import BenchmarkContext, percentile, git_commit
+
+# Words per generated query
+QUERY_WORDS = 8
+# Rough characters per token for prompt size estimates
+CHARS_PER_TOKEN = 4
+QUALITY_METRICS = ('recall', 'mrr', 'ndcg')
+LATENCY_METRICS = ('mean_ms', 'p50_ms', 'p95_ms')
+
+
+def parse_list(value, convert=str):
+    return [convert(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def parse_bool(value):
+    return value.lower() in ('true', '1', 'yes')
+
+
+def load_labelled_queries(path):
+    """
+    Read a labelled query set: a JSON list (or JSON lines) of
+    {"query": ..., "relevant": [filenames] or {filename: grade}, "filter": {...}}.
+    Grades are positive numbers; a list means grade 1 for each filename.
+    """
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(entries, dict):
+        entries = entries.get('queries', [])
+
+    labelled = []
+    for entry in entries:
+        relevant = entry.get('relevant') or {}
+        if isinstance(relevant, list):
+            relevant = {filename: 1 for filename in relevant}
+        if not entry.get('query') or not relevant:
+            raise ValueError(f"Labelled query needs a query and relevant filenames: {entry}")
+        labelled.append({"query": entry['query'], "relevant": relevant, "filter": entry.get('filter')})
+    return labelled
+
+
+def make_labelled_queries(corpus, count, seed=2):
+    """Known-item queries: a run of QUERY_WORDS words from one document, which is the relevant one"""
+    rng = random.Random(seed)
+    labelled = []
+    for _ in range(count):
+        filename, text, _ = corpus[rng.randrange(len(corpus))]
+        words = text.split()
+        start = rng.randrange(max(1, len(words) - QUERY_WORDS))
+        labelled.append({"query": ' '.join(words[start:start + QUERY_WORDS]),
+                         "relevant": {os.path.basename(filename): 1}, "filter": None})
+    return labelled
+
+
+def recall_at_k(ranked, relevant, k):
+    """Share of the relevant documents in the top k"""
+    return sum(1 for filename in ranked[:k] if filename in relevant) / len(relevant)
+
+
+def reciprocal_rank(ranked, relevant):
+    """1 / rank of the first relevant result, or 0 if none was returned"""
+    for rank, filename in enumerate(ranked, 1):
+        if filename in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked, relevant, k):
+    """Normalised discounted cumulative gain of the top k, with graded relevance"""
+    dcg = sum((2 ** relevant.get(filename, 0) - 1) / math.log2(rank + 1)
+              for rank, filename in enumerate(ranked[:k], 1))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 1) for rank, grade in enumerate(ideal, 1))
+    return dcg / idcg if idcg else 0.0
+
+
+def evaluate(search_documents, format_context, labelled, top_k, hybrid, context_chars):
+    """Run every labelled query with one configuration; returns the summary and per-query rows"""
+    rows = []
+    for item in labelled:
+        start = time.perf_counter()
+        result, status_code = search_documents(item['query'], top_k, hybrid, item['filter'])
+        latency = (time.perf_counter() - start) * 1000
+        ranked = [hit.get('filename') for hit in result.get('results', [])] if status_code == 200 else []
+        context = format_context(result if status_code == 200 else None, context_chars)
+        rows.append({
+            "query": item['query'],
+            "status": status_code,
+            "latency_ms": round(latency, 3),
+            "recall": recall_at_k(ranked, item['relevant'], top_k),
+            "mrr": reciprocal_rank(ranked, item['relevant']),
+            "ndcg": ndcg_at_k(ranked, item['relevant'], top_k),
+            "prompt_tokens": len(context) // CHARS_PER_TOKEN,
+            "ranked": ranked,
+        })
+
+    latencies = [row['latency_ms'] for row in rows]
+    tokens = [row['prompt_tokens'] for row in rows]
+    summary = {
+        "queries": len(rows),
+        "errors": sum(1 for row in rows if row['status'] != 200),
+        **{metric: round(sum(row[metric] for row in rows) / len(rows), 4) for metric in QUALITY_METRICS},
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "prompt_tokens_mean": round(sum(tokens) / len(tokens), 1),
+        "prompt_tokens_p95": percentile(tokens, 95),
+    }
+    return summary, rows
+
+
+def evaluate_repeated(search_documents, format_context, labelled, top_k, hybrid, context_chars, repeats):
+    """
+    evaluate() repeats times. Latencies are the median over the runs, per
+    query and in the summary, so one noisy run doesn't move them.
+    """
+    runs = [evaluate(search_documents, format_context, labelled, top_k, hybrid, context_chars)
+            for _ in range(max(1, repeats))]
+    summary, rows = runs[0]
+    summary = dict(summary, repeats=len(runs),
+                   **{metric: round(statistics.median(run[0][metric] for run in runs), 3)
+                      for metric in LATENCY_METRICS})
+    for position, row in enumerate(rows):
+        row['latency_ms'] = round(statistics.median(run[1][position]['latency_ms'] for run in runs), 3)
+    return summary, rows
+
+
+def find_regressions(results, baseline, args):
+    """
+    Describe every configuration that got worse than the baseline past the
+    thresholds. Returns (regressions, latency regressions).
+    """
+    regressions = []
+    latency_regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name}: not in the baseline, not compared")
+            continue
+        previous = previous['summary']
+        current = current['summary']
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: {current['errors']} failed queries (baseline {previous['errors']})")
+        for metric in QUALITY_METRICS:
+            if previous[metric] - current[metric] > args.max_quality_drop:
+                regressions.append(f"{name}: {metric} {current[metric]:.4f} (baseline {previous[metric]:.4f})")
+        latency_limit = max(previous['p95_ms'] * (1 + args.max_latency_increase),
+                            previous['p95_ms'] + args.latency_slack_ms)
+        if current['p95_ms'] > latency_limit:
+            latency_regressions.append(f"{name}: p95 {current['p95_ms']} ms (baseline {previous['p95_ms']} ms)")
+        token_limit = previous['prompt_tokens_mean'] * (1 + args.max_token_increase)
+        if current['prompt_tokens_mean'] > token_limit:
+            regressions.append(f"{name}: {current['prompt_tokens_mean']} prompt tokens "
+                               f"(baseline {previous['prompt_tokens_mean']})")
+    return regressions, latency_regressions
+
+
+def print_summary(results):
+    print(f"\n{'config':<26}{'recall':>8}{'mrr':>8}{'ndcg':>8}{'p50 ms':>10}{'p95 ms':>10}{'tokens':>9}{'err':>5}")
+    for name, result in results.items():
+        s = result['summary']
+        print(f"{name:<26}{s['recall']:>8.3f}{s['mrr']:>8.3f}{s['ndcg']:>8.3f}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['prompt_tokens_mean']:>9}{s['errors']:>5}")
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Evaluate retrieval quality and latency against a baseline')
+    parser.add_argument('--backend', choices=['fake', 'live'], default='fake')
+    parser.add_argument('--queries', '-q', type=str, help='Labelled query set (JSON or JSON lines)')
+    parser.add_argument('--num-queries', '-n', type=int, default=100, help='Generated queries (fake backend)')
+    parser.add_argument('--corpus-size', type=int, default=200, help='Synthetic documents (fake backend)')
+    parser.add_argument('--top-k', '-k', type=str, default='5,10', help='Comma-separated top_k values')
+    parser.add_argument('--hybrid', type=str, default='true,false', help='Comma-separated hybrid settings')
+    parser.add_argument('--context-chars', type=str, default='10000',
+                        help='Comma-separated format_context max_context_length values')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bedrock-latency', type=float, default=0.0, help='Seconds per fake Bedrock call')
+    parser.add_argument('--opensearch-latency', type=float, default=0.0, help='Seconds per fake OpenSearch call')
+    parser.add_argument('--baseline', '-b', type=str, help='Earlier eval report to compare against')
+    parser.add_argument('--max-quality-drop', type=float, default=0.01,
+                        help='Largest allowed absolute drop in recall, MRR or nDCG')
+    parser.add_argument('--repeats', '-r', type=int, default=3,
+                        help='Runs per configuration; latencies are the median over them')
+    parser.add_argument('--max-latency-increase', type=float, default=0.5,
+                        help='Largest allowed relative p95 latency increase')
+    parser.add_argument('--latency-slack-ms', type=float, default=5.0,
+                        help='p95 increases smaller than this never count, whatever the ratio')
+    parser.add_argument('--latency-report-only', action='store_true',
+                        help="Print latency regressions without failing the run")
+    parser.add_argument('--max-token-increase', type=float, default=0.10,
+                        help='Largest allowed relative increase in mean prompt tokens')
+    parser.add_argument('--output', '-o', type=str, default='eval_results.json', help='JSON report file')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show log output from the services')
+    args = parser.parse_args()
+
+    if args.backend == 'live' and not args.queries:
+        parser.error('the live backend needs --queries')
+    labelled = load_labelled_queries(args.queries) if args.queries else None
+
+    ctx = None
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        if args.backend == 'fake':
+            # BenchmarkContext reads the fault settings run_benchmarks would pass
+            ctx = BenchmarkContext(argparse.Namespace(
+                corpus_size=args.corpus_size, iterations=1, seed=args.seed, duplicate_rate=0.0,
+                s3_latency=0.0, textract_latency=0.0, textract_error_rate=0.0,
+                bedrock_latency=args.bedrock_latency, bedrock_jitter=0.0, bedrock_error_rate=0.0,
+                opensearch_latency=args.opensearch_latency, opensearch_error_rate=0.0,
+            ))
+            ctx.ensure_indexed()
+            labelled = labelled or make_labelled_queries(ctx.corpus, args.num_queries, args.seed + 2)
+            semantic_search, rag_service = ctx.semantic_search, ctx.rag_service
+        else:
+            import semantic_search
+            import rag_service
+
+    configs = list(itertools.product(parse_list(args.top_k, int), parse_list(args.hybrid, parse_bool),
+                                     parse_list(args.context_chars, int)))
+    results = {}
+    try:
+        with output:
+            # The first search reads the index model; keep that out of the timings
+            semantic_search.search_documents(labelled[0]['query'], 1, True, labelled[0]['filter'])
+            for top_k, hybrid, context_chars in configs:
+                name = f"k{top_k}_{'hybrid' if hybrid else 'vector'}_ctx{context_chars}"
+                summary, rows = evaluate_repeated(semantic_search.search_documents, rag_service.format_context,
+                                                  labelled, top_k, hybrid, context_chars, args.repeats)
+                results[name] = {"summary": summary, "queries": rows}
+    finally:
+        if ctx:
+            ctx.restore()
+
+    print_summary(results)
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "git_commit": git_commit(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config', {}).get('queries') != args.queries:
+            print("Warning: the baseline was run with a different query set")
+        regressions, latency_regressions = find_regressions(results, baseline.get('results', {}), args)
+        if latency_regressions and args.latency_report_only:
+            print("\nLatency above the thresholds (report only):")
+            for regression in latency_regressions:
+                print(f"  {regression}")
+        else:
+            regressions += latency_regressions
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,770 @@
+"""
+In-process fakes for S3, Textract, Transcribe, Bedrock runtime and the OpenSearch REST API.
+
+Each fake can inject latency and errors so benchmarks can reproduce slow
+or throttled dependencies. install_fakes() swaps them into the service
+modules (module-level boto3 clients and the requests functions they call).
+"""
+
+import io
+import re
+import fnmatch
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+import types
+import wave
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import requests
+from botocore.exceptions import ClientError
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+class FaultInjector:
+    """Latency and error injection shared by the fakes"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_code='ThrottlingException', seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, operation):
+        with self.lock:
+            self.calls += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate and self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise ClientError({'Error': {'Code': self.error_code, 'Message': 'Injected fault'}}, operation)
+
+
+class _S3Exceptions:
+    ClientError = ClientError
+
+    class NoSuchKey(ClientError):
+        pass
+
+
+class FakeS3:
+    """Dict-backed S3 client covering the calls the ingest path makes"""
+
+    exceptions = _S3Exceptions
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, body, content_type='application/octet-stream', metadata=None, tags=None):
+        with self.lock:
+            self.objects[(bucket, key)] = {
+                'Body': body if isinstance(body, bytes) else body.encode(),
+                'ContentType': content_type,
+                'Metadata': dict(metadata or {}),
+                'Tags': dict(tags or {}),
+            }
+
+    def _get(self, bucket, key, operation):
+        self.faults(operation)
+        with self.lock:
+            obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise _S3Exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey' if operation == 'GetObject' else '404',
+                                                     'Message': 'Not Found'}}, operation)
+        return obj
+
+    def head_bucket(self, Bucket, **kwargs):
+        self.faults('HeadBucket')
+        return {}
+
+    def head_object(self, Bucket, Key):
+        obj = self._get(Bucket, Key, 'HeadObject')
+        return {'ContentLength': len(obj['Body']), 'ContentType': obj['ContentType'], 'Metadata': obj['Metadata']}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        obj = self._get(Bucket, Key, 'GetObject')
+        return {'Body': io.BytesIO(obj['Body']), 'ContentLength': len(obj['Body']),
+                'ContentType': obj['ContentType'], 'Metadata': obj['Metadata'],
+                'ETag': '"%s"' % hashlib.md5(obj['Body']).hexdigest()}
+
+    def put_object(self, Bucket, Key, Body, ContentType='application/octet-stream', Metadata=None, Tagging=None, **kwargs):
+        self.faults('PutObject')
+        tags = dict(item.split('=', 1) for item in Tagging.split('&')) if Tagging else {}
+        self.put(Bucket, Key, Body if isinstance(Body, (bytes, str)) else Body.read(), ContentType, Metadata, tags)
+        return {}
+
+    def copy_object(self, CopySource, Bucket, Key, Metadata=None, MetadataDirective='COPY', ContentType=None, **kwargs):
+        source = self._get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        metadata = Metadata if MetadataDirective == 'REPLACE' else source['Metadata']
+        self.put(Bucket, Key, source['Body'], ContentType or source['ContentType'], metadata, source['Tags'])
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self.faults('ListObjectsV2')
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {'Contents': [{'Key': key} for key in page], 'KeyCount': len(page),
+                    'IsTruncated': start + MaxKeys < len(keys)}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.faults('DeleteObject')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def get_object_tagging(self, Bucket, Key, **kwargs):
+        obj = self._get(Bucket, Key, 'GetObjectTagging')
+        return {'TagSet': [{'Key': k, 'Value': v} for k, v in obj['Tags'].items()]}
+
+    def put_object_tagging(self, Bucket, Key, Tagging, **kwargs):
+        obj = self._get(Bucket, Key, 'PutObjectTagging')
+        obj['Tags'] = {tag['Key']: tag['Value'] for tag in Tagging['TagSet']}
+        return {}
+
+
+class FakeTextract:
+    """
+    Textract fake. Text for a document is looked up by filename in `texts`
+    (falling back to the object's bytes decoded as UTF-8), one LINE block per line.
+    """
+
+    def __init__(self, s3, faults=None):
+        self.s3 = s3
+        self.faults = faults or FaultInjector()
+        self.texts = {}
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def _text_for(self, bucket, key, data=None):
+        name = key.rsplit('/', 1)[-1] if key else None
+        if name in self.texts:
+            return self.texts[name]
+        if data is None:
+            data = self.s3._get(bucket, key, 'DetectDocumentText')['Body']
+        return data.decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def _blocks(text, page=1):
+        blocks = [{'BlockType': 'PAGE', 'Page': page}]
+        for index, line in enumerate(l for l in text.splitlines() if l.strip()):
+            blocks.append({
+                'BlockType': 'LINE', 'Text': line, 'Page': page, 'Confidence': 99.0,
+                'Geometry': {'BoundingBox': {'Left': 0.05, 'Top': 0.02 * index, 'Width': 0.9, 'Height': 0.02}}
+            })
+        return blocks
+
+    def detect_document_text(self, Document):
+        self.faults('DetectDocumentText')
+        if 'Bytes' in Document:
+            text = self.texts.get(hashlib.sha1(Document['Bytes']).hexdigest()) \
+                or Document['Bytes'].decode('utf-8', errors='ignore')
+        else:
+            location = Document['S3Object']
+            text = self._text_for(location['Bucket'], location['Name'])
+        return {'Blocks': self._blocks(text), 'DocumentMetadata': {'Pages': 1}}
+
+    def start_document_text_detection(self, DocumentLocation, **kwargs):
+        self.faults('StartDocumentTextDetection')
+        location = DocumentLocation['S3Object']
+        text = self._text_for(location['Bucket'], location['Name'])
+        with self.lock:
+            job_id = f"job-{len(self.jobs) + 1}"
+            self.jobs[job_id] = text
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId, NextToken=None, **kwargs):
+        self.faults('GetDocumentTextDetection')
+        if JobId not in self.jobs:
+            raise ClientError({'Error': {'Code': 'InvalidJobIdException', 'Message': 'Unknown job'}},
+                              'GetDocumentTextDetection')
+        text = self.jobs[JobId]
+        # One page of text per form feed, one result page per document page
+        pages = text.split('\f')
+        page_index = int(NextToken or 0)
+        response = {'JobStatus': 'SUCCEEDED', 'Blocks': self._blocks(pages[page_index], page_index + 1),
+                    'DocumentMetadata': {'Pages': len(pages)}}
+        if page_index + 1 < len(pages):
+            response['NextToken'] = str(page_index + 1)
+        return response
+
+
+SPOKEN_WORDS = ('meeting budget quarter revenue customer launch schedule review design team '
+                'contract deadline patient treatment flight hotel experiment results invoice payment').split()
+
+
+class FakeTranscribe:
+    """
+    Amazon Transcribe fake. A job reads its WAV segment from the fake S3 and
+    hears one word per burst of sound (every half second for other formats),
+    chosen from SPOKEN_WORDS by the burst's samples. A job completes
+    `realtime_factor` times the segment's duration after it starts.
+    """
+
+    def __init__(self, s3, faults=None, realtime_factor=0.0):
+        self.s3 = s3
+        self.faults = faults or FaultInjector()
+        self.realtime_factor = realtime_factor
+        self.jobs = {}
+        self.started = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _words(data):
+        try:
+            with wave.open(io.BytesIO(data), 'rb') as wav:
+                rate, width = wav.getframerate(), wav.getsampwidth()
+                samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2' if width == 2 else np.uint8)
+        except (wave.Error, EOFError):
+            # Compressed audio: assume 128 kbit/s and a word every half second
+            duration = len(data) * 8 / 128000
+            return [(SPOKEN_WORDS[i % len(SPOKEN_WORDS)], i * 0.5, i * 0.5 + 0.4)
+                    for i in range(int(duration * 2))], duration
+
+        window = max(1, rate // 4)
+        usable = samples[:samples.size - samples.size % window].astype(np.float32).reshape(-1, window)
+        voiced = np.sqrt(np.mean(np.square(usable), axis=1)) > 0.01 * (1 << (8 * width - 1))
+        words = []
+        position = 0
+        while position < len(voiced):
+            if not voiced[position]:
+                position += 1
+                continue
+            end = position
+            while end < len(voiced) and voiced[end]:
+                end += 1
+            word = SPOKEN_WORDS[int(hashlib.md5(usable[position].tobytes()).hexdigest(), 16) % len(SPOKEN_WORDS)]
+            words.append((word, position * window / rate, end * window / rate))
+            position = end
+        return words, samples.size / rate
+
+    def start_transcription_job(self, TranscriptionJobName, Media, OutputBucketName, OutputKey, **kwargs):
+        self.faults('StartTranscriptionJob')
+        with self.lock:
+            if TranscriptionJobName in self.jobs:
+                raise ClientError({'Error': {'Code': 'ConflictException', 'Message': 'Job exists'}},
+                                  'StartTranscriptionJob')
+        bucket, _, key = Media['MediaFileUri'][len('s3://'):].partition('/')
+        words, duration = self._words(self.s3._get(bucket, key, 'GetObject')['Body'])
+
+        items = []
+        for position, (word, start, end) in enumerate(words):
+            items.append({'type': 'pronunciation', 'start_time': f"{start:.3f}", 'end_time': f"{end:.3f}",
+                          'alternatives': [{'content': word, 'confidence': '0.97'}]})
+            if position % 10 == 9:
+                items.append({'type': 'punctuation', 'alternatives': [{'content': '.', 'confidence': '0.0'}]})
+        transcript = {'jobName': TranscriptionJobName, 'results': {
+            'transcripts': [{'transcript': ' '.join(word for word, _, _ in words)}], 'items': items}}
+
+        job = {'TranscriptionJobName': TranscriptionJobName, 'TranscriptionJobStatus': 'IN_PROGRESS',
+               'Media': Media, 'ready_at': time.monotonic() + duration * self.realtime_factor,
+               'output': (OutputBucketName, OutputKey, json.dumps(transcript))}
+        with self.lock:
+            self.jobs[TranscriptionJobName] = job
+            self.started += 1
+        return {'TranscriptionJob': self._status(job)}
+
+    def _status(self, job):
+        if job['TranscriptionJobStatus'] == 'IN_PROGRESS' and time.monotonic() >= job['ready_at']:
+            bucket, key, body = job['output']
+            self.s3.put(bucket, key, body, 'application/json')
+            job['TranscriptionJobStatus'] = 'COMPLETED'
+        return {k: v for k, v in job.items() if k in ('TranscriptionJobName', 'TranscriptionJobStatus', 'Media')}
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self.faults('GetTranscriptionJob')
+        with self.lock:
+            job = self.jobs.get(TranscriptionJobName)
+            if job is None:
+                raise ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Job not found'}},
+                                  'GetTranscriptionJob')
+            return {'TranscriptionJob': self._status(job)}
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        self.faults('DeleteTranscriptionJob')
+        with self.lock:
+            self.jobs.pop(TranscriptionJobName, None)
+        return {}
+
+
+def fake_embedding(text, dimension):
+    """Deterministic bag-of-words embedding: hashed token counts, L2-normalised"""
+    vector = [0.0] * dimension
+    for token in tokenize(text):
+        bucket = int(hashlib.md5(token.encode()).hexdigest(), 16) % dimension
+        vector[bucket] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class FakeBedrockRuntime:
+    """Bedrock runtime fake for Titan embeddings and Claude/Titan text generation"""
+
+    def __init__(self, faults=None, model_faults=None, completion="This is a generated answer."):
+        self.faults = faults or FaultInjector()
+        self.model_faults = model_faults or {}
+        self.completion = completion
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.model_faults.get(modelId, self.faults)('InvokeModel')
+        request = json.loads(body)
+        with self.lock:
+            self.calls.append(modelId)
+
+        if 'embed' in modelId:
+            dimension = request.get('dimensions', 1536 if modelId.endswith('v1') else 1024)
+            payload = {'embedding': fake_embedding(request['inputText'], dimension),
+                       'inputTextTokenCount': len(tokenize(request['inputText']))}
+        elif 'claude' in modelId:
+            prompt_text = json.dumps(request.get('messages', [])) + json.dumps(request.get('system', ''))
+            payload = {
+                'content': [{'type': 'text', 'text': self.completion}],
+                'usage': {'input_tokens': len(prompt_text) // 4, 'output_tokens': len(self.completion) // 4}
+            }
+        else:
+            payload = {'results': [{'outputText': self.completion}], 'completion': self.completion}
+        return {'body': io.BytesIO(json.dumps(payload).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        response = json.loads(self.invoke_model(modelId, body)['body'].read())
+        text = response.get('content', [{}])[0].get('text', '') or response.get('completion', '')
+        events = []
+        for word in text.split(' '):
+            chunk = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': word + ' '}}
+            events.append({'chunk': {'bytes': json.dumps(chunk).encode()}})
+        return {'body': events}
+
+
+class FakeResponse:
+    """Just enough of requests.Response for the service code"""
+
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.text = payload if isinstance(payload, str) else json.dumps(payload if payload is not None else {})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeOpenSearch:
+    """
+    In-memory OpenSearch REST API: document PUT, _search (match, knn and
+    script_score knn_score queries), _msearch, _bulk, scroll, point in time
+    searches with search_after, mappings and aliases. A routing key stands
+    for the shard it selects: searches with one only see documents written
+    with the same key.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.indices = {}
+        self.aliases = {}
+        self.scrolls = {}
+        self.pits = {}
+        self.token_cache = {}
+        self.lock = threading.RLock()
+
+    # -- request dispatch --------------------------------------------------
+
+    def handle(self, method, url, data=None):
+        try:
+            self.faults('OpenSearch')
+        except ClientError:
+            return FakeResponse(429, {"error": "Injected fault"})
+
+        parsed = urlparse(url)
+        parts = [p for p in parsed.path.split('/') if p]
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        body = data.decode() if isinstance(data, bytes) else data
+
+        with self.lock:
+            if method == 'PUT' and len(parts) == 3 and parts[1] == '_doc':
+                return self._index_doc(parts[0], parts[2], json.loads(body), params.get('routing'))
+            if method == 'PUT' and len(parts) == 1:
+                return self._create_index(parts[0], json.loads(body or '{}'))
+            if method == 'HEAD' and len(parts) == 1:
+                return FakeResponse(200 if parts[0] in self.indices or parts[0] in self.aliases else 404)
+            if method == 'DELETE' and len(parts) == 1:
+                return FakeResponse(200 if self.indices.pop(parts[0], None) is not None else 404)
+            if method == 'GET' and len(parts) == 2 and parts[1] == '_mapping':
+                return self._get_mapping(parts[0])
+            if method == 'GET' and len(parts) == 2 and parts[0] == '_alias':
+                return self._get_alias(parts[1])
+            if method == 'POST' and parts == ['_aliases']:
+                return self._update_aliases(json.loads(body))
+            if method == 'POST' and parts == ['_bulk']:
+                return self._bulk(body)
+            if method == 'POST' and parts == ['_msearch']:
+                return self._msearch(body)
+            if method == 'POST' and len(parts) == 3 and parts[1:] == ['_search', 'point_in_time']:
+                return self._create_pit(parts[0], params.get('routing'))
+            if method == 'DELETE' and parts == ['_search', 'point_in_time']:
+                return self._delete_pits(json.loads(body or '{}'))
+            if method in ('GET', 'POST') and parts == ['_search']:
+                return self._pit_search(json.loads(body or '{}'))
+            if method in ('GET', 'POST') and parts == ['_search', 'scroll']:
+                return self._scroll(json.loads(body)['scroll_id'])
+            if method == 'DELETE' and parts == ['_search', 'scroll']:
+                for scroll_id in _as_list(json.loads(body or '{}').get('scroll_id')):
+                    self.scrolls.pop(scroll_id, None)
+                return FakeResponse(200, {"succeeded": True})
+            if method == 'GET' and len(parts) == 2 and parts[1] == '_count':
+                return FakeResponse(200, {"count": sum(1 for _ in self.documents(parts[0]))})
+            if method in ('GET', 'POST') and len(parts) == 2 and parts[1] == '_search':
+                return self._search_endpoint(parts[0], json.loads(body or '{}'), params)
+        return FakeResponse(400, {"error": f"Unsupported fake request {method} {parsed.path}"})
+
+    # -- indices and aliases -----------------------------------------------
+
+    def resolve(self, name):
+        """Concrete index names behind an index, alias, alias pattern or comma-separated list"""
+        names = []
+        for part in name.split(','):
+            if '*' in part:
+                names.extend(index for alias in fnmatch.filter(self.aliases, part) for index in self.aliases[alias]
+                             if index not in names)
+            else:
+                names.extend(self.aliases.get(part, [part]))
+        return names
+
+    def _ensure_index(self, index, mapping=None):
+        if index not in self.indices:
+            self.indices[index] = {'mappings': (mapping or {}).get('mappings', {}), 'docs': {}}
+        return self.indices[index]
+
+    def _create_index(self, index, mapping):
+        if index in self.indices:
+            return FakeResponse(400, {"error": "resource_already_exists_exception"})
+        self._ensure_index(index, mapping)
+        return FakeResponse(200, {"acknowledged": True})
+
+    def _index_doc(self, index, doc_id, document, routing=None):
+        targets = self.resolve(index)
+        if len(targets) != 1:
+            return FakeResponse(400, {"error": "alias points at multiple indices"})
+        stored = self._ensure_index(targets[0])
+        stored['docs'][doc_id] = document
+        stored.setdefault('routing', {})[doc_id] = routing
+        self.token_cache.pop((targets[0], doc_id), None)
+        return FakeResponse(201, {"_index": targets[0], "_id": doc_id, "result": "created"})
+
+    def _get_mapping(self, name):
+        found = {i: {'mappings': self.indices[i]['mappings']} for i in self.resolve(name) if i in self.indices}
+        return FakeResponse(200 if found else 404, found)
+
+    def _get_alias(self, pattern):
+        found = {}
+        for alias in fnmatch.filter(self.aliases, pattern):
+            for index in self.aliases[alias]:
+                found.setdefault(index, {'aliases': {}})['aliases'][alias] = {}
+        return FakeResponse(200 if found else 404, found)
+
+    def _update_aliases(self, body):
+        for action in body.get('actions', []):
+            (kind, spec), = action.items()
+            if kind == 'add':
+                self.aliases.setdefault(spec['alias'], [])
+                if spec['index'] not in self.aliases[spec['alias']]:
+                    self.aliases[spec['alias']].append(spec['index'])
+            elif kind == 'remove':
+                self.aliases.get(spec['alias'], []).remove(spec['index'])
+            elif kind == 'remove_index':
+                self.indices.pop(spec['index'], None)
+        return FakeResponse(200, {"acknowledged": True})
+
+    def _bulk(self, body):
+        lines = [line for line in body.split('\n') if line.strip()]
+        items = []
+        for action_line, doc_line in zip(lines[::2], lines[1::2]):
+            (kind, spec), = json.loads(action_line).items()
+            response = self._index_doc(spec['_index'], spec['_id'], json.loads(doc_line), spec.get('routing'))
+            items.append({kind: {"_id": spec['_id'], "status": response.status_code}})
+        return FakeResponse(200, {"errors": False, "items": items})
+
+    # -- search --------------------------------------------------------------
+
+    def _search_endpoint(self, index, query, params):
+        if params.get('scroll'):
+            # Later pages are served from the hits of the first request
+            size = query.get('size', 10)
+            hits = self.search(index, dict(query, size=10 ** 9), params.get('routing'))['hits']['hits']
+            scroll_id = f"scroll-{len(self.scrolls) + 1}"
+            self.scrolls[scroll_id] = (hits[size:], size)
+            return FakeResponse(200, {"_scroll_id": scroll_id, "hits": {"hits": hits[:size]}})
+        return FakeResponse(200, self.search(index, query, params.get('routing')))
+
+    def _create_pit(self, index, routing=None):
+        # Searches read the live index; the fake doesn't snapshot it
+        pit_id = f"pit-{len(self.pits) + 1}"
+        self.pits[pit_id] = (index, routing)
+        return FakeResponse(200, {"pit_id": pit_id})
+
+    def _delete_pits(self, body):
+        pit_ids = _as_list(body.get('pit_id'))
+        for pit_id in pit_ids:
+            self.pits.pop(pit_id, None)
+        return FakeResponse(200, {"pits": [{"pit_id": pit_id, "successful": True} for pit_id in pit_ids]})
+
+    def _pit_search(self, query):
+        pit_id = (query.get('pit') or {}).get('id')
+        if pit_id not in self.pits:
+            return FakeResponse(404, {"error": {"type": "search_context_missing_exception"}})
+        index, routing = self.pits[pit_id]
+        result = self.search(index, query, routing)
+        result['pit_id'] = pit_id
+        return FakeResponse(200, result)
+
+    def _scroll(self, scroll_id):
+        remaining, size = self.scrolls.get(scroll_id, ([], 0))
+        self.scrolls[scroll_id] = (remaining[size:], size)
+        return FakeResponse(200, {"_scroll_id": scroll_id, "hits": {"hits": remaining[:size]}})
+
+    def _msearch(self, body):
+        lines = [line for line in body.split('\n') if line.strip()]
+        responses = []
+        for header_line, query_line in zip(lines[::2], lines[1::2]):
+            header = json.loads(header_line)
+            responses.append(self.search(header.get('index', ''), json.loads(query_line), header.get('routing')))
+        return FakeResponse(200, {"responses": responses})
+
+    def documents(self, index, routing=None):
+        for name in self.resolve(index):
+            stored = self.indices.get(name, {})
+            for doc_id, doc in stored.get('docs', {}).items():
+                if routing is None or stored.get('routing', {}).get(doc_id) == routing:
+                    yield name, doc_id, doc
+
+    def _bm25(self, query_text, docs):
+        terms = set(tokenize(query_text))
+        if not terms:
+            return {}
+        total = max(len(docs), 1)
+        doc_tokens = {}
+        for name, doc_id, doc in docs:
+            if (name, doc_id) not in self.token_cache:
+                self.token_cache[(name, doc_id)] = tokenize(doc.get('text'))
+            doc_tokens[(name, doc_id)] = self.token_cache[(name, doc_id)]
+        frequencies = {t: sum(1 for tokens in doc_tokens.values() if t in tokens) for t in terms}
+        scores = {}
+        for name, doc_id, doc in docs:
+            tokens = doc_tokens[(name, doc_id)]
+            score = 0.0
+            for term in terms:
+                tf = tokens.count(term)
+                if tf:
+                    idf = math.log(1 + (total - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+                    score += idf * tf * 2.2 / (tf + 1.2)
+            if score:
+                scores[(name, doc_id)] = score
+        return scores
+
+    @staticmethod
+    def _cosine(a, b):
+        if not a or not b or len(a) != len(b):
+            return 0.0
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)) or 1.0
+        return dot / norm
+
+    def _matches_filter(self, doc, clause):
+        """Evaluate term/terms/range/prefix/exists/bool filter clauses against a document"""
+        if not clause:
+            return True
+        if isinstance(clause, list):
+            return all(self._matches_filter(doc, c) for c in clause)
+        (kind, spec), = clause.items()
+        if kind == 'bool':
+            return (all(self._matches_filter(doc, c) for c in _as_list(spec.get('filter')) + _as_list(spec.get('must')))
+                    and not any(self._matches_filter(doc, c) for c in _as_list(spec.get('must_not')))
+                    and (not spec.get('should') or any(self._matches_filter(doc, c) for c in _as_list(spec['should']))))
+        if kind == 'exists':
+            return _field_value(doc, spec['field']) is not None
+        (field, value), = spec.items()
+        actual = _field_value(doc, field)
+        if kind == 'terms' and isinstance(actual, list):
+            return bool(set(actual) & set(value))
+        if kind == 'term':
+            value = value.get('value') if isinstance(value, dict) else value
+            # Multi-valued fields match if any value does
+            return value in actual if isinstance(actual, list) else actual == value
+        if kind == 'terms':
+            return actual in value
+        if kind == 'prefix':
+            return isinstance(actual, str) and actual.startswith(value.get('value') if isinstance(value, dict) else value)
+        if kind == 'range':
+            return actual is not None and all(
+                {'gte': actual >= bound, 'gt': actual > bound, 'lte': actual <= bound, 'lt': actual < bound}[op]
+                for op, bound in value.items() if op in ('gte', 'gt', 'lte', 'lt'))
+        if kind == 'match':
+            return bool(set(tokenize(str(value))) & set(tokenize(str(actual))))
+        if kind == 'match_all':
+            return True
+        return True
+
+    def score(self, query, docs):
+        """Return {(index, id): score} for the supported query types"""
+        if not query or 'match_all' in query:
+            return {(name, doc_id): 1.0 for name, doc_id, _ in docs}
+        (kind, spec), = query.items()
+        if kind == 'match':
+            return self._bm25(spec.get('text', ''), docs)
+        if kind == 'knn':
+            (field, knn), = spec.items()
+            candidates = [d for d in docs if self._matches_filter(d[2], knn.get('filter'))]
+            scored = {(n, i): (1 + self._cosine(knn['vector'], d.get(field))) / 2 for n, i, d in candidates}
+            best = sorted(scored.items(), key=lambda kv: -kv[1])[:knn.get('k', 10)]
+            return dict(best)
+        if kind == 'script_score':
+            base = self.score(spec.get('query'), docs)
+            script_params = spec['script']['params']
+            return {key: 1 + self._cosine(script_params['query_value'], self._doc(key).get(script_params['field']))
+                    for key in base}
+        if kind == 'bool':
+            filtered = [d for d in docs if self._matches_filter(
+                d[2], {'bool': {'filter': spec.get('filter', []), 'must_not': spec.get('must_not', [])}})]
+            scores = {}
+            clauses = _as_list(spec.get('must')) + _as_list(spec.get('should'))
+            for clause in clauses:
+                for key, value in self.score(clause, filtered).items():
+                    scores[key] = scores.get(key, 0) + value
+            if not clauses:
+                scores = {(n, i): 0.0 for n, i, _ in filtered}
+            if spec.get('must'):
+                required = [set(self.score(c, filtered)) for c in _as_list(spec['must'])]
+                scores = {k: v for k, v in scores.items() if all(k in r for r in required)}
+            return scores
+        if kind == 'constant_score':
+            return {(n, i): spec.get('boost', 1.0) for n, i, d in docs if self._matches_filter(d, spec['filter'])}
+        if kind == 'hybrid':
+            scores = {}
+            for clause in spec.get('queries', []):
+                for key, value in self.score(clause, docs).items():
+                    scores[key] = scores.get(key, 0) + value
+            return scores
+        return {}
+
+    def _doc(self, key):
+        name, doc_id = key
+        return self.indices[name]['docs'][doc_id]
+
+    def search(self, index, query, routing=None):
+        docs = list(self.documents(index, routing))
+        scores = self.score(query.get('query'), docs)
+        post_filter = query.get('post_filter')
+        # The tiebreaker after the score: _shard_doc (index and insertion order) for PIT searches, else _id
+        if any('_shard_doc' in clause for clause in _as_list(query.get('sort'))):
+            positions = {(name, doc_id): (order << 32) + position
+                         for order, name in enumerate(sorted(self.resolve(index)))
+                         for position, doc_id in enumerate(self.indices.get(name, {}).get('docs', {}))}
+            tiebreak = positions.get
+        else:
+            tiebreak = lambda key: key[1]
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], tiebreak(kv[0])))
+        hits = []
+        for (name, doc_id), score in ranked:
+            doc = self.indices[name]['docs'][doc_id]
+            if post_filter and not self._matches_filter(doc, post_filter):
+                continue
+            source = doc
+            excludes = (query.get('_source') or {}).get('excludes', []) if isinstance(query.get('_source'), dict) else []
+            if excludes:
+                source = {k: v for k, v in doc.items() if k not in excludes}
+            hit = {"_index": name, "_id": doc_id, "_score": score, "_source": source,
+                   "sort": [score, tiebreak((name, doc_id))]}
+            if self.indices[name].get('routing', {}).get(doc_id):
+                hit["_routing"] = self.indices[name]['routing'][doc_id]
+            hits.append(hit)
+        search_after = query.get('search_after')
+        if search_after:
+            # Hits sort by score descending, then the tiebreaker ascending
+            after_score, after_tiebreak = search_after[0], search_after[1]
+            hits = [h for h in hits if h['_score'] < after_score
+                    or (h['_score'] == after_score and h['sort'][1] > after_tiebreak)]
+        start = query.get('from', 0)
+        size = query.get('size', 10)
+        return {"took": 1, "hits": {"total": {"value": len(hits)}, "hits": hits[start:start + size]}}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _field_value(doc, field):
+    value = doc
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+class FakeBackend:
+    """All fakes wired together"""
+
+    def __init__(self, s3_faults=None, textract_faults=None, bedrock_faults=None, opensearch_faults=None,
+                 model_faults=None, transcribe_faults=None, transcribe_realtime_factor=0.0):
+        self.s3 = FakeS3(s3_faults)
+        self.textract = FakeTextract(self.s3, textract_faults)
+        self.transcribe = FakeTranscribe(self.s3, transcribe_faults, transcribe_realtime_factor)
+        self.bedrock = FakeBedrockRuntime(bedrock_faults, model_faults)
+        self.opensearch = FakeOpenSearch(opensearch_faults)
+
+
+def install_fakes(backend, modules):
+    """
+    Point the service modules at the fake backend. `modules` are the imported
+    service modules; any of s3_client, textract_client, transcribe_client,
+    bedrock_runtime and http (a requests session) they define are replaced, and the requests
+    functions are routed to the fake OpenSearch. Returns a function that restores the originals.
+    """
+    def route(method):
+        def call(url, data=None, headers=None, **kwargs):
+            if kwargs.get('json') is not None:
+                data = json.dumps(kwargs['json'])
+            return backend.opensearch.handle(method, url, data)
+        return call
+
+    methods = ('get', 'post', 'put', 'head', 'delete')
+    # Stands in for the modules' pooled requests.Session
+    session = types.SimpleNamespace(**{method: route(method.upper()) for method in methods})
+
+    saved = []
+    replacements = {'s3_client': backend.s3, 'textract_client': backend.textract,
+                    'transcribe_client': backend.transcribe, 'bedrock_runtime': backend.bedrock, 'http': session}
+    for module in modules:
+        for attribute, fake in replacements.items():
+            if hasattr(module, attribute):
+                saved.append((module, attribute, getattr(module, attribute)))
+                setattr(module, attribute, fake)
+
+    for method in methods:
+        saved.append((requests, method, getattr(requests, method)))
+        setattr(requests, method, route(method.upper()))
+
+    def restore():
+        for module, attribute, original in reversed(saved):
+            setattr(module, attribute, original)
+    return restore
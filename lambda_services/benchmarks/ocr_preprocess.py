@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Benchmark for the OCR image preprocessing in ingest.prepare_for_ocr.
+
+Generates sample images with known text (a 600 DPI scan, an EXIF-rotated
+phone photo, a transparent PNG screenshot, a HEIC photo and a large TIFF),
+runs them through the preprocessing ingest applies (JPEG/PNG files keep their
+original bytes when re-encoding wouldn't shrink them) and reports payload
+size, pixel count and processing time. Text legibility is checked against Textract's minimum text
+height of 15 pixels. With --textract the original and preprocessed images are
+also sent to Amazon Textract, and the share of expected words it recovers is
+compared (requires AWS credentials).
+
+    python benchmarks/ocr_preprocess.py --iterations 5 --output ocr_preprocess_results.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+
+LAMBDA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [LAMBDA_ROOT, os.path.join(LAMBDA_ROOT, 'image_conversion_service')]
+
+from benchmarks.run_benchmarks import BENCHMARK_ENV, percentile, git_commit
+
+for _key, _value in BENCHMARK_ENV.items():
+    os.environ.setdefault(_key, _value)
+
+from PIL import Image, ImageDraw, ImageFont
+from pillow_heif import register_heif_opener
+import ingest
+
+register_heif_opener()
+
+# Smallest text height Textract reliably detects
+TEXTRACT_MIN_TEXT_PX = 15
+SYNC_FORMATS = ('JPEG', 'PNG')
+
+SAMPLE_LINES = [
+    'Invoice number 48213 issued to Northwind Traders',
+    'Payment due within thirty days of the invoice date',
+    'Total amount 1,284.50 including sales tax',
+    'Please reference the account number on all correspondence',
+]
+
+
+def draw_text(image, font_px, color='black'):
+    """Draw SAMPLE_LINES down the page; returns the cap height in pixels"""
+    font = ImageFont.load_default(size=font_px)
+    draw = ImageDraw.Draw(image)
+    y = font_px * 2
+    for _ in range(3):
+        for line in SAMPLE_LINES:
+            draw.text((font_px * 2, y), line, fill=color, font=font)
+            y += int(font_px * 1.6)
+        y += font_px * 2
+    left, top, right, bottom = font.getbbox('H')
+    return bottom - top
+
+
+def encode(image, fmt, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def make_samples():
+    """(name, bytes, format, cap height in pixels, rotated) for each sample image"""
+    samples = []
+
+    # Letter page scanned at 600 DPI, 10pt text
+    page = Image.new('RGB', (5100, 6600), 'white')
+    scan_cap = draw_text(page, 83)
+    samples.append(('scan_600dpi_jpeg', encode(page, 'JPEG', quality=95, dpi=(600, 600)), 'JPEG', scan_cap, False))
+
+    # 12 MP phone photo of a document, stored sideways with EXIF orientation 6
+    noise = Image.effect_noise((4032, 3024), 24).point(lambda value: 150 + value // 3)
+    photo = Image.merge('RGB', (noise, noise, noise))
+    photo_cap = draw_text(photo, 64, color=(20, 20, 30))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    sideways = photo.transpose(Image.Transpose.ROTATE_90)
+    samples.append(('phone_photo_exif', encode(sideways, 'JPEG', quality=92, exif=exif), 'JPEG', photo_cap, True))
+
+    # Retina screenshot with a transparent background
+    screenshot = Image.new('RGBA', (2880, 1800), (0, 0, 0, 0))
+    screenshot_cap = draw_text(screenshot, 28, color=(0, 0, 0, 255))
+    samples.append(('screenshot_png', encode(screenshot, 'PNG'), 'PNG', screenshot_cap, False))
+
+    # HEIC photo as uploaded from an iPhone
+    samples.append(('phone_photo_heic', encode(photo, 'HEIF', quality=90), 'HEIF', photo_cap, False))
+
+    # Large grayscale TIFF scan at 400 DPI
+    tiff = Image.new('L', (6000, 8000), 255)
+    tiff_cap = draw_text(tiff, 56, color=0)
+    samples.append(('scan_400dpi_tiff', encode(tiff, 'TIFF', compression='tiff_lzw', dpi=(400, 400)),
+                    'TIFF', tiff_cap, False))
+    return samples
+
+
+def word_recall(textract_client, data):
+    """Share of the expected words Textract finds in an image"""
+    response = textract_client.detect_document_text(Document={'Bytes': data})
+    found = set()
+    for block in response['Blocks']:
+        if block['BlockType'] == 'WORD':
+            found.add(block['Text'].strip('.,').lower())
+    expected = {word.strip('.,').lower() for line in SAMPLE_LINES for word in line.split()}
+    return round(len(expected & found) / len(expected), 3)
+
+
+def run_sample(name, data, fmt, cap_px, rotated, args, textract_client=None):
+    original = Image.open(io.BytesIO(data))
+    original_size = original.size
+
+    timings = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        if fmt in SYNC_FORMATS:
+            processed_data = ingest.preprocess_image(data)
+        else:
+            processed_data = ingest.prepare_for_ocr(data)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    kept_original = processed_data is None
+    if kept_original:
+        processed_data = data
+
+    processed = Image.open(io.BytesIO(processed_data))
+    # Compare the long edges so an EXIF rotation doesn't skew the scale
+    scale = max(processed.size) / float(max(original_size))
+    text_px = round(cap_px * scale, 1)
+
+    result = {
+        "format": fmt,
+        "input_bytes": len(data),
+        "output_bytes": len(processed_data),
+        "size_ratio": round(len(processed_data) / len(data), 3),
+        "input_pixels": original_size[0] * original_size[1],
+        "output_pixels": processed.size[0] * processed.size[1],
+        "output_mode": processed.mode,
+        "kept_original": kept_original,
+        "upright": (processed.height > processed.width) == (original_size[0] > original_size[1])
+        if rotated else True,
+        "text_height_px": text_px,
+        "text_legible": text_px >= TEXTRACT_MIN_TEXT_PX,
+        "within_sync_limit": len(processed_data) <= ingest.TEXTRACT_SYNC_MAX_BYTES,
+        "p50_ms": round(percentile(timings, 50), 2),
+        "max_ms": round(max(timings), 2),
+    }
+
+    if textract_client:
+        result["processed_word_recall"] = word_recall(textract_client, processed_data)
+        # Textract only takes the original as-is if it is a supported format within the limit
+        if fmt in SYNC_FORMATS and len(data) <= ingest.TEXTRACT_SYNC_MAX_BYTES:
+            result["original_word_recall"] = word_recall(textract_client, data)
+    return result
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Benchmark OCR image preprocessing')
+    parser.add_argument('--iterations', '-n', type=int, default=3, help='Preprocessing runs per sample')
+    parser.add_argument('--textract', action='store_true', help='Compare word recall with real Amazon Textract')
+    parser.add_argument('--output', '-o', type=str, default='ocr_preprocess_results.json', help='JSON results file')
+    args = parser.parse_args()
+
+    textract_client = None
+    if args.textract:
+        import boto3
+        textract_client = boto3.client('textract')
+
+    print("Generating sample images...")
+    results = {}
+    for name, data, fmt, cap_px, rotated in make_samples():
+        print(f"Preprocessing {name}...")
+        results[name] = run_sample(name, data, fmt, cap_px, rotated, args, textract_client)
+
+    print(f"\n{'sample':<20}{'in KB':>10}{'out KB':>10}{'ratio':>8}{'text px':>9}{'legible':>9}{'p50 ms':>9}")
+    for name, stats in results.items():
+        print(f"{name:<20}{stats['input_bytes'] // 1024:>10}{stats['output_bytes'] // 1024:>10}"
+              f"{stats['size_ratio']:>8}{stats['text_height_px']:>9}{str(stats['text_legible']):>9}"
+              f"{stats['p50_ms']:>9}")
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "git_commit": git_commit(),
+        "config": {
+            **vars(args),
+            "target_dpi": ingest.OCR_TARGET_DPI,
+            "max_pixels": ingest.OCR_MAX_PIXELS,
+            "grayscale": ingest.OCR_GRAYSCALE,
+            "jpeg_quality": ingest.OCR_JPEG_QUALITY,
+            "max_bytes": ingest.OCR_MAX_BYTES,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
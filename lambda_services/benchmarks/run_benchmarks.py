@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+"""
+Offline end-to-end benchmark harness.
+
+Drives ingest.lambda_handler (documents and audio), search_documents, rag_query and generate_story against the
+in-process fakes in benchmarks/fakes.py, with configurable injected latency
+and error rates, and reports throughput, latency percentiles and allocations.
+Results are written as JSON so runs can be compared over time.
+
+    python benchmarks/run_benchmarks.py --workload all --iterations 200 --output bench_results.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import wave
+import argparse
+import contextlib
+import platform
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+LAMBDA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    LAMBDA_ROOT,
+    os.path.join(LAMBDA_ROOT, 'query_function'),
+    os.path.join(LAMBDA_ROOT, 'image_conversion_service'),
+]
+
+# The service modules read configuration at import time
+BENCHMARK_ENV = {
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'OPENSEARCH_ENDPOINT': 'http://opensearch.benchmark.local',
+    'INGESTION_BUCKET': 'bench-ingestion',
+    'PROCESSED_INGESTION_BUCKET': 'bench-processed',
+    'FAILED_INGESTION_BUCKET': 'bench-failed',
+    'TEXTRACT_POLL_INTERVAL': '0',
+    'TRANSCRIBE_POLL_INTERVAL': '0.02',
+    'SEARCH_CURSOR_SECRET': 'benchmark',
+}
+
+TOPICS = {
+    'finance': 'invoice payment receipt total amount tax balance account bank transfer due',
+    'medical': 'patient diagnosis prescription dosage clinic doctor symptoms treatment blood test',
+    'travel': 'flight hotel booking passenger departure arrival gate itinerary luggage ticket',
+    'legal': 'contract agreement party clause liability termination signature witness court',
+    'research': 'experiment dataset model accuracy results hypothesis sample analysis figure',
+}
+FILLER = 'the a of and to in for with on from by this that is was be are'.split()
+
+
+def make_corpus(size, seed=0, duplicate_rate=0.0):
+    """
+    Synthetic documents: (filename, text, topic), each mostly about one topic.
+    A duplicate_rate share of them are rescans of an earlier document of the
+    same topic, with a few OCR-style character errors.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    topics = sorted(TOPICS)
+    for i in range(size):
+        topic = topics[i % len(topics)]
+        earlier = [text for _, text, t in corpus if t == topic]
+        if earlier and rng.random() < duplicate_rate:
+            chars = list(rng.choice(earlier))
+            for _ in range(max(1, len(chars) // 200)):
+                position = rng.randrange(len(chars))
+                chars[position] = rng.choice('ilo0 ')
+            corpus.append((f"{topic}_{i:05d}.jpg", ''.join(chars), topic))
+            continue
+        words = TOPICS[topic].split()
+        lines = []
+        for _ in range(rng.randint(5, 15)):
+            lines.append(' '.join(rng.choice(words) if rng.random() < 0.6 else rng.choice(FILLER)
+                                  for _ in range(rng.randint(6, 12))))
+        corpus.append((f"{topic}_{i:05d}.jpg", '\n'.join(lines), topic))
+    return corpus
+
+
+def make_recording(seconds, seed=0, rate=16000):
+    """
+    Synthetic 16-bit mono speech: bursts of noisy tone 0.3-3 s long ("words"
+    and phrases) separated by 0.2-1.5 s of background hiss. Returns WAV bytes.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    total = int(seconds * rate)
+    audio = rng.normal(0, 30, total)
+    position = 0
+    while position < total:
+        length = int(rng.uniform(0.3, 3.0) * rate)
+        end = min(total, position + length)
+        t = np.arange(end - position) / rate
+        audio[position:end] += 6000 * np.sin(2 * np.pi * rng.uniform(120, 300) * t) + rng.normal(0, 1500, end - position)
+        position = end + int(rng.uniform(0.2, 1.5) * rate)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.clip(audio, -32768, 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def tenant_names(count):
+    """One large tenant followed by count - 1 small ones"""
+    return ['large'] + [f"small{i}" for i in range(1, count)] if count else []
+
+
+def tenant_for(position, tenants):
+    """Half the corpus goes to the large tenant, the rest round-robin to the small ones"""
+    if len(tenants) == 1 or position % 2 == 0:
+        return tenants[0]
+    return tenants[1 + (position // 2) % (len(tenants) - 1)]
+
+
+def make_queries(count, seed=1):
+    rng = random.Random(seed)
+    topics = sorted(TOPICS)
+    return [' '.join(rng.sample(TOPICS[topics[i % len(topics)]].split(), 3)) for i in range(count)]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(operation, items, concurrency=1, track_allocations=False):
+    """
+    Run operation(item) for every item and collect latency, throughput and
+    allocation statistics. operation returns True on success.
+    """
+    latencies = []
+    errors = 0
+
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            ok = operation(item)
+        except Exception as e:
+            print(f"Benchmark operation failed: {str(e)}")
+            ok = False
+        return time.perf_counter() - start, ok
+
+    if track_allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+
+    wall_start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(timed, items))
+    else:
+        outcomes = [timed(item) for item in items]
+    wall = time.perf_counter() - wall_start
+
+    for latency, ok in outcomes:
+        latencies.append(latency * 1000)
+        errors += 0 if ok else 1
+
+    stats = {
+        "operations": len(items),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 4),
+        "throughput_ops_s": round(len(items) / wall, 2) if wall else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 3) if latencies else None,
+        "max_ms": round(max(latencies), 3) if latencies else None,
+    }
+
+    if track_allocations:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        growth = sum(stat.size_diff for stat in after.compare_to(before, 'filename') if stat.size_diff > 0)
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+        stats["allocations"] = {
+            "peak_kb": round(peak / 1024, 1),
+            "retained_kb": round(growth / 1024, 1),
+            "retained_blocks": blocks,
+        }
+    return stats
+
+
+class BenchmarkContext:
+    """Fake backend plus the service modules wired to it"""
+
+    def __init__(self, args):
+        for key, value in BENCHMARK_ENV.items():
+            os.environ.setdefault(key, value)
+        # Read by common.tenancy at import
+        if getattr(args, 'tenant_mode', None):
+            os.environ['TENANT_MODE'] = args.tenant_mode
+
+        from benchmarks.fakes import FakeBackend, FaultInjector, install_fakes
+        self.backend = FakeBackend(
+            s3_faults=FaultInjector(args.s3_latency, seed=args.seed),
+            textract_faults=FaultInjector(args.textract_latency, error_rate=args.textract_error_rate, seed=args.seed),
+            bedrock_faults=FaultInjector(args.bedrock_latency, jitter=args.bedrock_jitter,
+                                         error_rate=args.bedrock_error_rate, seed=args.seed),
+            opensearch_faults=FaultInjector(args.opensearch_latency, error_rate=args.opensearch_error_rate,
+                                            seed=args.seed),
+            transcribe_realtime_factor=getattr(args, 'transcribe_rtf', 0.0),
+        )
+
+        import ingest
+        import semantic_search
+        import rag_service
+        import query
+        import common.audio
+        import common.embeddings
+        import common.sidecars
+        self.ingest = ingest
+        self.semantic_search = semantic_search
+        self.rag_service = rag_service
+        self.query = query
+        self.audio = common.audio
+        self.restore = install_fakes(self.backend, [ingest, common.audio, common.embeddings, common.sidecars,
+                                                    semantic_search, rag_service, query])
+
+        self.corpus = make_corpus(args.corpus_size, args.seed, args.duplicate_rate)
+        self.tenants = tenant_names(getattr(args, 'tenants', 0))
+        if self.tenants:
+            self.corpus = [(f"{tenant_for(i, self.tenants)}/{filename}", text, topic)
+                           for i, (filename, text, topic) in enumerate(self.corpus)]
+        self.queries = make_queries(args.iterations, args.seed + 1)
+        self.processed_bucket = os.environ['PROCESSED_INGESTION_BUCKET']
+        self.ingestion_bucket = os.environ['INGESTION_BUCKET']
+        self.indexed = False
+
+    def upload_corpus(self):
+        for filename, text, _ in self.corpus:
+            self.backend.s3.put(self.processed_bucket, filename, text, 'image/jpeg')
+            self.backend.textract.texts[filename] = text
+
+    def upload_ingestion(self):
+        for filename, text, _ in self.corpus:
+            self.backend.s3.put(self.ingestion_bucket, filename, text, 'image/jpeg')
+            self.backend.textract.texts[filename] = text
+
+    def s3_event(self, key, bucket=None):
+        bucket = bucket or self.processed_bucket
+        return {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}]}
+
+    def ensure_indexed(self):
+        """Index the corpus through the ingest handler, once"""
+        if not self.indexed:
+            self.upload_corpus()
+            for filename, _, _ in self.corpus:
+                self.ingest.lambda_handler(self.s3_event(filename), None)
+            self.indexed = True
+
+
+def run_ingest(ctx, args):
+    ctx.upload_corpus()
+    calls_before = len(ctx.backend.bedrock.calls)
+
+    def operation(item):
+        result = ctx.ingest.lambda_handler(ctx.s3_event(item[0]), None)
+        return not result.get('failed')
+
+    stats = measure(operation, ctx.corpus, args.concurrency, args.track_allocations)
+    # Near-duplicates are linked without an embedding call
+    stats["embedding_calls"] = len(ctx.backend.bedrock.calls) - calls_before
+    ctx.indexed = True
+    return stats
+
+
+def run_ingest_staged(ctx, args):
+    """Both hops of the staged pipeline: ingestion bucket copy, then processed bucket OCR and indexing"""
+    ctx.upload_ingestion()
+    ctx.ingest.INGEST_MODE = 'staged'
+
+    def operation(item):
+        first = ctx.ingest.lambda_handler(ctx.s3_event(item[0], ctx.ingestion_bucket), None)
+        second = ctx.ingest.lambda_handler(ctx.s3_event(item[0]), None)
+        return not first.get('failed') and not second.get('failed')
+
+    stats = measure(operation, ctx.corpus, args.concurrency, args.track_allocations)
+    ctx.indexed = True
+    return stats
+
+
+def run_ingest_fused(ctx, args):
+    """Single-invocation fused ingest from the ingestion bucket"""
+    ctx.upload_ingestion()
+    ctx.ingest.INGEST_MODE = 'fused'
+
+    def operation(item):
+        result = ctx.ingest.lambda_handler(ctx.s3_event(item[0], ctx.ingestion_bucket), None)
+        return not result.get('failed')
+
+    try:
+        stats = measure(operation, ctx.corpus, args.concurrency, args.track_allocations)
+    finally:
+        ctx.ingest.INGEST_MODE = 'staged'
+    ctx.indexed = True
+    return stats
+
+
+def run_ingest_audio(ctx, args):
+    """
+    Long recordings split on pauses and transcribed TRANSCRIBE_CONCURRENCY
+    segments at a time, against one recording transcribed a segment at a time
+    """
+    recordings = [(f"recording_{i:03d}.wav", make_recording(args.audio_seconds, args.seed + i))
+                  for i in range(args.audio_files)]
+    for filename, data in recordings:
+        ctx.backend.s3.put(ctx.processed_bucket, filename, data, 'audio/wav')
+    jobs_before = ctx.backend.transcribe.started
+
+    def operation(item):
+        result = ctx.ingest.lambda_handler(ctx.s3_event(item[0]), None)
+        return not result.get('failed')
+
+    stats = measure(operation, recordings, args.concurrency, args.track_allocations)
+    stats["segments_per_recording"] = round((ctx.backend.transcribe.started - jobs_before) / len(recordings), 1)
+
+    ctx.backend.s3.put(ctx.processed_bucket, 'serial_recording.wav', recordings[0][1], 'audio/wav')
+    concurrency = ctx.audio.TRANSCRIBE_CONCURRENCY
+    ctx.audio.TRANSCRIBE_CONCURRENCY = 1
+    try:
+        start = time.perf_counter()
+        operation(('serial_recording.wav',))
+        stats["serial_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        ctx.audio.TRANSCRIBE_CONCURRENCY = concurrency
+    return stats
+
+
+def run_reindex(ctx, args):
+    """Rebuild every document from the text sidecars written at ingest, without OCR"""
+    ctx.ensure_indexed()
+    from benchmarks.fakes import install_fakes
+    from common.sidecars import list_sidecars
+    from image_conversion_service import reindex_from_sidecars
+    # The job imports ingest as part of the image_conversion_service package
+    restore = install_fakes(ctx.backend, [reindex_from_sidecars.ingest])
+    try:
+        keys = list(list_sidecars())
+        return measure(lambda key: reindex_from_sidecars.reindex_sidecar(key) != 'failed', keys,
+                       args.concurrency, args.track_allocations)
+    finally:
+        restore()
+
+
+def run_search(ctx, args):
+    ctx.ensure_indexed()
+
+    def operation(query):
+        _, status_code = ctx.semantic_search.search_documents(query, args.top_k, True)
+        return status_code == 200
+
+    return measure(operation, ctx.queries, args.concurrency, args.track_allocations)
+
+
+def run_search_filtered(ctx, args):
+    """
+    Vector search restricted to one topic's documents. Counts a query as
+    failed unless it returns a full top_k of matching hits, which only a
+    pre-filter inside the k-NN search guarantees.
+    """
+    ctx.ensure_indexed()
+    topics = sorted(TOPICS)
+    items = [(query, topics[i % len(topics)]) for i, query in enumerate(ctx.queries)]
+    # With tenants the keys start with the tenant; the large one has every topic
+    key_prefix = f"{ctx.tenants[0]}/" if ctx.tenants else ''
+
+    def operation(item):
+        query, topic = item
+        result, status_code = ctx.semantic_search.search_documents(
+            query, args.top_k, False, {'source_prefix': f"{key_prefix}{topic}_"})
+        hits = result.get('results', [])
+        return (status_code == 200 and len(hits) == args.top_k
+                and all(hit['filename'].startswith(f"{topic}_") for hit in hits))
+
+    return measure(operation, items, args.concurrency, args.track_allocations)
+
+
+def run_search_tenant(ctx, args):
+    """
+    Searches scoped to one small tenant. With TENANT_MODE index or routing
+    they use the tenant filter, which only touches the tenant's index or
+    shard; with tenancy off the same scope is a source_prefix filter over the
+    whole shared index. Counts a query as failed if a hit from another tenant
+    comes back.
+    """
+    ctx.ensure_indexed()
+    from common.tenancy import tenancy_enabled
+    small = ctx.tenants[1:]
+    items = [(query, small[i % len(small)]) for i, query in enumerate(ctx.queries)]
+
+    def operation(item):
+        query, tenant = item
+        filters = {'tenant': tenant} if tenancy_enabled() else {'source_prefix': f"{tenant}/"}
+        result, status_code = ctx.semantic_search.search_documents(query, args.top_k, True, filters)
+        return status_code == 200 and all(hit['metadata'].get('source_key', '').startswith(f"{tenant}/")
+                                          for hit in result.get('results', []))
+
+    return measure(operation, items, args.concurrency, args.track_allocations)
+
+
+def run_search_paged(ctx, args):
+    """
+    Page through each query's results with continuation tokens, --pages pages
+    of --top-k hits. Reports the latency of the first and the last page
+    separately; with cursor pagination they should be about the same.
+    """
+    ctx.ensure_indexed()
+    page_latencies = {}
+
+    def operation(query):
+        result, cursor = None, None
+        for page in range(1, args.pages + 1):
+            start = time.perf_counter()
+            if cursor:
+                result, status_code = ctx.semantic_search.search_page(cursor=cursor)
+            else:
+                result, status_code = ctx.semantic_search.search_page(query, args.top_k, True)
+            page_latencies.setdefault(page, []).append((time.perf_counter() - start) * 1000)
+            cursor = result.get('next_token')
+            if status_code != 200 or not cursor:
+                break
+        return status_code == 200
+
+    stats = measure(operation, ctx.queries, args.concurrency, args.track_allocations)
+    if page_latencies:
+        for page in (1, max(page_latencies)):
+            stats[f"page{page}_p50_ms"] = round(percentile(page_latencies[page], 50), 3)
+    return stats
+
+
+def run_batch_search(ctx, args):
+    ctx.ensure_indexed()
+    batches = [ctx.queries[i:i + args.batch_size] for i in range(0, len(ctx.queries), args.batch_size)]
+
+    def operation(batch):
+        _, status_code = ctx.semantic_search.search_documents_batch(batch, args.top_k, True)
+        return status_code == 200
+
+    stats = measure(operation, batches, args.concurrency, args.track_allocations)
+    stats["queries_per_s"] = round(len(ctx.queries) / stats["wall_s"], 2) if stats["wall_s"] else None
+    return stats
+
+
+def run_rag(ctx, args):
+    ctx.ensure_indexed()
+
+    def operation(query):
+        _, status_code = ctx.rag_service.rag_query(query, args.top_k)
+        return status_code == 200
+
+    return measure(operation, ctx.queries, args.concurrency, args.track_allocations)
+
+
+def run_rag_pipelined(ctx, args):
+    ctx.ensure_indexed()
+
+    def operation(query):
+        _, status_code = ctx.rag_service.rag_query_pipelined(query, args.top_k)
+        return status_code == 200
+
+    return measure(operation, ctx.queries, args.concurrency, args.track_allocations)
+
+
+def run_story(ctx, args):
+    ctx.ensure_indexed()
+    calls_before = len(ctx.backend.bedrock.calls)
+
+    def operation(query):
+        _, status_code = ctx.query.generate_story(query)
+        return status_code == 200
+
+    stats = measure(operation, ctx.queries, args.concurrency, args.track_allocations)
+    stats["bedrock_calls_per_story"] = round((len(ctx.backend.bedrock.calls) - calls_before) / len(ctx.queries), 1)
+    return stats
+
+
+WORKLOADS = {
+    'ingest': run_ingest,
+    'ingest_staged': run_ingest_staged,
+    'ingest_fused': run_ingest_fused,
+    'ingest_audio': run_ingest_audio,
+    'reindex': run_reindex,
+    'search': run_search,
+    'search_filtered': run_search_filtered,
+    'search_tenant': run_search_tenant,
+    'search_paged': run_search_paged,
+    'batch_search': run_batch_search,
+    'rag': run_rag,
+    'rag_pipelined': run_rag_pipelined,
+    'story': run_story,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=LAMBDA_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def print_summary(results):
+    print(f"\n{'workload':<16}{'ops':>6}{'err':>5}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in results.items():
+        print(f"{name:<16}{stats['operations']:>6}{stats['errors']:>5}{stats['throughput_ops_s'] or 0:>10}"
+              f"{stats['p50_ms'] or 0:>10}{stats['p95_ms'] or 0:>10}{stats['p99_ms'] or 0:>10}")
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Run offline benchmarks against in-process fakes')
+    parser.add_argument('--workload', '-w', choices=['all'] + list(WORKLOADS), default='all')
+    parser.add_argument('--iterations', '-n', type=int, default=100, help='Queries per query workload')
+    parser.add_argument('--corpus-size', type=int, default=200, help='Documents to ingest')
+    parser.add_argument('--concurrency', '-c', type=int, default=1)
+    parser.add_argument('--top-k', '-k', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=25, help='Queries per batch_search call')
+    parser.add_argument('--pages', type=int, default=5, help='Pages fetched per query by search_paged')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tenants', type=int, default=0,
+                        help='Spread the corpus over one large and N - 1 small tenants by key prefix')
+    parser.add_argument('--tenant-mode', choices=['none', 'index', 'routing'],
+                        help='TENANT_MODE for the services (default: the environment)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                        help='Share of the corpus that are near-duplicate rescans of earlier documents')
+    parser.add_argument('--audio-files', type=int, default=2, help='Recordings ingested by ingest_audio')
+    parser.add_argument('--audio-seconds', type=float, default=3600, help='Length of each ingest_audio recording')
+    parser.add_argument('--transcribe-rtf', type=float, default=0.002,
+                        help='Fake transcription time per second of audio')
+    parser.add_argument('--track-allocations', action='store_true', help='Measure allocations with tracemalloc')
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='Seconds per fake S3 call')
+    parser.add_argument('--textract-latency', type=float, default=0.0)
+    parser.add_argument('--textract-error-rate', type=float, default=0.0)
+    parser.add_argument('--bedrock-latency', type=float, default=0.0)
+    parser.add_argument('--bedrock-jitter', type=float, default=0.0, help='Extra uniform random Bedrock latency')
+    parser.add_argument('--bedrock-error-rate', type=float, default=0.0)
+    parser.add_argument('--opensearch-latency', type=float, default=0.0)
+    parser.add_argument('--opensearch-error-rate', type=float, default=0.0)
+    parser.add_argument('--output', '-o', type=str, default='bench_results.json', help='JSON results file')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show log output from the services')
+    args = parser.parse_args()
+
+    ctx = BenchmarkContext(args)
+    names = list(WORKLOADS) if args.workload == 'all' else [args.workload]
+    if args.tenants < 2:
+        if args.workload == 'search_tenant':
+            parser.error('search_tenant needs --tenants 2 or more')
+        names = [name for name in names if name != 'search_tenant']
+    results = {}
+    try:
+        for name in names:
+            print(f"Running {name} benchmark...")
+            # The services log every step; keep that out of the timings unless asked for
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                results[name] = WORKLOADS[name](ctx, args)
+    finally:
+        ctx.restore()
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_summary(results)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
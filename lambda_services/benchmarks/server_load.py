@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Load test comparing the per-request Lambda handlers with the ASGI server.
+
+Replays a skewed query mix (a few popular queries and a long tail, as in real
+search traffic) at a fixed concurrency against the in-process fakes, with
+injected Bedrock and OpenSearch latency:
+
+- handler: every request calls lambda_handler independently, as separate
+  Lambda invocations do, with no query embedding cache.
+- server: requests go through query_function/server.py's ASGI app, sharing
+  the embedding cache, coalescing identical in-flight requests and reusing
+  recent responses.
+
+Reports throughput, latency percentiles and the Bedrock calls each mode made.
+
+    python benchmarks/server_load.py --requests 2000 --concurrency 32 --workload search
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import contextlib
+import io
+
+LAMBDA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [LAMBDA_ROOT, os.path.join(LAMBDA_ROOT, 'query_function')]
+
+from benchmarks.run_benchmarks import BenchmarkContext, make_queries, measure, git_commit
+
+ROUTES = {'search': '/search', 'rag': '/rag'}
+
+
+def query_mix(args):
+    """args.requests queries drawn from args.unique_queries with Zipf-like popularity"""
+    rng = random.Random(args.seed)
+    queries = make_queries(args.unique_queries, args.seed + 1)
+    weights = [1.0 / (rank + 1) ** args.skew for rank in range(len(queries))]
+    return rng.choices(queries, weights=weights, k=args.requests)
+
+
+def event_for(route, query):
+    return {'httpMethod': 'POST', 'path': route, 'body': json.dumps({'query': query, 'top_k': 5})}
+
+
+async def call_app(app, route, query):
+    """Send one POST through the ASGI app and return the status code"""
+    body = json.dumps({'query': query, 'top_k': 5}).encode()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = {}
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+
+    scope = {'type': 'http', 'method': 'POST', 'path': route, 'query_string': b'', 'headers': []}
+    await app(scope, receive, send)
+    return status.get('code')
+
+
+def run_handler_mode(ctx, workload, queries, args):
+    import common.embeddings
+    common.embeddings.QUERY_EMBEDDING_CACHE_SIZE = 0
+    handler = ctx.semantic_search.lambda_handler if workload == 'search' else ctx.rag_service.lambda_handler
+
+    def operation(query):
+        return handler(event_for(ROUTES[workload], query), None)['statusCode'] == 200
+
+    return measure(operation, queries, args.concurrency)
+
+
+def run_server_mode(ctx, workload, queries, args):
+    import common.embeddings
+    import server
+    common.embeddings.QUERY_EMBEDDING_CACHE_SIZE = args.embedding_cache_size
+    common.embeddings._query_embedding_cache.clear()
+    server.response_cache.clear()
+
+    # One event loop, as in a server process; the load generator threads submit to it
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def operation(query):
+        future = asyncio.run_coroutine_threadsafe(call_app(server.app, ROUTES[workload], query), loop)
+        return future.result() == 200
+
+    try:
+        stats = measure(operation, queries, args.concurrency)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+    stats["coalesced"] = server.singleflight.coalesced
+    stats["cache_hits"] = server.response_cache.hits
+    stats["handler_calls"] = server.stats['handler_calls']
+    server.singleflight.coalesced = server.response_cache.hits = server.stats['handler_calls'] = 0
+    return stats
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Compare the Lambda handlers with the ASGI server under load')
+    parser.add_argument('--workload', '-w', choices=['search', 'rag', 'all'], default='all')
+    parser.add_argument('--requests', '-n', type=int, default=1000, help='Requests per mode and workload')
+    parser.add_argument('--unique-queries', type=int, default=200, help='Distinct queries in the mix')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of query popularity')
+    parser.add_argument('--concurrency', '-c', type=int, default=32)
+    parser.add_argument('--corpus-size', type=int, default=200)
+    parser.add_argument('--embedding-cache-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bedrock-latency', type=float, default=0.05, help='Seconds per fake Bedrock call')
+    parser.add_argument('--opensearch-latency', type=float, default=0.02, help='Seconds per fake OpenSearch call')
+    parser.add_argument('--output', '-o', type=str, default='server_load_results.json', help='JSON results file')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show log output from the services')
+    args = parser.parse_args()
+
+    # BenchmarkContext reads the fault settings run_benchmarks would pass
+    context_args = argparse.Namespace(
+        corpus_size=args.corpus_size, iterations=1, seed=args.seed, duplicate_rate=0.0,
+        s3_latency=0.0, textract_latency=0.0, textract_error_rate=0.0,
+        bedrock_latency=args.bedrock_latency, bedrock_jitter=0.0, bedrock_error_rate=0.0,
+        opensearch_latency=args.opensearch_latency, opensearch_error_rate=0.0,
+    )
+    ctx = BenchmarkContext(context_args)
+    queries = query_mix(args)
+    workloads = ['search', 'rag'] if args.workload == 'all' else [args.workload]
+
+    results = {}
+    try:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            ctx.ensure_indexed()
+            for workload in workloads:
+                for mode, run in (('handler', run_handler_mode), ('server', run_server_mode)):
+                    calls_before = len(ctx.backend.bedrock.calls)
+                    stats = run(ctx, workload, queries, args)
+                    stats["bedrock_calls"] = len(ctx.backend.bedrock.calls) - calls_before
+                    results[f"{workload}_{mode}"] = stats
+    finally:
+        ctx.restore()
+
+    print(f"\n{'run':<18}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'bedrock':>10}{'err':>6}")
+    for name, stats in results.items():
+        print(f"{name:<18}{stats['throughput_ops_s']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{stats['bedrock_calls']:>10}{stats['errors']:>6}")
+    for workload in workloads:
+        handler, server = results[f"{workload}_handler"], results[f"{workload}_server"]
+        if handler['throughput_ops_s']:
+            print(f"{workload}: server throughput {server['throughput_ops_s'] / handler['throughput_ops_s']:.1f}x")
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "git_commit": git_commit(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
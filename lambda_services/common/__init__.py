@@ -0,0 +1,3 @@
+"""
+Shared helpers used by both the ingestion and query Lambda functions.
+"""
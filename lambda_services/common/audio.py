@@ -0,0 +1,498 @@
+"""
+Audio transcription for ingest.
+
+Recordings are split into segments of about AUDIO_SEGMENT_SECONDS. Each cut
+is placed in a pause within AUDIO_CUT_WINDOW seconds of the boundary, so it
+falls between words rather than through one. The segments are transcribed
+TRANSCRIBE_CONCURRENCY at a time and stitched back together in order, with
+every segment's timestamps shifted by its start in the recording. An hour-long
+recording then takes about as long as its slowest segment, instead of one job
+over the whole file that would outlast the Lambda timeout.
+
+WAV files are read with the standard library. Other formats are decoded to
+16 kHz mono WAV with ffmpeg when it is available (AUDIO_FFMPEG, e.g. from a
+Lambda layer). Without it, MP3s are cut at frame boundaries every
+AUDIO_SEGMENT_SECONDS and other formats go to the transcriber whole.
+
+Transcribers are pluggable (register_transcriber, AUDIO_TRANSCRIBER). The
+default runs Amazon Transcribe batch jobs on segments uploaded under
+AUDIO_WORK_PREFIX. Job names are derived from the object's bucket, key and
+size and the segment's time range, not its ETag, which changes when a failed
+file is copied back for a retry. An ingest retried after running out of time
+therefore picks up the jobs that already finished instead of starting them
+again.
+"""
+
+import os
+import io
+import re
+import json
+import time
+import wave
+import shutil
+import hashlib
+import tempfile
+import functools
+import subprocess
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+
+from common.tracing import span
+from common.rate_limit import get_limiter
+
+# Formats Amazon Transcribe accepts, as file extensions
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a', '.webm')
+
+# Segmentation: target length, how far either side of it a pause is looked
+# for, and the level (dBFS over LEVEL_WINDOW seconds) below which audio is a pause
+AUDIO_SEGMENT_SECONDS = float(os.environ.get('AUDIO_SEGMENT_SECONDS', 300))
+AUDIO_CUT_WINDOW = float(os.environ.get('AUDIO_CUT_WINDOW', 30))
+AUDIO_SILENCE_DB = float(os.environ.get('AUDIO_SILENCE_DB', -40))
+LEVEL_WINDOW = 0.25
+AUDIO_FFMPEG = os.environ.get('AUDIO_FFMPEG') or shutil.which('ffmpeg') or (
+    '/opt/bin/ffmpeg' if os.path.exists('/opt/bin/ffmpeg') else None)
+
+# Transcription: segments in flight at once, the transcriber to use and where
+# segments and transcripts are kept while their jobs run
+TRANSCRIBE_CONCURRENCY = int(os.environ.get('TRANSCRIBE_CONCURRENCY', 12))
+AUDIO_TRANSCRIBER = os.environ.get('AUDIO_TRANSCRIBER', 'transcribe')
+AUDIO_WORK_BUCKET = os.environ.get('AUDIO_WORK_BUCKET') or os.environ.get('PROCESSED_INGESTION_BUCKET')
+AUDIO_WORK_PREFIX = os.environ.get('AUDIO_WORK_PREFIX', 'audio-work/')
+# A language code, or 'auto' to identify the language of each segment
+TRANSCRIBE_LANGUAGE = os.environ.get('TRANSCRIBE_LANGUAGE', 'en-US')
+TRANSCRIBE_POLL_INTERVAL = float(os.environ.get('TRANSCRIBE_POLL_INTERVAL', 5))
+# Seconds before the invocation ends that transcription gives up, leaving
+# time to record the failure so the file is retried
+AUDIO_DEADLINE_MARGIN = float(os.environ.get('AUDIO_DEADLINE_MARGIN', 30))
+
+# Transcript lines end at a sentence, a pause or this many words
+LINE_MAX_WORDS = 40
+LINE_PAUSE_SECONDS = 2.0
+
+s3_client = boto3.client('s3')
+transcribe_client = boto3.client('transcribe')
+# StartTranscriptionJob has its own request rate quota
+transcribe_limiter = get_limiter('transcribe')
+
+# Bitrates in kbit/s by (MPEG version 1 or 2, layer), and sample rates by version
+MP3_BITRATES = {
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+
+
+def is_audio(key):
+    return key.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def is_audio_work_key(key):
+    """Segments and transcripts written while a recording is transcribed"""
+    return key.startswith(AUDIO_WORK_PREFIX)
+
+
+def pcm_samples(data, width, channels):
+    """Mono float samples in [-1, 1] from interleaved little-endian PCM frames"""
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16
+        samples = np.where(values >= 1 << 23, values - (1 << 24), values).astype(np.float32) / (1 << 23)
+    else:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2 ** 31
+    return samples.reshape(-1, channels).mean(axis=1)
+
+
+def read_levels(path):
+    """
+    Level in dBFS of every LEVEL_WINDOW of a PCM WAV file and its duration in
+    seconds, read a block at a time. None if the file isn't PCM WAV.
+    """
+    try:
+        with wave.open(path, 'rb') as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            window = max(1, int(rate * LEVEL_WINDOW))
+            levels = []
+            while True:
+                # About a minute and a half of audio per read
+                samples = pcm_samples(wav.readframes(window * 400), width, channels)
+                if not samples.size:
+                    break
+                blocks = [samples[:samples.size - samples.size % window].reshape(-1, window)]
+                if samples.size % window:
+                    blocks.append(samples[samples.size - samples.size % window:].reshape(1, -1))
+                for block in blocks:
+                    rms = np.sqrt(np.mean(np.square(block), axis=1))
+                    levels.extend((20 * np.log10(np.maximum(rms, 1e-10))).tolist())
+            return levels, wav.getnframes() / rate
+    except (wave.Error, EOFError) as e:
+        print(f"Could not read {os.path.basename(path)} as PCM WAV: {str(e)}")
+        return None
+
+
+def plan_segments(levels, duration, window=LEVEL_WINDOW):
+    """
+    (start, end) seconds of each segment. A cut goes in the pause nearest the
+    AUDIO_SEGMENT_SECONDS boundary within AUDIO_CUT_WINDOW of it, or at the
+    quietest point there if nothing is below AUDIO_SILENCE_DB.
+    """
+    segments = []
+    start = 0.0
+    while duration - start > AUDIO_SEGMENT_SECONDS + AUDIO_CUT_WINDOW:
+        target = start + AUDIO_SEGMENT_SECONDS
+        first = max(int((target - AUDIO_CUT_WINDOW) / window), int(start / window) + 1)
+        last = min(int((target + AUDIO_CUT_WINDOW) / window), len(levels) - 1)
+        candidates = range(first, last + 1)
+        pauses = [i for i in candidates if levels[i] <= AUDIO_SILENCE_DB]
+        if pauses:
+            best = min(pauses, key=lambda i: abs((i + 0.5) * window - target))
+        else:
+            best = min(candidates, key=lambda i: levels[i])
+        cut = (best + 0.5) * window
+        segments.append((start, cut))
+        start = cut
+    segments.append((start, duration))
+    return segments
+
+
+def wav_segment(path, start, end):
+    """WAV file bytes of the frames between start and end seconds"""
+    with wave.open(path, 'rb') as wav:
+        params = wav.getparams()
+        first = int(round(start * params.framerate))
+        wav.setpos(first)
+        data = wav.readframes(min(int(round(end * params.framerate)), params.nframes) - first)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setparams(params)
+        out.writeframes(data)
+    return buffer.getvalue()
+
+
+def decode_to_wav(path):
+    """16 kHz mono PCM WAV copy of a recording made with ffmpeg, or None without ffmpeg"""
+    if not AUDIO_FFMPEG:
+        return None
+    output = path + '.decoded.wav'
+    try:
+        with span('audio_decode'):
+            subprocess.run([AUDIO_FFMPEG, '-nostdin', '-v', 'error', '-y', '-i', path,
+                            '-ac', '1', '-ar', '16000', '-c:a', 'pcm_s16le', output],
+                           check=True, capture_output=True, timeout=600)
+        return output
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"ffmpeg could not decode {os.path.basename(path)}: {str(e)}")
+        return None
+
+
+def mp3_frame(header):
+    """(length in bytes, duration in seconds) of an MPEG layer II/III frame header, or (0, 0)"""
+    if header >> 21 != 0x7ff:
+        return 0, 0
+    version = {0: 25, 2: 2, 3: 1}.get(header >> 19 & 3)
+    layer = {1: 3, 2: 2}.get(header >> 17 & 3)
+    bitrate_index = header >> 12 & 0xf
+    rate_index = header >> 10 & 3
+    # Free-format bitrates and layer I aren't supported
+    if not version or not layer or bitrate_index in (0, 15) or rate_index == 3:
+        return 0, 0
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    samples = 1152 if layer == 2 or version == 1 else 576
+    return samples // 8 * bitrate // sample_rate + (header >> 9 & 1), samples / sample_rate
+
+
+def mp3_frames(data):
+    """(offset, duration) of each audio frame of an MP3 file, skipping ID3 tags and junk"""
+    position = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+        position = 10 + size + (10 if data[5] & 0x10 else 0)
+    frames = []
+    while position + 4 <= len(data):
+        length, seconds = mp3_frame(int.from_bytes(data[position:position + 4], 'big'))
+        if not length:
+            position += 1
+            continue
+        frames.append((position, seconds))
+        position += length
+    return frames
+
+
+def file_range(path, first, last):
+    with open(path, 'rb') as f:
+        f.seek(first)
+        return f.read(last - first)
+
+
+def split_mp3(path):
+    """Fixed-length (start, end, read) segments of an MP3, cut between frames"""
+    with open(path, 'rb') as f:
+        frames = mp3_frames(f.read())
+    if not frames:
+        return []
+    duration = sum(seconds for _, seconds in frames)
+    segments = []
+    start = elapsed = 0.0
+    first = frames[0][0]
+    for offset, seconds in frames:
+        # A short remainder stays with the last segment, as in plan_segments
+        if elapsed - start >= AUDIO_SEGMENT_SECONDS and duration - elapsed > AUDIO_CUT_WINDOW:
+            segments.append((start, elapsed, functools.partial(file_range, path, first, offset)))
+            start, first = elapsed, offset
+        elapsed += seconds
+    segments.append((start, elapsed, functools.partial(file_range, path, first, os.path.getsize(path))))
+    return segments
+
+
+def split_recording(path, extension):
+    """
+    Cut a downloaded recording into segments. Returns the media format of the
+    segments and a list of (start, end, read): times in seconds and a function
+    returning the segment's bytes, so only segments in flight are in memory.
+    """
+    wav_path = path if extension == '.wav' else None
+    measured = wav_path and read_levels(wav_path)
+    if not measured:
+        wav_path = decode_to_wav(path)
+        measured = wav_path and read_levels(wav_path)
+    if measured:
+        levels, duration = measured
+        return 'wav', [(start, end, functools.partial(wav_segment, wav_path, start, end))
+                       for start, end in plan_segments(levels, duration)]
+
+    if extension == '.mp3':
+        segments = split_mp3(path)
+        if segments:
+            return 'mp3', segments
+    print(f"Transcribing {os.path.basename(path)} as a single segment")
+    # The end is unknown until the transcript is back
+    return extension[1:], [(0.0, None, functools.partial(file_range, path, 0, os.path.getsize(path)))]
+
+
+class Transcriber:
+    """
+    Turns one segment of audio into timed words. transcribe() gets a function
+    returning the segment's bytes, its media format and a name unique to the
+    recording and segment that stays the same across retries. It returns
+    [{"text", "start", "end", "conf"}] with times in seconds from the start of
+    the segment and punctuation attached to the word before it, and raises
+    TimeoutError if the deadline (epoch seconds) passes first.
+    """
+
+    # Recorded as the source of the sidecar pages
+    source = 'transcriber'
+
+    def transcribe(self, read_audio, media_format, name, deadline=None):
+        raise NotImplementedError
+
+    def cleanup(self, name):
+        """Remove anything kept for a segment once the recording is transcribed"""
+
+
+class AmazonTranscriber(Transcriber):
+    """Amazon Transcribe batch jobs on segments uploaded to AUDIO_WORK_BUCKET"""
+
+    source = 'transcribe'
+
+    def media_key(self, name, media_format):
+        return f"{AUDIO_WORK_PREFIX}{name}.{media_format}"
+
+    def output_key(self, name):
+        return f"{AUDIO_WORK_PREFIX}{name}.json"
+
+    def get_job(self, name):
+        try:
+            return transcribe_client.get_transcription_job(TranscriptionJobName=name)['TranscriptionJob']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('BadRequestException', 'NotFoundException'):
+                return None
+            raise
+
+    def start_job(self, read_audio, media_format, name):
+        media_key = self.media_key(name, media_format)
+        with span('s3_put'):
+            s3_client.put_object(Bucket=AUDIO_WORK_BUCKET, Key=media_key, Body=read_audio())
+        params = {
+            'TranscriptionJobName': name,
+            'Media': {'MediaFileUri': f"s3://{AUDIO_WORK_BUCKET}/{media_key}"},
+            'MediaFormat': media_format,
+            'OutputBucketName': AUDIO_WORK_BUCKET,
+            'OutputKey': self.output_key(name),
+        }
+        if TRANSCRIBE_LANGUAGE == 'auto':
+            params['IdentifyLanguage'] = True
+        else:
+            params['LanguageCode'] = TRANSCRIBE_LANGUAGE
+        with span('transcribe_start'):
+            transcribe_limiter.acquire()
+            try:
+                return transcribe_client.start_transcription_job(**params)['TranscriptionJob']
+            except ClientError as e:
+                # A redelivered event for the same file got there first
+                if e.response['Error']['Code'] != 'ConflictException':
+                    raise
+                return self.get_job(name)
+
+    def transcribe(self, read_audio, media_format, name, deadline=None):
+        job = self.get_job(name)
+        if job and job['TranscriptionJobStatus'] == 'FAILED':
+            transcribe_client.delete_transcription_job(TranscriptionJobName=name)
+            job = None
+        if job is None:
+            job = self.start_job(read_audio, media_format, name)
+        else:
+            print(f"Resuming transcription job {name}")
+
+        with span('transcribe_poll'):
+            while job['TranscriptionJobStatus'] in ('QUEUED', 'IN_PROGRESS'):
+                if deadline and time.time() + TRANSCRIBE_POLL_INTERVAL > deadline:
+                    raise TimeoutError(f"Transcription job {name} did not finish in time")
+                time.sleep(TRANSCRIBE_POLL_INTERVAL)
+                job = transcribe_client.get_transcription_job(TranscriptionJobName=name)['TranscriptionJob']
+        if job['TranscriptionJobStatus'] != 'COMPLETED':
+            # Transcribe rejects audio it can't read; retrying won't help
+            raise ValueError(f"Transcription job {name} failed: {job.get('FailureReason')}")
+
+        response = s3_client.get_object(Bucket=AUDIO_WORK_BUCKET, Key=self.output_key(name))
+        return words_from_transcript(json.loads(response['Body'].read()))
+
+    def cleanup(self, name):
+        try:
+            job = self.get_job(name)
+            if job:
+                transcribe_client.delete_transcription_job(TranscriptionJobName=name)
+                media_key = job.get('Media', {}).get('MediaFileUri', '').split('/', 3)[-1]
+                if media_key:
+                    s3_client.delete_object(Bucket=AUDIO_WORK_BUCKET, Key=media_key)
+            s3_client.delete_object(Bucket=AUDIO_WORK_BUCKET, Key=self.output_key(name))
+        except Exception as e:
+            print(f"Error cleaning up transcription job {name}: {str(e)}")
+
+
+TRANSCRIBERS = {'transcribe': AmazonTranscriber}
+
+
+def register_transcriber(name, transcriber_class):
+    """Make a Transcriber subclass available as AUDIO_TRANSCRIBER=name"""
+    TRANSCRIBERS[name] = transcriber_class
+
+
+def get_transcriber(name=None):
+    name = name or AUDIO_TRANSCRIBER
+    if name not in TRANSCRIBERS:
+        raise ValueError(f"Unknown transcriber {name}; registered: {', '.join(sorted(TRANSCRIBERS))}")
+    return TRANSCRIBERS[name]()
+
+
+def words_from_transcript(result):
+    """Timed words from an Amazon Transcribe transcript JSON"""
+    words = []
+    for item in result.get('results', {}).get('items', []):
+        alternative = (item.get('alternatives') or [{}])[0]
+        content = alternative.get('content', '')
+        if item.get('type') == 'punctuation':
+            if words:
+                words[-1]['text'] += content
+            continue
+        words.append({
+            "text": content,
+            "start": float(item['start_time']),
+            "end": float(item['end_time']),
+            "conf": round(float(alternative.get('confidence', 0)) * 100, 1),
+        })
+    return words
+
+
+def transcript_lines(words, offset=0.0):
+    """
+    Group timed words into lines of a sentence each, also ending a line at a
+    pause or LINE_MAX_WORDS, with times shifted by offset into the recording
+    """
+    lines = []
+    current = []
+
+    def flush():
+        if current:
+            lines.append({
+                "text": " ".join(word["text"] for word in current),
+                "start": round(offset + current[0]["start"], 2),
+                "end": round(offset + current[-1]["end"], 2),
+                "conf": round(sum(word.get("conf", 0) for word in current) / len(current), 1),
+            })
+            current.clear()
+
+    for word in words:
+        if current and (word["start"] - current[-1]["end"] > LINE_PAUSE_SECONDS or len(current) >= LINE_MAX_WORDS):
+            flush()
+        current.append(word)
+        if word["text"].endswith(('.', '?', '!')):
+            flush()
+    flush()
+    return lines
+
+
+def download(bucket, key, path):
+    """Stream an object to a local file; returns its size in bytes"""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: response['Body'].read(1 << 20), b''):
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def transcribe_recording(bucket, key, deadline=None):
+    """
+    Transcribe an audio object. Returns one sidecar page per segment, with its
+    start and end in seconds and one timed line per sentence. deadline is
+    when the invocation ends (epoch seconds); transcription raises
+    TimeoutError AUDIO_DEADLINE_MARGIN before it.
+    """
+    extension = os.path.splitext(key)[1].lower()
+    transcriber = get_transcriber()
+    if deadline:
+        deadline -= AUDIO_DEADLINE_MARGIN
+
+    with tempfile.TemporaryDirectory(prefix='audio-') as workdir:
+        path = os.path.join(workdir, 'recording' + extension)
+        with span('s3_download'):
+            size = download(bucket, key, path)
+        with span('audio_split'):
+            media_format, segments = split_recording(path, extension)
+        print(f"Transcribing {key} in {len(segments)} segments")
+
+        stem = re.sub(r'[^0-9A-Za-z._-]', '-', os.path.splitext(os.path.basename(key))[0])[:100]
+        names = [
+            f"{stem}-" + hashlib.sha1(f"{bucket}/{key}/{size}/{start}/{end}/{media_format}".encode()).hexdigest()[:20]
+            for start, end, _ in segments
+        ]
+
+        def transcribe_segment(position):
+            start, end, read_audio = segments[position]
+            lines = transcript_lines(transcriber.transcribe(read_audio, media_format, names[position], deadline), start)
+            if end is None:
+                end = lines[-1]["end"] if lines else start
+            return {"page": position + 1, "source": transcriber.source, "start": round(start, 2),
+                    "end": round(end, 2), "lines": lines}
+
+        workers = max(1, min(TRANSCRIBE_CONCURRENCY, len(segments)))
+        with span('audio_transcribe', segments=len(segments)):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pages = list(executor.map(
+                    lambda position: contextvars.copy_context().run(transcribe_segment, position),
+                    range(len(segments))
+                ))
+                list(executor.map(transcriber.cleanup, names))
+    return pages
+
@@ -0,0 +1,155 @@
+"""
+Near-duplicate detection for extracted document text with MinHash and LSH.
+
+Each document's text is normalised and cut into character shingles, and a
+MinHash signature of DEDUP_NUM_PERM values estimates the Jaccard similarity of
+two shingle sets. The signature is split into DEDUP_BANDS bands; every band is
+hashed into an `lsh_bands` keyword on the indexed document, so the LSH index
+lives in OpenSearch next to the documents it describes. Finding candidates is
+one query on those keywords that scores each document by the number of bands
+it shares, and the DEDUP_MAX_CANDIDATES best candidates are confirmed by
+comparing the stored signatures against DEDUP_THRESHOLD.
+
+With the default 128 permutations in 16 bands of 8 rows, documents with a
+Jaccard similarity of 0.9 share at least one band 99.99% of the time, 0.8
+about 95% of the time, and pairs at 0.5 only ~6% of the time.
+"""
+
+import os
+import re
+import json
+import zlib
+import hashlib
+import numpy as np
+import requests
+
+from common.tenancy import routing_param
+
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+# 'link' indexes a duplicate as a pointer to the original without embedding it; 'skip' doesn't index it at all
+DEDUP_ACTION = os.environ.get('DEDUP_ACTION', 'link')
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.8))
+DEDUP_NUM_PERM = int(os.environ.get('DEDUP_NUM_PERM', 128))
+DEDUP_BANDS = int(os.environ.get('DEDUP_BANDS', 16))
+DEDUP_SHINGLE_SIZE = int(os.environ.get('DEDUP_SHINGLE_SIZE', 5))
+# Shorter texts (a stamp, a page number) are too generic to call duplicates
+DEDUP_MIN_CHARS = int(os.environ.get('DEDUP_MIN_CHARS', 200))
+# Candidates compared per lookup, those sharing the most bands first
+DEDUP_MAX_CANDIDATES = int(os.environ.get('DEDUP_MAX_CANDIDATES', 20))
+
+_MASK_32 = np.uint64(0xFFFFFFFF)
+
+# Fixed seed so signatures stay comparable across containers and deployments
+_rng = np.random.RandomState(1)
+_PERM_A = (_rng.randint(0, 2 ** 32, DEDUP_NUM_PERM, dtype=np.uint64) << np.uint64(32)) \
+    | _rng.randint(0, 2 ** 32, DEDUP_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = (_rng.randint(0, 2 ** 32, DEDUP_NUM_PERM, dtype=np.uint64) << np.uint64(32)) \
+    | _rng.randint(0, 2 ** 32, DEDUP_NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(text):
+    """Lowercase alphanumerics separated by single spaces, so OCR spacing and punctuation noise don't matter"""
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def shingle_hashes(text):
+    """32-bit hashes of the distinct character shingles of the normalised text"""
+    normalized = normalize_text(text)
+    size = DEDUP_SHINGLE_SIZE
+    if len(normalized) <= size:
+        shingles = {normalized} if normalized else set()
+    else:
+        shingles = {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(text):
+    """
+    MinHash signature of the text, as a list of DEDUP_NUM_PERM ints.
+    Each permutation is a multiply-shift hash of the shingle hashes, which
+    wraps around in 64-bit arithmetic by design.
+    """
+    hashes = shingle_hashes(text)
+    if not len(hashes):
+        return None
+    with np.errstate(over='ignore'):
+        permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) >> np.uint64(32)
+    return (permuted & _MASK_32).min(axis=1).astype(np.int64).tolist()
+
+
+def lsh_bands(signature):
+    """One keyword per band of the signature, e.g. 'b3-5f1c2a9e0b7d4c61'"""
+    rows = len(signature) // DEDUP_BANDS
+    bands = []
+    for band in range(DEDUP_BANDS):
+        values = signature[band * rows:(band + 1) * rows]
+        digest = hashlib.blake2b(','.join(map(str, values)).encode(), digest_size=8).hexdigest()
+        bands.append(f"b{band}-{digest}")
+    return bands
+
+
+def estimate_similarity(first, second):
+    """Estimated Jaccard similarity: the share of signature positions that agree"""
+    if not first or not second or len(first) != len(second):
+        return 0.0
+    return float(np.mean(np.asarray(first) == np.asarray(second)))
+
+
+def fingerprint(text):
+    """
+    Signature and band keywords for a document, or None when the text is too
+    short to deduplicate. The result is stored on the document as-is.
+    """
+    if len(text.strip()) < DEDUP_MIN_CHARS:
+        return None
+    signature = minhash_signature(text)
+    if signature is None:
+        return None
+    return {"minhash": signature, "lsh_bands": lsh_bands(signature)}
+
+
+def find_duplicate(endpoint, index, fields, exclude_id=None, tenant=None, routing=None, session=None):
+    """
+    Look up the closest earlier document sharing an LSH band with `fields`
+    (the output of fingerprint). Returns (doc_id, filename, similarity) for
+    the best match at or above DEDUP_THRESHOLD, otherwise None. Lookup errors
+    are logged and treated as no match, so ingest never fails because of them.
+    With a tenant, only that tenant's documents are matched. session is the
+    caller's pooled requests session, if it has one.
+    """
+    query = {
+        "size": DEDUP_MAX_CANDIDATES,
+        "_source": ["filename", "minhash"],
+        "query": {
+            "bool": {
+                # One point per shared band, so the likeliest duplicates come first
+                "should": [{"constant_score": {"filter": {"term": {"lsh_bands": band}}}}
+                           for band in fields["lsh_bands"]],
+                "minimum_should_match": 1,
+                "filter": [{"term": {"tenant": tenant}}] if tenant else [],
+                # Linked duplicates carry no signature, so only originals are matched
+                "must_not": [{"exists": {"field": "duplicate_of"}}]
+            }
+        }
+    }
+    try:
+        response = (session or requests).post(f"{endpoint}/{index}/_search{routing_param(routing)}",
+                                 headers={"Content-Type": "application/json"}, data=json.dumps(query))
+        if response.status_code == 404:
+            return None
+        if response.status_code >= 300:
+            print(f"Duplicate lookup failed: {response.status_code} - {response.text}")
+            return None
+        hits = response.json().get('hits', {}).get('hits', [])
+    except requests.exceptions.RequestException as e:
+        print(f"Duplicate lookup failed: {str(e)}")
+        return None
+
+    best = None
+    for hit in hits:
+        if hit['_id'] == exclude_id:
+            continue
+        similarity = estimate_similarity(fields["minhash"], hit['_source'].get('minhash'))
+        if similarity >= DEDUP_THRESHOLD and (best is None or similarity > best[2]):
+            best = (hit['_id'], hit['_source'].get('filename'), similarity)
+    return best
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Zero-downtime embedding model migration.
+
+1. Set EMBEDDING_DUAL_WRITE_MODEL_ID on the ingest and query functions, so
+   new documents are written to both the live alias and the new model's
+   index, and queries may use the new model. This has to happen before the
+   swap: the query path refuses an index model it isn't configured for.
+2. Run `create` then `backfill` to re-embed existing documents into the new index.
+3. Run `swap` to atomically move the read alias to the new index. The query
+   path reads the model from the index _meta, so it switches with the alias
+   within INDEX_MODEL_CACHE_TTL; ingest then writes only the new model.
+4. Make the new model the active EMBEDDING_MODEL_ID and clear the dual-write setting.
+"""
+
+import os
+import sys
+import json
+import argparse
+import requests
+
+from common.embeddings import (
+    get_embeddings, embedding_fields, create_index, swap_alias,
+    index_name_for, model_dimension, normalize_endpoint, INDEX_ALIAS
+)
+
+
+def rejected_positions(response, batch_size):
+    """Positions of the documents in a _bulk request that were not written: all of them if the request failed"""
+    if response.status_code >= 300:
+        print(f"Bulk write failed: {response.status_code} - {response.text[:500]}")
+        return set(range(batch_size))
+    result = json.loads(response.text)
+    if not result.get("errors"):
+        return set()
+    rejected = {}
+    for position, entry in enumerate(result.get("items", [])):
+        for item in entry.values():
+            if item.get("status", 200) >= 300 or item.get("error"):
+                rejected[position] = item
+    if rejected:
+        print(f"Bulk write rejected {len(rejected)} documents, e.g. {json.dumps(next(iter(rejected.values())))[:500]}")
+    return set(rejected)
+
+
+def bulk_rejections(response, batch_size):
+    """Documents of a _bulk request that were not written: every one if the request failed"""
+    return len(rejected_positions(response, batch_size))
+
+
+def backfill(endpoint, source, target, model_id, dimension, batch_size=100, copy_same_model=False):
+    """
+    Re-embed every document in source with model_id and bulk-write it into target.
+    Documents already embedded with the target model (e.g. by dual-write) are skipped,
+    or with copy_same_model copied with their stored vectors, e.g. when rebuilding
+    an index with a new mapping for the same model. Documents the bulk write
+    rejects count as failed; a failed search or scroll raises.
+    """
+    base = normalize_endpoint(endpoint)
+    headers = {"Content-Type": "application/json"}
+    copied = skipped = failed = 0
+
+    query = {
+        "size": batch_size,
+        "query": {"match_all": {}}
+    }
+    if not copy_same_model:
+        query["_source"] = {"excludes": ["vector"]}
+    response = requests.post(f"{base}/{source}/_search?scroll=5m", headers=headers, data=json.dumps(query))
+    if response.status_code >= 300:
+        raise Exception(f"Search on {source} failed: {response.status_code} - {response.text}")
+    results = json.loads(response.text)
+    scroll_id = results.get("_scroll_id")
+
+    try:
+        while True:
+            hits = results.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+
+            bulk_lines = []
+            for hit in hits:
+                doc = hit.get("_source", {})
+                # Documents indexed before the structured metadata fields get them from text-metadata
+                if "file_type" not in doc and doc.get("text-metadata"):
+                    doc.update(json.loads(doc["text-metadata"]))
+                if doc.get("embedding_model") == model_id and not copy_same_model:
+                    skipped += 1
+                    continue
+                # Documents routed by tenant keep their routing key
+                action = {"index": {"_index": target, "_id": hit["_id"],
+                                    **({"routing": hit["_routing"]} if hit.get("_routing") else {})}}
+                if doc.get("duplicate_of") or doc.get("embedding_model") == model_id:
+                    # Linked near-duplicates have nothing to embed, and same-model vectors are reused
+                    bulk_lines.append(json.dumps(action))
+                    bulk_lines.append(json.dumps(doc))
+                    continue
+                vector = get_embeddings(doc.get("text", ""), model_id=model_id, dimension=dimension)
+                if not vector:
+                    failed += 1
+                    continue
+                doc.update(embedding_fields(model_id, dimension))
+                doc["vector"] = vector
+                bulk_lines.append(json.dumps(action))
+                bulk_lines.append(json.dumps(doc))
+
+            if bulk_lines:
+                batch = len(bulk_lines) // 2
+                response = requests.post(f"{base}/_bulk", headers={"Content-Type": "application/x-ndjson"},
+                                         data="\n".join(bulk_lines) + "\n")
+                rejected = bulk_rejections(response, batch)
+                copied += batch - rejected
+                failed += rejected
+            print(f"Backfill progress: copied={copied} skipped={skipped} failed={failed}")
+
+            response = requests.post(f"{base}/_search/scroll", headers=headers,
+                                     data=json.dumps({"scroll": "5m", "scroll_id": scroll_id}))
+            if response.status_code >= 300:
+                raise Exception(f"Scroll over {source} failed: {response.status_code} - {response.text}")
+            results = json.loads(response.text)
+            scroll_id = results.get("_scroll_id", scroll_id)
+    finally:
+        # Free the search context now rather than when it times out
+        if scroll_id:
+            requests.delete(f"{base}/_search/scroll", headers=headers, data=json.dumps({"scroll_id": [scroll_id]}))
+
+    return {"copied": copied, "skipped": skipped, "failed": failed}
+
+
+def document_count(endpoint, index):
+    """Number of documents in an index or alias, or None if it can't be read"""
+    response = requests.get(f"{normalize_endpoint(endpoint)}/{index}/_count")
+    if response.status_code != 200:
+        return None
+    return json.loads(response.text).get("count")
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Migrate the document index to a new embedding model')
+    parser.add_argument('command', choices=['create', 'backfill', 'swap'])
+    parser.add_argument('--model', '-m', type=str, required=True, help='Target embedding model ID')
+    parser.add_argument('--dimension', '-d', type=int, default=1024, help='Target embedding dimension')
+    parser.add_argument('--alias', '-a', type=str, default=INDEX_ALIAS, help='Read alias (default: documents)')
+    parser.add_argument('--endpoint', '-e', type=str, help='OpenSearch endpoint URL')
+    parser.add_argument('--index', '-i', type=str,
+                        help='Target index name (default derived from the model); a new name rebuilds the '
+                             'index with the current mapping, copying vectors for documents already on the model')
+    parser.add_argument('--replace-index', action='store_true',
+                        help='Replace a legacy concrete index named like the alias during swap')
+    parser.add_argument('--force', action='store_true',
+                        help='Swap even if the new index holds fewer documents than the alias')
+    args = parser.parse_args()
+
+    endpoint = args.endpoint or os.environ.get('OPENSEARCH_ENDPOINT')
+    dimension = model_dimension(args.model, args.dimension)
+    target = args.index or index_name_for(args.model, dimension, args.alias)
+
+    if args.command == 'create':
+        create_index(endpoint, target, args.model, dimension)
+    elif args.command == 'backfill':
+        result = backfill(endpoint, args.alias, target, args.model, dimension, copy_same_model=bool(args.index))
+        print(result)
+        if result["failed"]:
+            print(f"{result['failed']} documents were not written to {target}; fix and re-run backfill before swap")
+            sys.exit(1)
+    elif args.command == 'swap':
+        # Documents a backfill failed to write are missing from the new index
+        live, migrated = document_count(endpoint, args.alias), document_count(endpoint, target)
+        if not args.force and (live is None or migrated is None or migrated < live):
+            print(f"{target} has {migrated} documents and {args.alias} has {live}; "
+                  f"re-run backfill, or pass --force to swap anyway")
+            sys.exit(1)
+        swap_alias(endpoint, target, args.alias, args.replace_index)
+
+
+if __name__ == "__main__":
+    main()
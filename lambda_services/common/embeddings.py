@@ -0,0 +1,335 @@
+"""
+Shared embedding generation for the ingest and query paths.
+
+Both paths must embed with the same Bedrock model and dimension, otherwise
+query vectors are compared against document vectors from a different space.
+Every indexed document records the model it was embedded with, and every
+physical index records it in its mapping `_meta`, so the query side can
+always embed with the model the index was built from.
+"""
+
+import os
+import re
+import json
+import time
+import datetime
+import threading
+from collections import OrderedDict
+import boto3
+import requests
+from common.rate_limit import get_limiter
+
+# Active embedding model used for new documents and for queries
+EMBEDDING_MODEL_ID = os.environ.get('EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0')
+# Titan v2 only accepts 256, 512 or 1024 dimensions; v1 is fixed at 1536
+EMBEDDING_DIMENSION = int(os.environ.get('EMBEDDING_DIMENSION', 1024))
+
+# Optional second model written in parallel during a migration. Set it on the
+# query functions too, so they can embed queries for the new index once the
+# alias is swapped to it.
+DUAL_WRITE_MODEL_ID = os.environ.get('EMBEDDING_DUAL_WRITE_MODEL_ID') or None
+DUAL_WRITE_DIMENSION = int(os.environ.get('EMBEDDING_DUAL_WRITE_DIMENSION', 1024))
+
+# Alias that searches read from; physical indices sit behind it
+INDEX_ALIAS = os.environ.get('OPENSEARCH_INDEX', 'documents')
+
+# Fixed output dimension for models that don't accept a "dimensions" parameter
+FIXED_DIMENSIONS = {
+    'amazon.titan-embed-text-v1': 1536,
+    'amazon.titan-embed-g1-text-02': 1536,
+}
+
+bedrock_runtime = boto3.client(
+    service_name='bedrock-runtime',
+    region_name=os.environ.get('AWS_REGION', 'us-east-1')
+)
+# Shared across threads so a batch of documents stays under BEDROCK_RATE_LIMIT
+bedrock_limiter = get_limiter('bedrock')
+
+
+class EmbeddingModelMismatch(Exception):
+    """Raised when a query would be embedded with a different model than the index"""
+
+
+def normalize_endpoint(endpoint):
+    """Force the https:// scheme on an OpenSearch endpoint if none is present"""
+    if endpoint and not endpoint.startswith(('http://', 'https://')):
+        endpoint = f"https://{endpoint}"
+    return endpoint
+
+
+def model_dimension(model_id, dimension=None):
+    """Return the vector dimension produced by a model for a requested dimension"""
+    return FIXED_DIMENSIONS.get(model_id, dimension or EMBEDDING_DIMENSION)
+
+
+def build_request_body(text, model_id, dimension):
+    """Build the Bedrock request body for the given Titan embedding model"""
+    if model_id in FIXED_DIMENSIONS:
+        return json.dumps({"inputText": text})
+    return json.dumps({
+        "inputText": text,
+        "dimensions": dimension,
+        "normalize": True
+    })
+
+
+def get_embeddings(text, max_chunk_size=8000, model_id=None, dimension=None):
+    """
+    Generate embeddings using Amazon Bedrock Titan Embeddings model.
+    Defaults to the active model so ingest and query always agree.
+    """
+    if not text or not text.strip():
+        print("Empty text provided for embeddings")
+        return None
+
+    model_id = model_id or EMBEDDING_MODEL_ID
+    dimension = model_dimension(model_id, dimension)
+
+    try:
+        # Ensure we don't exceed the model's maximum input size
+        if len(text) > max_chunk_size:
+            print(f"Text exceeds maximum size, truncating to {max_chunk_size} characters")
+            text = text[:max_chunk_size]
+
+        # Call Bedrock to get embeddings
+        bedrock_limiter.acquire()
+        response = bedrock_runtime.invoke_model(
+            modelId=model_id,
+            contentType="application/json",
+            accept="*/*",
+            body=build_request_body(text, model_id, dimension)
+        )
+
+        # Parse the response
+        response_body = json.loads(response.get("body").read())
+        embedding = response_body.get("embedding")
+
+        if embedding and len(embedding) != dimension:
+            print(f"Model {model_id} returned {len(embedding)} dimensions, expected {dimension}")
+            return None
+
+        return embedding
+    except Exception as e:
+        print(f"Error generating embeddings: {str(e)}")
+        return None
+
+
+def embedding_fields(model_id=None, dimension=None):
+    """Fields recorded on every indexed document describing how it was embedded"""
+    model_id = model_id or EMBEDDING_MODEL_ID
+    return {
+        "embedding_model": model_id,
+        "embedding_dimension": model_dimension(model_id, dimension)
+    }
+
+
+def metadata_fields(bucket, key, extraction_time=None):
+    """
+    Structured metadata recorded on every indexed document. These are
+    mapped as keyword/date fields so searches can pre-filter on them; the
+    same values are also kept in the legacy `text-metadata` JSON string.
+    """
+    return {
+        "source_bucket": bucket,
+        "source_key": key,
+        "extraction_time": extraction_time or datetime.datetime.now().isoformat(),
+        "file_type": os.path.splitext(key)[1][1:].lower()
+    }
+
+
+def index_name_for(model_id, dimension, alias=INDEX_ALIAS):
+    """Physical index name for a model, e.g. documents-amazon-titan-embed-text-v2-0-1024"""
+    slug = re.sub(r'[^a-z0-9]+', '-', model_id.lower()).strip('-')
+    return f"{alias}-{slug}-{dimension}"
+
+
+def write_targets(alias=INDEX_ALIAS, endpoint=None):
+    """
+    Return the (index, model_id, dimension) tuples each new document is written to.
+    Outside a migration this is just the read alias with the active model;
+    during one it also includes the physical index for the dual-write model,
+    so the new index fills up while the alias keeps serving the old one.
+    Once the alias has been swapped to the dual-write model's index (read
+    from its _meta via endpoint), only that model is written, so old-model
+    vectors don't overwrite the new ones behind the alias.
+    alias is a tenant's alias when each tenant has its own index.
+    """
+    targets = [(alias, EMBEDDING_MODEL_ID, model_dimension(EMBEDDING_MODEL_ID))]
+    if DUAL_WRITE_MODEL_ID and DUAL_WRITE_MODEL_ID != EMBEDDING_MODEL_ID:
+        dimension = model_dimension(DUAL_WRITE_MODEL_ID, DUAL_WRITE_DIMENSION)
+        if endpoint and get_index_model(endpoint, alias)[0] == DUAL_WRITE_MODEL_ID:
+            return [(alias, DUAL_WRITE_MODEL_ID, dimension)]
+        targets.append((index_name_for(DUAL_WRITE_MODEL_ID, dimension, alias), DUAL_WRITE_MODEL_ID, dimension))
+    return targets
+
+
+def index_mapping(model_id, dimension):
+    """Mapping for a physical index, recording the embedding model in _meta"""
+    return {
+        "settings": {
+            "index": {
+                "knn": True
+            }
+        },
+        "mappings": {
+            "_meta": embedding_fields(model_id, dimension),
+            "properties": {
+                "filename": {"type": "text"},
+                "text": {"type": "text"},
+                "vector": {
+                    "type": "knn_vector",
+                    "dimension": dimension,
+                    # The lucene engine applies k-NN filters during the graph search
+                    "method": {
+                        "name": "hnsw",
+                        "space_type": "cosinesimil",
+                        "engine": "lucene"
+                    }
+                },
+                "text-metadata": {"type": "text"},
+                "file_type": {"type": "keyword"},
+                "source_bucket": {"type": "keyword"},
+                "source_key": {"type": "keyword"},
+                "extraction_time": {"type": "date"},
+                # Set when TENANT_MODE is index or routing, see common/tenancy.py
+                "tenant": {"type": "keyword"},
+                # Set on the per-segment documents of transcribed recordings, see common/audio.py
+                "segment": {"type": "integer"},
+                "start_time": {"type": "float"},
+                "end_time": {"type": "float"},
+                "embedding_model": {"type": "keyword"},
+                "embedding_dimension": {"type": "integer"},
+                # Near-duplicate detection, see common/dedup.py
+                "minhash": {"type": "long", "index": False},
+                "lsh_bands": {"type": "keyword"},
+                "duplicate_of": {"type": "keyword"},
+                "duplicate_similarity": {"type": "float"}
+            }
+        }
+    }
+
+
+def create_index(endpoint, index, model_id, dimension):
+    """Create a physical index for the given model if it doesn't already exist"""
+    url = f"{normalize_endpoint(endpoint)}/{index}"
+    headers = {"Content-Type": "application/json"}
+    if requests.head(url).status_code == 200:
+        print(f"Index {index} already exists")
+        return True
+    response = requests.put(url, headers=headers, data=json.dumps(index_mapping(model_id, dimension)))
+    if response.status_code >= 300:
+        print(f"Failed to create index {index}: {response.status_code} - {response.text}")
+        return False
+    print(f"Created index {index} for {model_id} ({dimension} dimensions)")
+    return True
+
+
+def swap_alias(endpoint, new_index, alias=INDEX_ALIAS, replace_index=False):
+    """
+    Atomically point the read alias at new_index.
+    Removal and addition happen in a single _aliases call, so searches
+    never see the alias missing or pointing at two indices. If the alias
+    name is still a legacy concrete index, replace_index=True drops that
+    index in the same call.
+    """
+    base = normalize_endpoint(endpoint)
+    headers = {"Content-Type": "application/json"}
+
+    actions = []
+    response = requests.get(f"{base}/_alias/{alias}")
+    if response.status_code == 200:
+        for index in json.loads(response.text):
+            if index != new_index:
+                actions.append({"remove": {"index": index, "alias": alias}})
+    elif requests.head(f"{base}/{alias}").status_code == 200:
+        if not replace_index:
+            print(f"{alias} is a concrete index; pass replace_index=True to replace it with an alias")
+            return False
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": new_index, "alias": alias}})
+
+    response = requests.post(f"{base}/_aliases", headers=headers, data=json.dumps({"actions": actions}))
+    if response.status_code >= 300:
+        print(f"Failed to swap alias {alias} to {new_index}: {response.status_code} - {response.text}")
+        return False
+    print(f"Alias {alias} now points at {new_index}")
+    return True
+
+
+# Long-running servers re-read the index model now and then to notice alias swaps
+INDEX_MODEL_CACHE_TTL = float(os.environ.get('INDEX_MODEL_CACHE_TTL', 300))
+# Query embeddings kept per process, keyed by model; 0 disables the cache
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', 0))
+
+_index_model_cache = {}
+_query_embedding_cache = OrderedDict()
+_query_embedding_lock = threading.Lock()
+
+
+def get_index_model(endpoint, index=INDEX_ALIAS):
+    """
+    Look up the embedding model recorded in the _meta of the index (or the
+    index behind an alias). Cached for INDEX_MODEL_CACHE_TTL seconds.
+    Returns (model_id, dimension), or (None, None) for legacy indices without _meta.
+    """
+    cached = _index_model_cache.get(index)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    model = (None, None)
+    try:
+        response = requests.get(f"{normalize_endpoint(endpoint)}/{index}/_mapping")
+        if response.status_code == 200:
+            for mapping in json.loads(response.text).values():
+                meta = mapping.get("mappings", {}).get("_meta", {})
+                if meta.get("embedding_model"):
+                    model = (meta["embedding_model"], meta.get("embedding_dimension"))
+                    break
+    except requests.exceptions.RequestException as e:
+        print(f"Could not read mapping for {index}: {str(e)}")
+        return model
+
+    _index_model_cache[index] = (model, time.monotonic() + INDEX_MODEL_CACHE_TTL)
+    return model
+
+
+def cached_query_embedding(text, model_id=None, dimension=None):
+    """
+    Embed a query through the per-process LRU cache, so repeated queries in a
+    long-running server don't call Bedrock again. Failed embeddings aren't cached.
+    """
+    if QUERY_EMBEDDING_CACHE_SIZE <= 0:
+        return get_embeddings(text, model_id=model_id, dimension=dimension)
+
+    key = (model_id, dimension, text)
+    with _query_embedding_lock:
+        if key in _query_embedding_cache:
+            _query_embedding_cache.move_to_end(key)
+            return _query_embedding_cache[key]
+
+    embedding = get_embeddings(text, model_id=model_id, dimension=dimension)
+    if embedding:
+        with _query_embedding_lock:
+            _query_embedding_cache[key] = embedding
+            while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                _query_embedding_cache.popitem(last=False)
+    return embedding
+
+
+def get_query_embeddings(text, endpoint, index=INDEX_ALIAS, allowed_models=None):
+    """
+    Embed a query with the model the target index was built with.
+    Legacy indices without _meta fall back to the active model. Raises
+    EmbeddingModelMismatch if the index model isn't one we're allowed to call.
+    """
+    model_id, dimension = get_index_model(endpoint, index)
+    if not model_id:
+        return cached_query_embedding(text)
+
+    allowed = allowed_models or {EMBEDDING_MODEL_ID, DUAL_WRITE_MODEL_ID}
+    if model_id not in allowed:
+        raise EmbeddingModelMismatch(
+            f"Index {index} was embedded with {model_id}, which is not an allowed query model"
+        )
+    return cached_query_embedding(text, model_id, dimension)
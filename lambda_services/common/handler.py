@@ -0,0 +1,59 @@
+"""
+The wrapper every Lambda handler shares.
+
+Each handler answers warm-up pings before a trace starts, so warm-ups stay out
+of the latency metrics, and runs everything else inside a trace. The API
+handlers also decode the API Gateway event on the way in, and attach the debug
+timings and apply the response encoding on the way out.
+
+    @lambda_entry('search', warm_up_container)
+    def lambda_handler(event, context):
+        return handle_search_request(event)
+
+    warm_up_on_init(__name__, warm_up_container)
+"""
+
+import functools
+
+from common.tracing import start_trace, event_debug_flag, attach_timings, is_debug_request
+from common.responses import json_response, encode_response, decode_request
+from common.warmup import is_warmup_event, warm_on_init
+
+
+def lambda_entry(trace_name, warm_up_container, api=True):
+    """
+    Decorate a Lambda handler: warm-up pings return warm_up_container()'s
+    result and every other event runs in a trace named trace_name. With
+    api=True the handler gets the decoded API Gateway event and returns an
+    API Gateway response; otherwise it gets the event as it is and returns a
+    dict, which gets the timings when debug is set.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if is_warmup_event(event):
+                result = warm_up_container()
+                return json_response(200, result) if api else result
+            if not api:
+                with start_trace(trace_name, debug=is_debug_request(event.get('debug'))) as trace:
+                    result = handler(event, context)
+                    if trace and trace.debug:
+                        result['timings'] = trace.timings()
+                return result
+            event = decode_request(event)
+            with start_trace(trace_name, debug=event_debug_flag(event)) as trace:
+                response = handler(event, context)
+            return encode_response(attach_timings(response, trace), event)
+        return wrapper
+    return decorator
+
+
+def warm_up_on_init(module_name, warm_up_container):
+    """
+    Call warm_up_container while the handler module is imported, when
+    warm_on_init says so. Provisioned concurrency runs init ahead of traffic,
+    but never the handler. Call it at the end of the module, once everything
+    the warm-up uses is defined.
+    """
+    if warm_on_init(module_name):
+        warm_up_container()
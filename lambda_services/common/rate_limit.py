@@ -0,0 +1,69 @@
+"""
+Token-bucket rate limiting for calls to throttled AWS services.
+
+Limiters are shared per service name within a container, so every worker
+thread processing a batch draws from the same budget. Rates come from
+<SERVICE>_RATE_LIMIT (requests per second, 0 or unset = unlimited) and
+<SERVICE>_BURST (bucket size, defaults to the rate).
+"""
+
+import os
+import time
+import threading
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Take tokens from the bucket, waiting for a refill if needed.
+        Returns False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _Unlimited:
+    """Stand-in limiter when no rate is configured"""
+
+    def acquire(self, tokens=1, timeout=None):
+        return True
+
+
+UNLIMITED = _Unlimited()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service):
+    """Shared limiter for a service name such as 'textract' or 'bedrock'"""
+    with _limiters_lock:
+        if service not in _limiters:
+            prefix = service.upper()
+            rate = float(os.environ.get(f'{prefix}_RATE_LIMIT', 0) or 0)
+            burst = float(os.environ.get(f'{prefix}_BURST', 0) or 0)
+            _limiters[service] = TokenBucket(rate, burst or None) if rate > 0 else UNLIMITED
+        return _limiters[service]
@@ -0,0 +1,167 @@
+"""
+API Gateway responses for the query handlers.
+
+Bodies are serialised with orjson when it is installed (falling back to the
+standard library), optionally as NDJSON with one result per line, and
+compressed with brotli or gzip when the client accepts it and the body is
+larger than RESPONSE_COMPRESS_MIN_BYTES. Compressed bodies are base64-encoded
+with isBase64Encoded set, as API Gateway proxy integrations require. API
+Gateway only decodes them back to bytes when the API lists `*/*` as a binary
+media type, which this repo doesn't configure, so compression is off unless
+RESPONSE_COMPRESSION is set (the ASGI server turns it on, since it decodes the
+bodies itself). Request bodies that binary media types cause API Gateway to
+base64-encode are decoded by decode_request.
+"""
+
+import os
+import gzip
+import json
+import base64
+
+from common.tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', 'false').lower() == 'true'
+# Fast levels: the point is to cut transfer time, not to squeeze out the last bytes
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+JSON_CONTENT_TYPE = 'application/json'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+
+def decode_request(event):
+    """
+    The event with a base64-encoded request body decoded. With binary media
+    types enabled on the API, API Gateway base64-encodes request bodies too.
+    """
+    if not event.get('isBase64Encoded') or not event.get('body'):
+        return event
+    return {**event, 'body': base64.b64decode(event['body']).decode('utf-8'), 'isBase64Encoded': False}
+
+
+def dumps(obj):
+    """Compact JSON text, via orjson when available"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            # e.g. non-string dict keys, which the standard library coerces
+            pass
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def dumps_ndjson(result):
+    """
+    NDJSON for a result: a first line with every field except the result
+    list, then one line per entry of `results` (or `sources` for RAG
+    answers). Batch results keyed by query become one line per query.
+    """
+    items_key = 'results' if 'results' in result else 'sources'
+    items = result.get(items_key) or []
+    if isinstance(items, dict):
+        items = [{"query": query, **value} for query, value in items.items()]
+    header = {key: value for key, value in result.items() if key != items_key}
+    return ''.join(dumps(line) + '\n' for line in [header] + list(items))
+
+
+def request_headers(event):
+    """Request headers with lower-case names; API Gateway preserves the client's casing"""
+    return {name.lower(): value for name, value in (event.get('headers') or {}).items() if value is not None}
+
+
+def wants_ndjson(event):
+    """NDJSON is requested with format=ndjson (query string, body or direct invocation) or an Accept header"""
+    params = event.get('queryStringParameters') or {}
+    if params.get('format'):
+        return params['format'].lower() == 'ndjson'
+    if event.get('httpMethod') == 'POST' and event.get('body'):
+        try:
+            body_format = json.loads(event['body']).get('format')
+        except (ValueError, AttributeError):
+            body_format = None
+        if body_format:
+            return str(body_format).lower() == 'ndjson'
+    if event.get('format'):
+        return str(event['format']).lower() == 'ndjson'
+    return NDJSON_CONTENT_TYPE in request_headers(event).get('accept', '')
+
+
+def json_response(status_code, result, event=None):
+    """
+    API Gateway response for a result dict. Successful results go out as
+    NDJSON when the request asks for it; everything else is JSON.
+    """
+    with span('serialize'):
+        if event is not None and status_code == 200 and wants_ndjson(event):
+            body, content_type = dumps_ndjson(result), NDJSON_CONTENT_TYPE
+        else:
+            body, content_type = dumps(result), JSON_CONTENT_TYPE
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': content_type, **CORS_HEADERS},
+        'body': body
+    }
+
+
+def accepted_encoding(event):
+    """'br' or 'gzip' if the client accepts it, preferring brotli; None otherwise"""
+    accepted = {}
+    for part in request_headers(event).get('accept-encoding', '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def encode_response(response, event):
+    """
+    Compress the body of a finished response if the client accepts it and
+    it is worth it. Applied last, after anything that still reads the body.
+    """
+    body = response.get('body')
+    if not RESPONSE_COMPRESSION or not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    encoding = accepted_encoding(event)
+    if encoding is None:
+        return response
+
+    compressed = brotli.compress(raw, quality=BROTLI_QUALITY) if encoding == 'br' \
+        else gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    headers = {**(response.get('headers') or {}), 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
@@ -0,0 +1,122 @@
+"""
+Versioned sidecars of extracted document text.
+
+The ingest service writes one gzip-compressed JSON lines file per processed
+object under SIDECAR_PREFIX in SIDECAR_BUCKET (the processed bucket by
+default). The first line is a header with the format version and the source
+object; each following line is one page with its text lines, OCR confidences
+and bounding boxes. For a transcribed recording each page is one segment,
+with its start and end in seconds and a start and end on every line.
+Re-indexing rebuilds documents from these files instead of
+running Textract again.
+"""
+
+import os
+import io
+import gzip
+import json
+import hashlib
+import datetime
+import boto3
+
+# Bump when the page or line layout changes; readers reject newer versions
+SIDECAR_VERSION = 1
+
+SIDECAR_ENABLED = os.environ.get('SIDECAR_ENABLED', 'true').lower() == 'true'
+SIDECAR_BUCKET = os.environ.get('SIDECAR_BUCKET') or os.environ.get('PROCESSED_INGESTION_BUCKET')
+SIDECAR_PREFIX = os.environ.get('SIDECAR_PREFIX', 'sidecars/')
+SIDECAR_SUFFIX = '.text.jsonl.gz'
+
+s3_client = boto3.client('s3')
+
+
+def sidecar_key(key):
+    """Sidecar location for a processed object key"""
+    return f"{SIDECAR_PREFIX}{key}{SIDECAR_SUFFIX}"
+
+
+def is_sidecar_key(key):
+    return key.startswith(SIDECAR_PREFIX) and key.endswith(SIDECAR_SUFFIX)
+
+
+def pages_from_blocks(blocks, page_number=None):
+    """
+    Group the LINE blocks of a Textract response into pages, in reading order.
+    page_number overrides the block page numbers for single-page requests.
+    """
+    pages = {}
+    for block in blocks:
+        if block['BlockType'] != 'LINE':
+            continue
+        number = page_number or block.get('Page', 1)
+        line = {"text": block['Text']}
+        if 'Confidence' in block:
+            line["conf"] = round(block['Confidence'], 1)
+        box = block.get('Geometry', {}).get('BoundingBox')
+        if box:
+            line["bbox"] = [round(box[side], 4) for side in ('Left', 'Top', 'Width', 'Height')]
+        pages.setdefault(number, []).append(line)
+    if not pages and page_number:
+        pages[page_number] = []
+    return [{"page": number, "source": "textract", "lines": lines} for number, lines in sorted(pages.items())]
+
+
+def pages_text(pages):
+    """Document text with one line per extracted line, in page order"""
+    return "".join(line["text"] + "\n" for page in pages for line in page["lines"])
+
+
+def write_sidecar(bucket, key, pages, extracted_at=None):
+    """
+    Write the sidecar for the document indexed from bucket/key.
+    Returns the sidecar key.
+    """
+    text = pages_text(pages)
+    header = {
+        "version": SIDECAR_VERSION,
+        "source_bucket": bucket,
+        "source_key": key,
+        "extracted_at": extracted_at or datetime.datetime.now().isoformat(),
+        "pages": len(pages),
+        "text_sha1": hashlib.sha1(text.encode('utf-8')).hexdigest(),
+    }
+    lines = [json.dumps(header, separators=(',', ':'))]
+    lines.extend(json.dumps(page, separators=(',', ':')) for page in pages)
+    body = gzip.compress(("\n".join(lines) + "\n").encode('utf-8'))
+
+    destination = sidecar_key(key)
+    s3_client.put_object(
+        Bucket=SIDECAR_BUCKET,
+        Key=destination,
+        Body=body,
+        ContentType='application/gzip',
+        Metadata={'sidecar-version': str(SIDECAR_VERSION)}
+    )
+    return destination
+
+
+def read_sidecar(key, bucket=None):
+    """Read a sidecar; returns (header, pages)"""
+    response = s3_client.get_object(Bucket=bucket or SIDECAR_BUCKET, Key=key)
+    with gzip.GzipFile(fileobj=io.BytesIO(response['Body'].read())) as f:
+        records = [json.loads(line) for line in f.read().decode('utf-8').splitlines() if line.strip()]
+    if not records:
+        raise ValueError(f"Sidecar {key} is empty")
+
+    header, pages = records[0], records[1:]
+    if header.get("version", 0) > SIDECAR_VERSION:
+        raise ValueError(f"Sidecar {key} has version {header.get('version')}, newer than supported {SIDECAR_VERSION}")
+    return header, pages
+
+
+def list_sidecars(prefix='', bucket=None):
+    """Yield the keys of all sidecars under SIDECAR_PREFIX + prefix"""
+    list_args = {'Bucket': bucket or SIDECAR_BUCKET, 'Prefix': f"{SIDECAR_PREFIX}{prefix}"}
+    while True:
+        page = s3_client.list_objects_v2(**list_args)
+        for item in page.get('Contents', []):
+            if is_sidecar_key(item['Key']):
+                yield item['Key']
+        if not page.get('IsTruncated'):
+            break
+        list_args['ContinuationToken'] = page['NextContinuationToken']
@@ -0,0 +1,139 @@
+"""
+Tenant-aware index routing for the ingest and query paths.
+
+TENANT_MODE selects how tenants are kept apart:
+
+- none (default): one shared index behind INDEX_ALIAS, no tenant field.
+- index: every tenant gets its own physical index behind a tenant alias
+  (`documents-tenant-acme`), so a tenant's searches only touch its own
+  index. Each tenant index is also added to INDEX_ALIAS, which becomes the
+  cross-tenant read alias.
+- routing: one shared index, but documents are written and searched with
+  the tenant as the routing key, so a tenant's searches only touch the
+  shard holding its documents. Document IDs are prefixed with the tenant,
+  as IDs only have to be unique per shard.
+
+In both tenant modes documents carry a `tenant` keyword field and searches
+for a tenant also filter on it. Ingest takes the tenant from the first
+segment of the S3 key (`acme/invoices/scan.jpg`), or TENANT_DEFAULT for keys
+without one; searches take it from the request.
+"""
+
+import os
+import re
+import json
+import requests
+
+from common.embeddings import INDEX_ALIAS, create_index, index_name_for, normalize_endpoint
+
+TENANT_MODE = os.environ.get('TENANT_MODE', 'none')
+# Tenant for objects at the top level of a bucket
+TENANT_DEFAULT = os.environ.get('TENANT_DEFAULT', 'shared')
+TENANT_MODES = ('none', 'index', 'routing')
+
+# Tenant names end up in index names, so they're held to OpenSearch's rules
+_TENANT_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+
+_ready_tenant_indices = set()
+
+
+def tenancy_enabled():
+    return TENANT_MODE in ('index', 'routing')
+
+
+def normalize_tenant(tenant):
+    """A tenant name from a request, lower-cased; raises ValueError if it isn't a valid one"""
+    name = str(tenant).strip().lower()
+    if not _TENANT_PATTERN.match(name):
+        raise ValueError(f"Invalid tenant: {tenant}")
+    return name
+
+
+def tenant_from_key(key):
+    """The tenant an S3 object belongs to: the first segment of its key"""
+    if '/' not in key.strip('/'):
+        return TENANT_DEFAULT
+    prefix = key.strip('/').split('/', 1)[0].lower()
+    prefix = re.sub(r'[^a-z0-9_-]+', '-', prefix).strip('-_')[:63]
+    return prefix or TENANT_DEFAULT
+
+
+def processed_key(key):
+    """
+    Key a file is moved to in the processed bucket. Folders are dropped, but
+    in a tenant mode the tenant prefix is kept so the processed copy is
+    indexed under the same tenant.
+    """
+    filename = os.path.basename(key)
+    if not tenancy_enabled() or '/' not in key.strip('/'):
+        return filename
+    return f"{tenant_from_key(key)}/{filename}"
+
+
+def tenant_alias(tenant, alias=INDEX_ALIAS):
+    """Alias in front of a tenant's own index in index mode, e.g. documents-tenant-acme"""
+    return f"{alias}-tenant-{tenant}"
+
+
+def tenant_scope(tenant, alias=INDEX_ALIAS):
+    """
+    (index, routing) to read or write a tenant's documents with. Without a
+    tenant, or with tenancy off, that's the shared or cross-tenant alias.
+    """
+    if not tenant or not tenancy_enabled():
+        return alias, None
+    if TENANT_MODE == 'index':
+        return tenant_alias(tenant, alias), None
+    return alias, tenant
+
+
+def routing_param(routing, separator='?'):
+    """URL query string for a routing key, or '' without one"""
+    return f"{separator}routing={routing}" if routing else ''
+
+
+def tenant_doc_id(tenant, doc_id, mode=None):
+    """Document ID for a tenant's document; prefixed in routing mode, where IDs only need to be unique per shard"""
+    if (mode or TENANT_MODE) == 'routing' and tenant:
+        return f"{tenant}.{doc_id}"
+    return doc_id
+
+
+def tenant_fields(tenant):
+    """Fields recorded on every document in a tenant mode"""
+    return {"tenant": tenant} if tenancy_enabled() and tenant else {}
+
+
+def ensure_tenant_index(endpoint, tenant, model_id, dimension, alias=INDEX_ALIAS):
+    """
+    In index mode, create a tenant's physical index and its alias the first
+    time the tenant is written to, and add the index to the cross-tenant
+    alias. While INDEX_ALIAS is still the legacy shared index the cross-tenant
+    alias can't exist yet; `tenant_migration.py sync-alias` adds it later.
+    Returns True once the tenant alias exists.
+    """
+    name = tenant_alias(tenant, alias)
+    if name in _ready_tenant_indices:
+        return True
+    base = normalize_endpoint(endpoint)
+    if requests.head(f"{base}/{name}").status_code == 200:
+        _ready_tenant_indices.add(name)
+        return True
+
+    physical = index_name_for(model_id, dimension, name)
+    if not create_index(endpoint, physical, model_id, dimension):
+        return False
+    actions = [{"add": {"index": physical, "alias": name}}]
+    alias_exists = requests.get(f"{base}/_alias/{alias}").status_code == 200
+    if alias_exists or requests.head(f"{base}/{alias}").status_code == 404:
+        actions.append({"add": {"index": physical, "alias": alias}})
+    else:
+        print(f"{alias} is a concrete index; run tenant_migration.py sync-alias to include {name} in it")
+    response = requests.post(f"{base}/_aliases", headers={"Content-Type": "application/json"},
+                             data=json.dumps({"actions": actions}))
+    if response.status_code >= 300:
+        print(f"Failed to alias {physical} as {name}: {response.status_code} - {response.text}")
+        return False
+    print(f"Created index {physical} for tenant {tenant}")
+    _ready_tenant_indices.add(name)
+    return True
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Split the shared document index by tenant.
+
+Index mode (TENANT_MODE=index):
+1. Set TENANT_MODE=index on the ingest function, so new documents go to
+   their tenant's index.
+2. Run `split --mode index` to copy every existing document, vectors
+   included, into its tenant's index.
+3. Set TENANT_MODE=index on the query functions and run
+   `sync-alias --replace-index` to replace the legacy shared index with the
+   cross-tenant alias over every tenant index. Documents ingested since step
+   1 become searchable here. Run `sync-alias` again after swapping a tenant
+   alias to a new embedding model, since embedding_migration.py only moves
+   the alias it is given.
+
+Routing mode (TENANT_MODE=routing):
+1. Run `split --mode routing --index documents-routed` to copy every document
+   into a new index with the tenant as its routing key. Routing can't be
+   changed in place, so the split always writes a new index.
+2. Run `sync-alias --mode routing --index documents-routed --replace-index`
+   to move INDEX_ALIAS to it, then set TENANT_MODE=routing.
+
+`split` exits non-zero if any document was not copied. `sync-alias` won't
+drop the legacy index while the copies hold fewer documents than it unless
+--force is passed.
+
+Documents without a `tenant` field are assigned one from their source key,
+as ingest would.
+"""
+
+import os
+import sys
+import json
+import argparse
+import requests
+
+from common.embeddings import (
+    create_index, swap_alias, get_index_model, model_dimension, normalize_endpoint,
+    EMBEDDING_MODEL_ID, INDEX_ALIAS
+)
+from common.embedding_migration import rejected_positions, document_count
+from common.tenancy import tenant_from_key, tenant_alias, tenant_doc_id, ensure_tenant_index, TENANT_MODE, TENANT_MODES
+
+
+def document_tenant(doc):
+    """The tenant of an indexed document: its tenant field, or the prefix of its source key"""
+    if doc.get("tenant"):
+        return doc["tenant"]
+    source_key = doc.get("source_key")
+    if not source_key and doc.get("text-metadata"):
+        source_key = json.loads(doc["text-metadata"]).get("source_key")
+    return tenant_from_key(source_key or doc.get("filename", ""))
+
+
+def split(endpoint, source, mode, target=None, alias=INDEX_ALIAS, batch_size=500):
+    """
+    Copy every document in source to its tenant's index (index mode) or into
+    target routed by tenant (routing mode). Vectors are copied, so nothing
+    is re-embedded. Returns the number of documents copied per tenant and the
+    number that were not; a failed search or scroll raises.
+    """
+    base = normalize_endpoint(endpoint)
+    headers = {"Content-Type": "application/json"}
+    model_id, dimension = get_index_model(endpoint, source)
+    model_id = model_id or EMBEDDING_MODEL_ID
+    dimension = dimension or model_dimension(model_id)
+    if mode == 'routing' and not create_index(endpoint, target, model_id, dimension):
+        raise Exception(f"Could not create {target}")
+
+    counts = {}
+    failed = 0
+    response = requests.post(f"{base}/{source}/_search?scroll=5m", headers=headers,
+                             data=json.dumps({"size": batch_size, "query": {"match_all": {}}}))
+    if response.status_code >= 300:
+        raise Exception(f"Search on {source} failed: {response.status_code} - {response.text}")
+    results = json.loads(response.text)
+    scroll_id = results.get("_scroll_id")
+
+    try:
+        while True:
+            hits = results.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+
+            bulk_lines = []
+            tenants = []
+            for hit in hits:
+                doc = hit.get("_source", {})
+                tenant = document_tenant(doc)
+                doc["tenant"] = tenant
+                if mode == 'index':
+                    if not ensure_tenant_index(endpoint, tenant, model_id, dimension, alias):
+                        failed += 1
+                        continue
+                    action = {"_index": tenant_alias(tenant, alias), "_id": hit["_id"]}
+                else:
+                    # IDs, and the links duplicates hold to them, get the tenant prefix ingest would give them
+                    if doc.get("duplicate_of"):
+                        doc["duplicate_of"] = tenant_doc_id(tenant, doc["duplicate_of"], mode)
+                    action = {"_index": target, "_id": tenant_doc_id(tenant, hit["_id"], mode), "routing": tenant}
+                bulk_lines.append(json.dumps({"index": action}))
+                bulk_lines.append(json.dumps(doc))
+                tenants.append(tenant)
+
+            if bulk_lines:
+                response = requests.post(f"{base}/_bulk", headers={"Content-Type": "application/x-ndjson"},
+                                         data="\n".join(bulk_lines) + "\n")
+                rejected = rejected_positions(response, len(tenants))
+                failed += len(rejected)
+                for position, tenant in enumerate(tenants):
+                    if position not in rejected:
+                        counts[tenant] = counts.get(tenant, 0) + 1
+            print(f"Split progress: {sum(counts.values())} documents, {len(counts)} tenants, failed={failed}")
+
+            response = requests.post(f"{base}/_search/scroll", headers=headers,
+                                     data=json.dumps({"scroll": "5m", "scroll_id": scroll_id}))
+            if response.status_code >= 300:
+                raise Exception(f"Scroll over {source} failed: {response.status_code} - {response.text}")
+            results = json.loads(response.text)
+            scroll_id = results.get("_scroll_id", scroll_id)
+    finally:
+        # Free the search context now rather than when it times out
+        if scroll_id:
+            requests.delete(f"{base}/_search/scroll", headers=headers, data=json.dumps({"scroll_id": [scroll_id]}))
+
+    return {"tenants": counts, "failed": failed}
+
+
+def split_complete(endpoint, legacy, copies):
+    """
+    Whether copies (an index, alias or pattern) hold at least as many
+    documents as the legacy index they replace; prints the counts if not
+    """
+    live, migrated = document_count(endpoint, legacy), document_count(endpoint, copies)
+    if live is None or migrated is None or migrated < live:
+        print(f"{copies} has {migrated} documents and {legacy} has {live}; "
+              f"re-run split, or pass --force to replace {legacy} anyway")
+        return False
+    return True
+
+
+def sync_cross_tenant_alias(endpoint, alias=INDEX_ALIAS, replace_index=False, force=False):
+    """
+    Point the cross-tenant alias at exactly the indices behind the tenant
+    aliases, in one _aliases call. If the alias name is still the legacy
+    shared index, replace_index=True drops that index in the same call,
+    unless the tenant indices hold fewer documents than it (force=True
+    drops it anyway).
+    """
+    base = normalize_endpoint(endpoint)
+    response = requests.get(f"{base}/_alias/{tenant_alias('*', alias)}")
+    if response.status_code != 200:
+        print(f"No tenant indices found for {alias}")
+        return False
+    tenant_indices = set(json.loads(response.text))
+
+    actions = []
+    response = requests.get(f"{base}/_alias/{alias}")
+    if response.status_code == 200:
+        current = set(json.loads(response.text))
+        actions.extend({"remove": {"index": index, "alias": alias}} for index in sorted(current - tenant_indices))
+    else:
+        current = set()
+        if requests.head(f"{base}/{alias}").status_code == 200:
+            if not replace_index:
+                print(f"{alias} is a concrete index; pass --replace-index to replace it with the cross-tenant alias")
+                return False
+            # Documents the split failed to copy would be lost with the legacy index
+            if not force and not split_complete(endpoint, alias, tenant_alias('*', alias)):
+                return False
+            actions.append({"remove_index": {"index": alias}})
+    actions.extend({"add": {"index": index, "alias": alias}} for index in sorted(tenant_indices - current))
+    if not actions:
+        print(f"Alias {alias} already covers every tenant index")
+        return True
+
+    response = requests.post(f"{base}/_aliases", headers={"Content-Type": "application/json"},
+                             data=json.dumps({"actions": actions}))
+    if response.status_code >= 300:
+        print(f"Failed to update alias {alias}: {response.status_code} - {response.text}")
+        return False
+    print(f"Alias {alias} now covers {len(tenant_indices)} tenant indices")
+    return True
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Split the shared document index by tenant')
+    parser.add_argument('command', choices=['split', 'sync-alias'])
+    parser.add_argument('--mode', '-m', choices=[m for m in TENANT_MODES if m != 'none'],
+                        default=TENANT_MODE if TENANT_MODE != 'none' else 'index')
+    parser.add_argument('--alias', '-a', type=str, default=INDEX_ALIAS, help='Shared / cross-tenant alias')
+    parser.add_argument('--source', '-s', type=str, help='Index to split (default: the alias)')
+    parser.add_argument('--index', '-i', type=str, help='New routed index (routing mode)')
+    parser.add_argument('--endpoint', '-e', type=str, help='OpenSearch endpoint URL')
+    parser.add_argument('--replace-index', action='store_true',
+                        help='Replace a legacy concrete index named like the alias during sync-alias')
+    parser.add_argument('--force', action='store_true',
+                        help='Replace the legacy index even if the split copies hold fewer documents')
+    args = parser.parse_args()
+
+    endpoint = args.endpoint or os.environ.get('OPENSEARCH_ENDPOINT')
+    if args.mode == 'routing' and not args.index:
+        parser.error('--index is required in routing mode')
+
+    if args.command == 'split':
+        result = split(endpoint, args.source or args.alias, args.mode, args.index, args.alias)
+        print(result)
+        if result["failed"]:
+            print(f"{result['failed']} documents were not copied; fix and re-run split before sync-alias")
+            sys.exit(1)
+    elif args.mode == 'index':
+        if not sync_cross_tenant_alias(endpoint, args.alias, args.replace_index, args.force):
+            sys.exit(1)
+    else:
+        if not args.force and not split_complete(endpoint, args.alias, args.index):
+            sys.exit(1)
+        if not swap_alias(endpoint, args.index, args.alias, args.replace_index):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Lightweight per-stage timing for the Lambda handlers.
+
+Handlers open a trace per request and wrap each stage in span(). When a
+trace is neither emitting metrics (TRACING_ENABLED) nor collecting timings
+for a debug response, span() returns a shared no-op context manager, so
+instrumented code costs one ContextVar lookup per stage.
+
+Finished traces are written as a CloudWatch Embedded Metric Format line
+(stage durations become metrics) plus a structured JSON log line.
+"""
+
+import os
+import json
+import time
+import resource
+import contextvars
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ResearchAI')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class _NoopSpan:
+    """Shared do-nothing span used when tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """A timed stage within a trace"""
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+        self.cpu_start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "cpu_ms": round((time.process_time() - self.cpu_start) * 1000, 3),
+        }
+        if exc_type:
+            record["error"] = exc_type.__name__
+        if self.attributes:
+            record.update(self.attributes)
+        self.trace.spans.append(record)
+        return False
+
+    def set(self, **attributes):
+        """Attach attributes (counts, sizes, ids) to the span record"""
+        self.attributes.update(attributes)
+
+
+class Trace:
+    """Spans collected for one handler invocation"""
+
+    def __init__(self, name, emit, debug=False):
+        self.name = name
+        self.emit = emit
+        self.debug = debug
+        self.spans = []
+        self.start = time.perf_counter()
+        self.total_ms = None
+
+    def span(self, name, **attributes):
+        return Span(self, name, attributes)
+
+    def timings(self):
+        """Per-stage totals for API responses; repeated stages are summed"""
+        stages = {}
+        for record in self.spans:
+            stages[record["name"]] = round(stages.get(record["name"], 0) + record["duration_ms"], 3)
+        total_ms = self.total_ms
+        if total_ms is None:
+            total_ms = round((time.perf_counter() - self.start) * 1000, 3)
+        return {"total_ms": total_ms, "stages": stages}
+
+    def finish(self):
+        self.total_ms = round((time.perf_counter() - self.start) * 1000, 3)
+        if self.emit:
+            emit_trace(self)
+
+
+def emit_trace(trace):
+    """Write the trace as a CloudWatch EMF record and a structured log line"""
+    timings = trace.timings()
+    # ru_maxrss is reported in kilobytes on Linux
+    max_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    metrics = {f"{stage}_ms": duration for stage, duration in timings["stages"].items()}
+    metrics["total_ms"] = timings["total_ms"]
+    metrics["max_rss_mb"] = max_rss_mb
+
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Handler"]],
+                "Metrics": [
+                    {"Name": name, "Unit": "Megabytes" if name == "max_rss_mb" else "Milliseconds"}
+                    for name in metrics
+                ]
+            }]
+        },
+        "Handler": trace.name,
+        **metrics
+    }))
+    print(json.dumps({
+        "level": "INFO",
+        "message": "trace",
+        "handler": trace.name,
+        "total_ms": timings["total_ms"],
+        "max_rss_mb": max_rss_mb,
+        "spans": trace.spans
+    }))
+
+
+@contextmanager
+def start_trace(name, debug=False):
+    """
+    Open a trace for one handler invocation. Yields the Trace, or None when
+    tracing is disabled and no debug timings were requested.
+    """
+    if not (TRACING_ENABLED or debug):
+        yield None
+        return
+
+    trace = Trace(name, emit=TRACING_ENABLED, debug=debug)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+
+
+def span(name, **attributes):
+    """Time a stage of the current trace; a no-op outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    return trace.span(name, **attributes)
+
+
+def is_debug_request(value):
+    """Interpret a debug flag from query strings, JSON bodies or direct invocations"""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def event_debug_flag(event):
+    """Find a debug flag in an API Gateway GET/POST event or a direct invocation"""
+    params = event.get('queryStringParameters') or {}
+    if 'debug' in params:
+        return is_debug_request(params['debug'])
+    if event.get('httpMethod') == 'POST' and event.get('body'):
+        try:
+            return is_debug_request(json.loads(event['body']).get('debug'))
+        except (ValueError, AttributeError):
+            return False
+    return is_debug_request(event.get('debug'))
+
+
+def attach_timings(response, trace):
+    """
+    Add the trace's timings block to a JSON API Gateway response body if debug
+    was requested; NDJSON bodies get it on their first line
+    """
+    if trace is None or not trace.debug:
+        return response
+    if (response.get('headers') or {}).get('Content-Type') == 'application/x-ndjson':
+        first, _, rest = (response.get('body') or '').partition('\n')
+        try:
+            header = json.loads(first)
+        except ValueError:
+            return response
+        header['timings'] = trace.timings()
+        response['body'] = json.dumps(header) + '\n' + rest
+        return response
+    try:
+        body = json.loads(response.get('body') or '{}')
+    except ValueError:
+        return response
+    if isinstance(body, dict):
+        body['timings'] = trace.timings()
+        response['body'] = json.dumps(body)
+    return response
@@ -0,0 +1,196 @@
+"""
+Warm-up for the Lambda handlers and the query server.
+
+A container started by provisioned concurrency or kept alive by a scheduled
+ping otherwise does nothing until its first real request, which then pays for
+endpoint resolution and a TLS handshake on every client, the index model
+lookup and an empty query embedding cache. Warming up does that work first:
+
+- opens up to WARMUP_CONNECTIONS pooled OpenSearch connections
+- reads the index's embedding model into the model cache
+- makes one signed call on each AWS client, which resolves its endpoint and
+  opens its connection (credentials are resolved when a client is created)
+- embeds the top WARMUP_QUERY_COUNT queries from WARMUP_QUERIES_SOURCE into the
+  query embedding cache, when QUERY_EMBEDDING_CACHE_SIZE is set
+
+Handlers recognise {"warmup": true}, serverless-plugin-warmup pings and plain
+EventBridge scheduled events, warm up and return without running a request.
+Provisioned concurrency never calls the handler before traffic arrives, so
+those containers warm up during init instead.
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import boto3
+from botocore.exceptions import ClientError
+
+import common.embeddings as embeddings
+from common.embeddings import (
+    get_index_model, get_query_embeddings, build_request_body, model_dimension, normalize_endpoint,
+    EMBEDDING_MODEL_ID, INDEX_ALIAS
+)
+
+# 'true' or 'false' forces warming up during init; unset warms up only under provisioned concurrency
+WARMUP_ON_INIT = os.environ.get('WARMUP_ON_INIT', '').lower()
+# Pooled OpenSearch connections opened in parallel
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', 4))
+# Popular queries to pre-embed: s3://bucket/key or a file path, holding a JSON
+# list (strings, or {"query", "count"} objects) or one query per line
+WARMUP_QUERIES_SOURCE = os.environ.get('WARMUP_QUERIES_SOURCE', '')
+WARMUP_QUERY_COUNT = int(os.environ.get('WARMUP_QUERY_COUNT', 100))
+WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', 8))
+# Seconds a warm-up waits for its calls; whatever is still running is left behind
+WARMUP_TIMEOUT = float(os.environ.get('WARMUP_TIMEOUT', 10))
+
+s3_client = boto3.client('s3')
+
+
+def is_warmup_event(event):
+    """Whether an invocation is a warm-up ping rather than a request"""
+    if not isinstance(event, dict):
+        return False
+    if event.get('warmup') or event.get('source') == 'serverless-plugin-warmup':
+        return True
+    # A schedule with custom input (e.g. the failed-file retry) sends that input instead
+    return event.get('source') == 'aws.events' and event.get('detail-type') == 'Scheduled Event'
+
+
+def warm_on_init(module_name):
+    """
+    Whether a handler module should warm up while it is imported: only the
+    module Lambda calls (_HANDLER), not the ones it imports, and by default
+    only in provisioned concurrency containers, whose init runs ahead of
+    traffic. On-demand cold starts would pay for it inside the first request.
+    """
+    handler = os.environ.get('_HANDLER', '')
+    if handler.rsplit('.', 1)[0].rsplit('.', 1)[-1] != module_name.rsplit('.', 1)[-1]:
+        return False
+    if WARMUP_ON_INIT:
+        return WARMUP_ON_INIT == 'true'
+    return os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency'
+
+
+def load_warmup_queries(source=WARMUP_QUERIES_SOURCE, count=WARMUP_QUERY_COUNT):
+    """The first `count` distinct queries of the stored list, most popular first"""
+    if not source or count <= 0:
+        return []
+    if source.startswith('s3://'):
+        bucket, _, key = source[len('s3://'):].partition('/')
+        text = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    else:
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        entries = [line for line in text.splitlines() if not line.startswith('#')]
+    if any(isinstance(entry, dict) for entry in entries):
+        entries = sorted(entries, key=lambda e: -e.get('count', 0) if isinstance(e, dict) else 0)
+        entries = [entry.get('query') if isinstance(entry, dict) else entry for entry in entries]
+
+    queries = []
+    for entry in entries:
+        query = entry.strip() if isinstance(entry, str) else ''
+        if query and query not in queries:
+            queries.append(query)
+            if len(queries) == count:
+                break
+    return queries
+
+
+def prime_client(call):
+    """
+    Make one call to open a client's connection. An error response still
+    means the request was signed and the connection is open, so it counts.
+    """
+    try:
+        call()
+    except ClientError:
+        pass
+
+
+def prime_bedrock(client):
+    """The smallest Bedrock call: embed one word"""
+    client.invoke_model(modelId=EMBEDDING_MODEL_ID, contentType='application/json', accept='application/json',
+                        body=build_request_body('warmup', EMBEDDING_MODEL_ID, model_dimension(EMBEDDING_MODEL_ID)))
+
+
+def warm_up(endpoint=None, index=INDEX_ALIAS, session=None, s3=None, buckets=(), textract=None,
+            llm_client=None, queries=False):
+    """
+    Prime the given clients, the OpenSearch session and (with queries=True)
+    the query embedding cache, all in parallel. Returns a summary of what was
+    primed, with the time each step took; failures are reported, not raised.
+    """
+    started = time.perf_counter()
+    steps = {}
+
+    def timed(name, func):
+        step_start = time.perf_counter()
+        try:
+            func()
+            step = {"ok": True}
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {str(e)}")
+            step = {"ok": False, "error": str(e)}
+        step["ms"] = round((time.perf_counter() - step_start) * 1000, 1)
+        steps[name] = step
+
+    # The index model comes first, as every query embedding needs it
+    if endpoint:
+        timed('index_model', lambda: get_index_model(endpoint, index))
+
+    tasks = [('bedrock', lambda: prime_bedrock(embeddings.bedrock_runtime))]
+    if llm_client is not None and llm_client is not embeddings.bedrock_runtime:
+        tasks.append(('bedrock_llm', lambda: prime_bedrock(llm_client)))
+    if endpoint and session is not None:
+        url = f"{normalize_endpoint(endpoint)}/{index}"
+        tasks.extend((f"opensearch_{i}", lambda: session.head(url)) for i in range(WARMUP_CONNECTIONS))
+    for bucket in (b for b in buckets if b):
+        tasks.append((f"s3_{bucket}", lambda bucket=bucket: prime_client(lambda: s3.head_bucket(Bucket=bucket))))
+    if textract is not None:
+        tasks.append(('textract', lambda: prime_client(lambda: textract.get_document_text_detection(JobId='warmup'))))
+
+    warm_queries = []
+    if queries:
+        try:
+            warm_queries = load_warmup_queries()
+        except Exception as e:
+            print(f"Could not load warm-up queries from {WARMUP_QUERIES_SOURCE}: {str(e)}")
+        if warm_queries and embeddings.QUERY_EMBEDDING_CACHE_SIZE <= 0:
+            print("QUERY_EMBEDDING_CACHE_SIZE is 0; warm-up queries would not be kept, skipping them")
+            warm_queries = []
+    embedded = []
+
+    def embed(query):
+        try:
+            if get_query_embeddings(query, endpoint, index):
+                embedded.append(query)
+        except Exception as e:
+            print(f"Could not pre-embed warm-up query: {str(e)}")
+
+    executor = ThreadPoolExecutor(max_workers=max(1, WARMUP_WORKERS), thread_name_prefix='warmup')
+    futures = [executor.submit(timed, name, func) for name, func in tasks]
+    futures += [executor.submit(embed, query) for query in warm_queries]
+    _, pending = wait(futures, timeout=WARMUP_TIMEOUT)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    # Steps still running past the timeout are left out
+    steps = dict(steps)
+    connections = [steps.pop(name) for name in list(steps) if name.startswith('opensearch_')]
+    if connections:
+        steps['opensearch'] = {"ok": all(step["ok"] for step in connections), "connections": len(connections),
+                               "ms": max(step["ms"] for step in connections)}
+    result = {
+        "warmup": True,
+        "steps": steps,
+        "queries_embedded": len(embedded),
+        "timed_out": len(pending),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    print(f"Warm-up finished: {json.dumps(result)}")
+    return result
@@ -3,12 +3,32 @@ import boto3
 import time
 import urllib.parse
 from pillow_heif import register_heif_opener
-from PIL import Image
+from PIL import Image, ImageOps, UnidentifiedImageError
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PyPdfError
 import io
 import json
 import requests
-import datetime
 import re
+import math
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from common.embeddings import (
+    get_embeddings, embedding_fields, metadata_fields, write_targets, create_index, normalize_endpoint, INDEX_ALIAS
+)
+from common.tracing import span
+from common.warmup import warm_up
+from common.handler import lambda_entry, warm_up_on_init
+from common.rate_limit import get_limiter
+from common.sidecars import (
+    write_sidecar, pages_from_blocks, pages_text, is_sidecar_key, SIDECAR_ENABLED, SIDECAR_BUCKET
+)
+from common.audio import transcribe_recording, is_audio, is_audio_work_key, AUDIO_WORK_BUCKET
+from common.dedup import fingerprint, find_duplicate, DEDUP_ENABLED, DEDUP_ACTION
+from common.tenancy import (
+    tenancy_enabled, tenant_from_key, processed_key, tenant_scope, tenant_doc_id, tenant_fields, routing_param,
+    ensure_tenant_index, TENANT_MODE
+)
 
 register_heif_opener()
 
@@ -18,56 +38,78 @@ opensearch_endpoint = os.environ.get('OPENSEARCH_ENDPOINT')
 INGESTION_BUCKET = os.environ.get('INGESTION_BUCKET')
 FAILED_INGESTION_BUCKET = os.environ.get('FAILED_INGESTION_BUCKET')
 PROCESSED_INGESTION_BUCKET = os.environ.get('PROCESSED_INGESTION_BUCKET')
+# Seconds between Textract job status polls
+TEXTRACT_POLL_INTERVAL = float(os.environ.get('TEXTRACT_POLL_INTERVAL', 5))
+# 'staged' converts into the processed bucket, which triggers OCR and indexing;
+# 'fused' does it all in one invocation from the ingestion bucket
+INGEST_MODE = os.environ.get('INGEST_MODE', 'staged')
+# In fused mode, still copy files to the processed bucket (in the background).
+# Off by default there, since fused ingest doesn't need the copy
+ARCHIVE_PROCESSED = (os.environ.get('ARCHIVE_PROCESSED') or
+                     ('false' if INGEST_MODE == 'fused' else 'true')).lower() == 'true'
+# Messages from an SQS batch processed in parallel
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', 4))
+# One pooled OpenSearch session per container, so warm invocations and the
+# worker threads of a batch reuse connections instead of opening one per write
+http = requests.Session()
+for _scheme in ('http://', 'https://'):
+    http.mount(_scheme, requests.adapters.HTTPAdapter(pool_maxsize=max(4, 2 * INGEST_CONCURRENCY)))
+# Shared across the worker threads so a batch stays under TEXTRACT_RATE_LIMIT
+textract_limiter = get_limiter('textract')
+# When the current invocation times out (epoch seconds), for work that can stop early and resume
+_deadline = contextvars.ContextVar('ingest_deadline', default=None)
 
-# Add Bedrock client for embeddings
-bedrock_runtime = boto3.client(
-    service_name='bedrock-runtime',
-    region_name=os.environ.get('AWS_REGION', 'us-east-1')
-)
+# Failed-file retry policy: attempts before quarantine and backoff in seconds
+INGEST_MAX_ATTEMPTS = int(os.environ.get('INGEST_MAX_ATTEMPTS', 3))
+INGEST_RETRY_BASE_DELAY = int(os.environ.get('INGEST_RETRY_BASE_DELAY', 300))
+INGEST_RETRY_MAX_DELAY = int(os.environ.get('INGEST_RETRY_MAX_DELAY', 6 * 3600))
+# Files requeued per scheduled run; the rest wait for the next run
+INGEST_RETRY_BATCH = int(os.environ.get('INGEST_RETRY_BATCH', 500))
+# Seconds kept free before the invocation times out
+INGEST_RETRY_TIME_MARGIN = 10
 
-# Constants for embedding model
-EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
-EMBEDDING_DIMENSION = 1536  # Titan model dimension
+# Failed bucket layout: <state>/<source bucket>/<source key>
+RETRY_PREFIX = 'retry'
+QUARANTINE_PREFIX = 'quarantine'
 
+# PDF text layer extraction: pages with less text than PDF_MIN_PAGE_CHARS that
+# contain images, or whose text is mostly unprintable, are OCR'd one by one
+# with the synchronous API. PDFs with more scanned pages than
+# PDF_SYNC_OCR_MAX_PAGES, or larger than PDF_TEXT_LAYER_MAX_BYTES, go through
+# an asynchronous Textract job as a whole.
+PDF_TEXT_LAYER = os.environ.get('PDF_TEXT_LAYER', 'true').lower() == 'true'
+PDF_MIN_PAGE_CHARS = int(os.environ.get('PDF_MIN_PAGE_CHARS', 50))
+PDF_SYNC_OCR_MAX_PAGES = int(os.environ.get('PDF_SYNC_OCR_MAX_PAGES', 20))
+PDF_TEXT_LAYER_MAX_BYTES = int(os.environ.get('PDF_TEXT_LAYER_MAX_BYTES', 50 * 1024 * 1024))
+PDF_OCR_CONCURRENCY = int(os.environ.get('PDF_OCR_CONCURRENCY', 4))
+# Largest document the synchronous Textract API accepts
+TEXTRACT_SYNC_MAX_BYTES = 10 * 1024 * 1024
 
-def get_embeddings(text, max_chunk_size=8000):
-    """
-    Generate embeddings using Amazon Bedrock Titan Embeddings model.
-    For longer texts, we chunk the text and create embeddings for each chunk.
-    """
-    if not text or not text.strip():
-        print("Empty text provided for embeddings")
-        return None
-        
-    try:
-        # Ensure we don't exceed the model's maximum input size
-        if len(text) > max_chunk_size:
-            print(f"Text exceeds maximum size, truncating to {max_chunk_size} characters")
-            text = text[:max_chunk_size]
-            
-        # Prepare the request body according to Titan embedding model requirements
-        request_body = json.dumps({
-            "inputText": text,
-            "dimensions": EMBEDDING_DIMENSION,
-            "normalize": True
-        })
+# OCR preprocessing: images are auto-oriented from EXIF, downsampled to
+# OCR_TARGET_DPI (when the file records one) and OCR_MAX_PIXELS, optionally
+# converted to grayscale, and encoded to fit under OCR_MAX_BYTES
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', 'true').lower() == 'true'
+OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 300))
+OCR_MAX_PIXELS = int(os.environ.get('OCR_MAX_PIXELS', 12000000))
+OCR_GRAYSCALE = os.environ.get('OCR_GRAYSCALE', 'true').lower() == 'true'
+OCR_JPEG_QUALITY = int(os.environ.get('OCR_JPEG_QUALITY', 85))
+OCR_MAX_BYTES = int(os.environ.get('OCR_MAX_BYTES', TEXTRACT_SYNC_MAX_BYTES))
 
-        # Call Bedrock to get embeddings
-        response = bedrock_runtime.invoke_model(
-            modelId=EMBEDDING_MODEL_ID,
-            contentType="application/json",
-            accept="*/*",
-            body=request_body
-        )
-        
-        # Parse the response
-        response_body = json.loads(response.get("body").read())
-        embedding = response_body.get("embedding")
-        
-        return embedding
-    except Exception as e:
-        print(f"Error generating embeddings: {str(e)}")
-        return None
+# Formats converted to JPEG before OCR, and formats Textract reads directly
+CONVERT_EXTENSIONS = ('.heic', '.heif', '.tiff', '.tif')
+TEXTRACT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Background archive uploads in fused mode
+_archive_executor = ThreadPoolExecutor(max_workers=2)
+
+# AWS error codes worth retrying later; any other client error is permanent
+TRANSIENT_ERROR_CODES = {
+    'ThrottlingException', 'ProvisionedThroughputExceededException', 'LimitExceededException',
+    'TooManyRequestsException', 'ServiceUnavailable', 'ServiceUnavailableException', 'SlowDown',
+    'InternalError', 'InternalServerError', 'InternalServerException', 'RequestTimeout',
+    'RequestTimeoutException', 'ModelTimeoutException', 'ModelNotReadyException',
+}
 
 
 def get_s3_object_with_retry(bucket, key, max_retries=3):
@@ -79,7 +121,8 @@ def get_s3_object_with_retry(bucket, key, max_retries=3):
             if attempt == max_retries - 1:
                 raise
             print(f"Object {key} not found in {bucket} (attempt {attempt+1}/{max_retries}), retrying...")
-            time.sleep(2 ** attempt)  # Exponential backoff
+            with span('s3_retry_sleep', attempt=attempt + 1):
+                time.sleep(2 ** attempt)  # Exponential backoff
 
 def check_s3_object_exists_with_retry(bucket, key, max_retries=3):
     """Check if an S3 object exists with retry logic"""
@@ -92,7 +135,8 @@ def check_s3_object_exists_with_retry(bucket, key, max_retries=3):
                 if attempt == max_retries - 1:
                     return False
                 print(f"Object {key} not found in {bucket} (attempt {attempt+1}/{max_retries}), retrying...")
-                time.sleep(2 ** attempt)  # Exponential backoff
+                with span('s3_retry_sleep', attempt=attempt + 1):
+                    time.sleep(2 ** attempt)  # Exponential backoff
             else:
                 # If it's a different error, raise it
                 raise e
@@ -110,107 +154,619 @@ def sanitize_id(key):
         doc_id = doc_id[:512]
     return doc_id
 
+def warm_up_container():
+    """Open pooled OpenSearch, S3, Textract and Bedrock connections"""
+    return warm_up(opensearch_endpoint, INDEX_ALIAS, session=http, s3=s3_client,
+                   buckets=(INGESTION_BUCKET, PROCESSED_INGESTION_BUCKET), textract=textract_client)
+
+@lambda_entry('ingest', warm_up_container, api=False)
 def lambda_handler(event, context):
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        _deadline.set(time.time() + context.get_remaining_time_in_millis() / 1000)
+    if event.get('retry_failed'):
+        return retry_failed_files(deadline=_deadline.get())
+    if is_sqs_event(event):
+        return handle_sqs_batch(event)
+    return handle_records(event)
+
+def record_location(record):
+    """Bucket and URL-decoded key from an S3 event record"""
+    bucket = record['s3']['bucket']['name']
+    # URL-decode the key to handle special characters and spaces
+    encoded_key = record['s3']['object']['key']
+    key = urllib.parse.unquote_plus(encoded_key)
+
+    print(f"Processing event for object - Original key: {encoded_key}")
+    print(f"Decoded key: {key}")
+    return bucket, key
+
+def process_record(bucket, key, raise_errors=False):
+    """
+    Route one S3 object to the stage for its bucket.
+    Returns True if processed, False if it failed (and was moved to the failed
+    bucket) and None if the bucket isn't handled here. With raise_errors,
+    transient errors propagate instead so the caller can retry the file.
+    """
+    # Sidecars written next to processed objects trigger the processed bucket too
+    if bucket == SIDECAR_BUCKET and is_sidecar_key(key):
+        return None
+    # So do audio segments and transcripts written during transcription
+    if bucket == AUDIO_WORK_BUCKET and is_audio_work_key(key):
+        return None
+
+    # Check if the file exists with retry logic
+    with span('s3_exists_check'):
+        exists = check_s3_object_exists_with_retry(bucket, key)
+    if not exists:
+        print(f"File {key} does not exist in {bucket} after multiple attempts, skipping processing")
+        return False
+
+    try:
+        # Only process files from the ingestion bucket
+        if bucket == INGESTION_BUCKET and INGEST_MODE == 'fused':
+            with span('fused_ingest'):
+                fused_ingest(bucket, key)
+            return True
+        elif bucket == INGESTION_BUCKET:
+            with span('process_file'):
+                process_file(bucket, key)
+            return True
+        # Process files in the processed bucket with Textract
+        elif bucket == PROCESSED_INGESTION_BUCKET:
+            with span('extract_and_index_text'):
+                extract_and_index_text(bucket, key, raise_errors=True)
+            return True
+    except Exception as e:
+        print(f"Error processing {key}: {str(e)}")
+        # In queue mode transient errors are left for SQS to redeliver
+        if raise_errors and classify_error(e) == 'transient':
+            raise
+        move_to_failed_bucket(bucket, key, e)
+        return False
+    return None
+
+def handle_records(event):
+    """Process every S3 record in an ingest event"""
     processed_files = []
     failed_files = []
 
     # Process files from S3 event trigger
     for record in event.get('Records', []):
         if record.get('s3'):
-            bucket = record['s3']['bucket']['name']
-            # URL-decode the key to handle special characters and spaces
-            encoded_key = record['s3']['object']['key']
-            key = urllib.parse.unquote_plus(encoded_key)
-            
-            print(f"Processing event for object - Original key: {encoded_key}")
-            print(f"Decoded key: {key}")
-            
-            # Check if the file exists with retry logic
-            if not check_s3_object_exists_with_retry(bucket, key):
-                print(f"File {key} does not exist in {bucket} after multiple attempts, skipping processing")
+            bucket, key = record_location(record)
+            outcome = process_record(bucket, key)
+            if outcome:
+                processed_files.append(key)
+            elif outcome is False:
                 failed_files.append(key)
+
+    return {
+        'processed': processed_files,
+        'failed': failed_files
+    }
+
+def is_sqs_event(event):
+    """True if the event is a batch of SQS messages rather than S3 notifications"""
+    records = event.get('Records') or []
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+def s3_records_from_message(message):
+    """S3 event records carried in an SQS message body, sent directly or through SNS"""
+    body = json.loads(message.get('body') or '{}')
+    if body.get('Type') == 'Notification' and 'Message' in body:
+        body = json.loads(body['Message'])
+    # S3 sends a test event when the notification is first configured
+    if body.get('Event') == 's3:TestEvent':
+        return []
+    return [record for record in body.get('Records', []) if record.get('s3')]
+
+def handle_sqs_batch(event):
+    """
+    Process a batch of S3 notifications delivered through SQS.
+    Messages are handled INGEST_CONCURRENCY at a time and any that hit a
+    transient error are reported in batchItemFailures, so SQS only redelivers
+    those. Permanent failures go to the failed bucket and are not redelivered.
+    """
+    messages = event.get('Records', [])
+    processed_files = []
+    failed_files = []
+
+    def process_message(message):
+        succeeded = True
+        for record in s3_records_from_message(message):
+            bucket, key = record_location(record)
+            try:
+                outcome = process_record(bucket, key, raise_errors=True)
+            except Exception:
+                failed_files.append(key)
+                succeeded = False
                 continue
-                
+            if outcome:
+                processed_files.append(key)
+            elif outcome is False:
+                failed_files.append(key)
+        return succeeded
+
+    batch_item_failures = []
+    with ThreadPoolExecutor(max_workers=max(1, INGEST_CONCURRENCY)) as executor:
+        # Each worker gets its own copy of the context so spans land in this trace
+        futures = [
+            (message, executor.submit(contextvars.copy_context().run, process_message, message))
+            for message in messages
+        ]
+        for message, future in futures:
             try:
-                # Only process files from the ingestion bucket
-                if bucket == INGESTION_BUCKET:
-                    process_file(bucket, key)
-                    processed_files.append(key)
-                # Process files in the processed bucket with Textract
-                elif bucket == PROCESSED_INGESTION_BUCKET:
-                    extract_and_index_text(bucket, key)
-                    processed_files.append(key)
+                succeeded = future.result()
             except Exception as e:
-                print(f"Error processing {key}: {str(e)}")
-                move_to_failed_bucket(bucket, key)
-                failed_files.append(key)
+                print(f"Error processing message {message.get('messageId')}: {str(e)}")
+                succeeded = False
+            if not succeeded:
+                batch_item_failures.append({"itemIdentifier": message['messageId']})
 
+    print(f"Processed {len(messages)} messages, {len(batch_item_failures)} failed")
     return {
+        'batchItemFailures': batch_item_failures,
         'processed': processed_files,
         'failed': failed_files
     }
 
 def process_file(bucket, key):
-    """Process a single file from the ingestion bucket and move to processed bucket"""
+    """
+    Process a single file from the ingestion bucket and move to processed bucket.
+    Errors are raised for the caller to route to the failed bucket.
+    """
     if key.lower().endswith('.textclipping'):
         print(f"Unsupported file type: {key}")
-        move_to_failed_bucket(bucket, key)
         raise ValueError(f"Unsupported file type: {key}")
 
     try:
-        # Get just the filename without any folder structure
-        filename = os.path.basename(key)
+        # Get just the filename without any folder structure (bar the tenant prefix)
+        filename = processed_key(key)
         
-        # Determine output format
-        if key.lower().endswith(('.heic', '.heif', '.tiff', '.tif')):
-            # Use just the base filename without path for the destination
-            dest_filename = os.path.splitext(filename)[0] + '.jpg'
-            
+        # HEIC/TIFF files are always converted; with OCR_PREPROCESS, JPEG/PNG files are re-encoded
+        # when that shrinks them and copied server side otherwise
+        jpeg_data = None
+        lower_key = key.lower()
+        if lower_key.endswith(CONVERT_EXTENSIONS) or (OCR_PREPROCESS and lower_key.endswith(IMAGE_EXTENSIONS)):
             # Get the file from S3 with retry logic
-            response = get_s3_object_with_retry(bucket, key)
-            image_data = response['Body'].read()
-
-            with io.BytesIO(image_data) as image_bytes:
-                image = Image.open(image_bytes)
+            with span('s3_get'):
+                response = get_s3_object_with_retry(bucket, key)
+                image_data = response['Body'].read()
 
-                if hasattr(image, 'n_frames') and image.n_frames > 1:
-                    image.seek(0)
-
-                if image.mode in ['RGBA', 'P', 'CMYK']:
-                    image = image.convert('RGB')
+            with span('image_convert', input_bytes=len(image_data)) as conversion:
+                if lower_key.endswith(CONVERT_EXTENSIONS):
+                    jpeg_data = prepare_image(image_data)
+                else:
+                    jpeg_data = preprocess_image(image_data)
+                conversion.set(output_bytes=len(jpeg_data) if jpeg_data is not None else len(image_data))
 
-                jpeg_buffer = io.BytesIO()
-                image.save(jpeg_buffer, format='JPEG', quality=95)
-                jpeg_buffer.seek(0)
+        if jpeg_data is not None:
+            # Use just the base filename without path for the destination
+            dest_filename = os.path.splitext(filename)[0] + '.jpg'
 
+            with span('s3_put'):
                 s3_client.put_object(
                     Bucket=PROCESSED_INGESTION_BUCKET,
                     Key=dest_filename,
-                    Body=jpeg_buffer.getvalue(),
-                    ContentType='image/jpeg'
+                    Body=jpeg_data,
+                    ContentType='image/jpeg',
+                    # Carry the retry attempt count over to the converted file
+                    Metadata=response.get('Metadata', {})
                 )
-                
-                print(f"Successfully converted {key} to JPEG and moved to processed bucket as {dest_filename}")
+
+            print(f"Successfully converted {key} to JPEG and moved to processed bucket as {dest_filename}")
         else:
             # For other file types, just copy to processed bucket with just the filename
-            s3_client.copy_object(
-                CopySource={'Bucket': bucket, 'Key': key},
-                Bucket=PROCESSED_INGESTION_BUCKET,
-                Key=filename
-            )
+            with span('s3_copy'):
+                s3_client.copy_object(
+                    CopySource={'Bucket': bucket, 'Key': key},
+                    Bucket=PROCESSED_INGESTION_BUCKET,
+                    Key=filename
+                )
             print(f"Successfully moved {key} to processed bucket as {filename}")
             
     except Exception as e:
         print(f"Error processing file {key}: {str(e)}")
-        move_to_failed_bucket(bucket, key)
         raise e
 
-def extract_and_index_text(bucket, key):
-    """Extract text from image using Textract, generate embeddings, and index in OpenSearch"""
+def prepare_image(image_data):
+    """JPEG bytes for OCR, preprocessed unless OCR_PREPROCESS is off"""
+    if OCR_PREPROCESS:
+        return prepare_for_ocr(image_data)
+    return convert_to_jpeg(image_data)
+
+def preprocess_image(image_data):
+    """
+    OCR-ready JPEG bytes for a JPEG/PNG file Textract could read as it is, or
+    None to keep the original: when it is already within the byte, DPI and
+    pixel budget, or when re-encoding would not make it smaller.
+    """
+    if not OCR_PREPROCESS or not exceeds_ocr_budget(image_data):
+        return None
+    prepared = prepare_for_ocr(image_data)
+    if len(prepared) >= len(image_data) and len(image_data) <= OCR_MAX_BYTES:
+        return None
+    return prepared
+
+def exceeds_ocr_budget(image_data):
+    """Whether image bytes are over OCR_MAX_BYTES, OCR_TARGET_DPI or OCR_MAX_PIXELS; only the header is decoded"""
+    if len(image_data) > OCR_MAX_BYTES:
+        return True
+    with io.BytesIO(image_data) as image_bytes:
+        try:
+            image = Image.open(image_bytes)
+        except UnidentifiedImageError:
+            # Left for Textract to accept or reject, as before preprocessing
+            return False
+        dpi = image.info.get('dpi')
+        if dpi and OCR_TARGET_DPI and max(dpi) > OCR_TARGET_DPI:
+            return True
+        return image.width * image.height > OCR_MAX_PIXELS
+
+def prepare_for_ocr(image_data):
+    """
+    Re-encode image bytes for Textract: apply the EXIF orientation, downsample
+    to the DPI and pixel budget, optionally convert to grayscale, then use the
+    highest JPEG quality that fits under OCR_MAX_BYTES, scaling down further
+    if even the lowest quality is too large.
+    """
+    with io.BytesIO(image_data) as image_bytes:
+        image = Image.open(image_bytes)
+
+        if hasattr(image, 'n_frames') and image.n_frames > 1:
+            image.seek(0)
+
+        # Scans record their DPI; phone photos usually report 72 and are left to the pixel budget
+        scale = 1.0
+        dpi = image.info.get('dpi')
+        if dpi and OCR_TARGET_DPI and max(dpi) > OCR_TARGET_DPI:
+            scale = OCR_TARGET_DPI / float(max(dpi))
+        pixels = image.width * image.height * scale * scale
+        if pixels > OCR_MAX_PIXELS:
+            scale *= math.sqrt(OCR_MAX_PIXELS / pixels)
+        target_pixels = image.width * image.height * scale * scale
+
+        if scale < 1.0 and image.format == 'JPEG':
+            # Let the JPEG decoder downscale while decoding, which is much cheaper
+            image.draft(image.mode, (int(image.width * scale), int(image.height * scale)))
+
+        image = ImageOps.exif_transpose(image)
+
+        # Flatten transparency onto white so it doesn't turn black
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+
+        if OCR_GRAYSCALE:
+            image = image.convert('L')
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        if image.width * image.height > target_pixels:
+            resize = math.sqrt(target_pixels / (image.width * image.height))
+            image = image.resize((max(1, round(image.width * resize)), max(1, round(image.height * resize))),
+                                 Image.LANCZOS)
+
+        qualities = sorted({q for q in (OCR_JPEG_QUALITY, 75, 60) if q <= OCR_JPEG_QUALITY}, reverse=True)
+        for _ in range(5):
+            for quality in qualities:
+                jpeg_buffer = io.BytesIO()
+                image.save(jpeg_buffer, format='JPEG', quality=quality)
+                if jpeg_buffer.tell() <= OCR_MAX_BYTES:
+                    return jpeg_buffer.getvalue()
+            image = image.resize((max(1, round(image.width * 0.75)), max(1, round(image.height * 0.75))),
+                                 Image.LANCZOS)
+
+    raise ValueError(f"Image could not be encoded under {OCR_MAX_BYTES} bytes for Textract")
+
+def convert_to_jpeg(image_data):
+    """Convert HEIC/TIFF image bytes to JPEG bytes"""
+    with io.BytesIO(image_data) as image_bytes:
+        image = Image.open(image_bytes)
+
+        if hasattr(image, 'n_frames') and image.n_frames > 1:
+            image.seek(0)
+
+        if image.mode in ['RGBA', 'P', 'CMYK']:
+            image = image.convert('RGB')
+
+        jpeg_buffer = io.BytesIO()
+        image.save(jpeg_buffer, format='JPEG', quality=95)
+        return jpeg_buffer.getvalue()
+
+def fused_ingest(bucket, key):
+    """
+    Single-pass ingest for INGEST_MODE=fused: convert in memory, send the bytes
+    straight to Textract, embed and index, without going through the processed
+    bucket. With ARCHIVE_PROCESSED the processed copy is written in the
+    background and marked so the processed-bucket trigger skips it.
+    """
+    if key.lower().endswith('.textclipping'):
+        print(f"Unsupported file type: {key}")
+        raise ValueError(f"Unsupported file type: {key}")
+
+    filename = processed_key(key)
+    lower_key = key.lower()
+    pages = None
+    archive = None
+
+    if lower_key.endswith('.pdf'):
+        # Any asynchronous Textract job reads the PDF where it was uploaded
+        archive = start_archive(bucket, key, filename)
+        pages = extract_pdf_pages(bucket, key)
+    elif is_audio(key):
+        archive = start_archive(bucket, key, filename)
+        pages = transcribe_recording(bucket, key, deadline=_deadline.get())
+    elif lower_key.endswith(CONVERT_EXTENSIONS + TEXTRACT_EXTENSIONS):
+        with span('s3_get'):
+            response = get_s3_object_with_retry(bucket, key)
+            image_data = response['Body'].read()
+
+        if lower_key.endswith(CONVERT_EXTENSIONS):
+            filename = os.path.splitext(filename)[0] + '.jpg'
+            with span('image_convert', input_bytes=len(image_data)) as conversion:
+                image_data = prepare_image(image_data)
+                conversion.set(output_bytes=len(image_data))
+        elif lower_key.endswith(IMAGE_EXTENSIONS) and OCR_PREPROCESS:
+            with span('image_convert', input_bytes=len(image_data)) as conversion:
+                prepared = preprocess_image(image_data)
+                if prepared is not None:
+                    filename = os.path.splitext(filename)[0] + '.jpg'
+                    image_data = prepared
+                conversion.set(output_bytes=len(image_data))
+
+        archive = start_archive(bucket, key, filename, body=image_data, metadata=response.get('Metadata', {}))
+        pages = detect_pages({'Bytes': image_data})
+    else:
+        # Nothing to extract; only the archive copy applies
+        archive = start_archive(bucket, key, filename)
+
     try:
-        #TODO: Add support for other file types(.wav. mp3, etc.)
-        if not key.lower().endswith(('.jpg', '.jpeg', '.png', '.pdf')):
-            print(f"Skipping non-image/PDF file for Textract: {key}")
+        if pages is not None:
+            # Index under the same name and location the staged pipeline would use
+            doc_bucket, doc_key = (PROCESSED_INGESTION_BUCKET, filename) if ARCHIVE_PROCESSED else (bucket, key)
+            save_sidecar(doc_bucket, doc_key, pages)
+            indexed = index_pages(doc_bucket, doc_key, pages)
+            if indexed is None:
+                print(f"No text extracted from {key}")
+            elif not indexed:
+                raise Exception(f"Failed to index text from {key}")
+    finally:
+        if archive:
+            try:
+                archive.result()
+            except Exception as e:
+                print(f"Error archiving {key} to processed bucket: {str(e)}")
+
+def start_archive(bucket, key, filename, body=None, metadata=None):
+    """
+    Copy (or upload the converted bytes of) a fused-mode file to the processed
+    bucket in the background. Returns a future, or None if archiving is off.
+    """
+    if not ARCHIVE_PROCESSED:
+        return None
+
+    def archive():
+        with span('s3_archive'):
+            if body is not None:
+                s3_client.put_object(
+                    Bucket=PROCESSED_INGESTION_BUCKET,
+                    Key=filename,
+                    Body=body,
+                    ContentType='image/jpeg' if filename.lower().endswith(('.jpg', '.jpeg')) else 'image/png',
+                    Metadata={**(metadata or {}), 'ingest-indexed': 'true'}
+                )
+            else:
+                head = s3_client.head_object(Bucket=bucket, Key=key)
+                s3_client.copy_object(
+                    CopySource={'Bucket': bucket, 'Key': key},
+                    Bucket=PROCESSED_INGESTION_BUCKET,
+                    Key=filename,
+                    Metadata={**head.get('Metadata', {}), 'ingest-indexed': 'true'},
+                    MetadataDirective='REPLACE',
+                    ContentType=head.get('ContentType', 'application/octet-stream')
+                )
+        print(f"Archived {key} to processed bucket as {filename}")
+
+    return _archive_executor.submit(contextvars.copy_context().run, archive)
+
+def is_fused_archive(bucket, key):
+    """True if the object is a fused-mode archive copy that was already indexed"""
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    return head.get('Metadata', {}).get('ingest-indexed') == 'true'
+
+def save_sidecar(bucket, key, pages):
+    """Persist the extracted pages so re-indexing never needs OCR again; failures are only logged"""
+    if not SIDECAR_ENABLED:
+        return
+    try:
+        with span('sidecar_write', pages=len(pages)):
+            destination = write_sidecar(bucket, key, pages)
+        print(f"Wrote text sidecar for {key} to {SIDECAR_BUCKET}/{destination}")
+    except Exception as e:
+        print(f"Error writing text sidecar for {key}: {str(e)}")
+
+def detect_pages(document, page_number=None):
+    """Synchronous Textract OCR of an image given as {'Bytes': ...} or {'S3Object': ...}"""
+    with span('textract_detect'):
+        textract_limiter.acquire()
+        response = textract_client.detect_document_text(Document=document)
+    return pages_from_blocks(response["Blocks"], page_number)
+
+def extract_pdf_pages(bucket, key):
+    """
+    Pages of a PDF in order: the embedded text layer where there is one,
+    with Textract OCR only for the pages that are scanned images.
+    """
+    if PDF_TEXT_LAYER:
+        pages, reader, scanned = read_pdf_text_layer(bucket, key)
+        if scanned is not None and len(scanned) <= PDF_SYNC_OCR_MAX_PAGES:
+            print(f"PDF {key}: {len(pages)} pages, {len(scanned)} need OCR")
+            ocr_pages = ocr_pdf_pages(reader, scanned)
+            if ocr_pages is not None:
+                for number, page in ocr_pages.items():
+                    pages[number] = page
+                return pages
+            print(f"PDF {key} has scanned pages too large for synchronous Textract, using an asynchronous Textract job")
+        elif scanned is not None:
+            print(f"PDF {key} has {len(scanned)} scanned pages, using an asynchronous Textract job")
+
+    return textract_pdf_pages(bucket, key)
+
+def read_pdf_text_layer(bucket, key):
+    """
+    Extract the text layer of a PDF page by page.
+    Returns (pages, reader, indices of the pages that need OCR), or
+    (None, None, None) if the PDF is too large or can't be parsed.
+    """
+    with span('s3_get'):
+        response = get_s3_object_with_retry(bucket, key)
+        if response.get('ContentLength', 0) > PDF_TEXT_LAYER_MAX_BYTES:
+            response['Body'].close()
+            print(f"PDF {key} is too large for text layer extraction, using Textract")
+            return None, None, None
+        pdf_data = response['Body'].read()
+
+    try:
+        with span('pdf_text_layer', input_bytes=len(pdf_data)) as analysis:
+            reader = PdfReader(io.BytesIO(pdf_data))
+            pages = [pdf_page_lines(page, number + 1) for number, page in enumerate(reader.pages)]
+            scanned = [
+                number for number, (page, extracted) in enumerate(zip(reader.pages, pages))
+                if page_needs_ocr(page, pages_text([extracted]))
+            ]
+            analysis.set(pages=len(pages), scanned_pages=len(scanned))
+        return pages, reader, scanned
+    except Exception as e:
+        print(f"Could not read the text layer of PDF {key}, using Textract: {str(e)}")
+        return None, None, None
+
+def pdf_page_lines(page, page_number):
+    """Text layer of a PDF page in the same page layout as Textract results (without geometry)"""
+    lines = [line.strip() for line in (page.extract_text() or "").splitlines()]
+    return {"page": page_number, "source": "text_layer", "lines": [{"text": line} for line in lines if line]}
+
+def page_needs_ocr(page, text):
+    """
+    Heuristic for pages whose text has to come from OCR: little or no text
+    layer on a page that has images, or a text layer that is mostly
+    unprintable (fonts without a usable Unicode mapping).
+    """
+    content = text.strip()
+    if content:
+        readable = sum(1 for char in content if char.isalnum() or char.isspace() or char in '.,;:!?\'"()-%$/')
+        if readable / len(content) < 0.7:
+            return True
+    if len(content) >= PDF_MIN_PAGE_CHARS:
+        return False
+    return page_has_images(page)
+
+def page_has_images(page):
+    """True if the page draws any image XObjects, checked without decoding them"""
+    resources = page.get('/Resources')
+    resources = resources.get_object() if resources is not None else {}
+    xobjects = resources.get('/XObject')
+    if xobjects is None:
+        return False
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        if xobject.get('/Subtype') == '/Image':
+            return True
+        # Scanners sometimes wrap the image in a form XObject
+        if xobject.get('/Subtype') == '/Form' and page_has_images(xobject):
+            return True
+    return False
+
+def single_page_pdf(reader, number):
+    """One page of a PDF as a PDF of its own"""
+    writer = PdfWriter()
+    writer.add_page(reader.pages[number])
+    page_buffer = io.BytesIO()
+    writer.write(page_buffer)
+    return page_buffer.getvalue()
+
+def ocr_pdf_pages(reader, page_numbers):
+    """
+    OCR single pages of a PDF with the synchronous API; returns {page index: page},
+    or None if a page is too large for it and the document needs an asynchronous job
+    """
+    if not page_numbers:
+        return {}
+
+    page_data = {number: single_page_pdf(reader, number) for number in page_numbers}
+    oversized = [number + 1 for number, data in page_data.items() if len(data) > TEXTRACT_SYNC_MAX_BYTES]
+    if oversized:
+        print(f"Pages {oversized} are too large for synchronous Textract")
+        return None
+
+    def ocr_page(number):
+        # A single-page request always reports page 1; keep the page's place in the document
+        return detect_pages({'Bytes': page_data[number]}, page_number=number + 1)[0]
+
+    with span('pdf_page_ocr', pages=len(page_numbers)):
+        with ThreadPoolExecutor(max_workers=max(1, min(PDF_OCR_CONCURRENCY, len(page_numbers)))) as executor:
+            pages = executor.map(
+                lambda number: contextvars.copy_context().run(ocr_page, number), page_numbers
+            )
+            return dict(zip(page_numbers, pages))
+
+def textract_pdf_pages(bucket, key):
+    """Run an asynchronous Textract text detection job on a PDF in S3 and return its pages"""
+    print(f"Starting asynchronous Textract job for PDF: {key}")
+
+    # Start the asynchronous job
+    with span('textract_start'):
+        textract_limiter.acquire()
+        response = textract_client.start_document_text_detection(
+            DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
+        )
+    job_id = response['JobId']
+    print(f"Started Textract job with ID: {job_id}")
+
+    # Wait for the job to complete
+    status = 'IN_PROGRESS'
+    with span('textract_poll') as poll:
+        polls = 0
+        while status == 'IN_PROGRESS':
+            time.sleep(TEXTRACT_POLL_INTERVAL)
+            textract_limiter.acquire()
+            response = textract_client.get_document_text_detection(JobId=job_id)
+            status = response['JobStatus']
+            polls += 1
+            print(f"Textract job status: {status}")
+        poll.set(polls=polls)
+
+    if status != 'SUCCEEDED':
+        print(f"Textract job failed with status: {status}")
+        raise Exception(f"Textract job failed with status: {status}")
+
+    # Get the first page of results, then any further pages
+    blocks = list(response['Blocks'])
+    next_token = response.get('NextToken', None)
+    with span('textract_results'):
+        while next_token:
+            textract_limiter.acquire()
+            response = textract_client.get_document_text_detection(
+                JobId=job_id,
+                NextToken=next_token
+            )
+            blocks.extend(response['Blocks'])
+            next_token = response.get('NextToken', None)
+
+    print(f"Successfully extracted text from PDF: {key}")
+    return pages_from_blocks(blocks)
+
+def extract_and_index_text(bucket, key, raise_errors=False):
+    """
+    Extract text from an image or PDF using Textract, or transcribe an audio
+    file, then generate embeddings and index in OpenSearch.
+    Errors are logged and swallowed unless raise_errors is set.
+    """
+    try:
+        if not key.lower().endswith(TEXTRACT_EXTENSIONS) and not is_audio(key):
+            print(f"Skipping file with no text to extract: {key}")
             return
         
         # Verify the file exists before processing with retry logic
@@ -218,141 +774,334 @@ def extract_and_index_text(bucket, key):
             print(f"File {key} does not exist in {bucket} after multiple attempts, skipping text extraction")
             return
             
-        # Call Amazon Textract to extract text - use appropriate method for file type
-        if key.lower().endswith('.pdf'):
-            # For PDFs, we need to use the asynchronous API
-            print(f"Starting asynchronous Textract job for PDF: {key}")
-            
-            # Start the asynchronous job
-            response = textract_client.start_document_text_detection(
-                DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
-            )
-            job_id = response['JobId']
-            print(f"Started Textract job with ID: {job_id}")
-            
-            # Wait for the job to complete
-            status = 'IN_PROGRESS'
-            while status == 'IN_PROGRESS':
-                time.sleep(5)
-                response = textract_client.get_document_text_detection(JobId=job_id)
-                status = response['JobStatus']
-                print(f"Textract job status: {status}")
-            
-            if status == 'SUCCEEDED':
-                # Get all pages of results
-                extracted_text = ""
-                pages = []
-                
-                # Get the first page of results
-                pages.append(response)
-                
-                # If there are more pages, get them
-                next_token = response.get('NextToken', None)
-                while next_token:
-                    response = textract_client.get_document_text_detection(
-                        JobId=job_id,
-                        NextToken=next_token
-                    )
-                    pages.append(response)
-                    next_token = response.get('NextToken', None)
-                
-                # Extract text from all pages
-                for page in pages:
-                    for item in page['Blocks']:
-                        if item['BlockType'] == 'LINE':
-                            extracted_text += item['Text'] + "\n"
-                
-                # Continue with the extracted text
-                print(f"Successfully extracted text from PDF: {key}")
-            else:
-                print(f"Textract job failed with status: {status}")
-                raise Exception(f"Textract job failed with status: {status}")
+        # Fused mode archives files it has already indexed
+        if INGEST_MODE == 'fused' and is_fused_archive(bucket, key):
+            print(f"Skipping {key}, already indexed by fused ingest")
+            return
+
+        # Extract the text - use the appropriate method for the file type
+        if is_audio(key):
+            # Recordings are split and the segments transcribed in parallel
+            pages = transcribe_recording(bucket, key, deadline=_deadline.get())
+        elif key.lower().endswith('.pdf'):
+            # For PDFs, read the text layer and OCR scanned pages
+            pages = extract_pdf_pages(bucket, key)
         else:
             # For images, use the synchronous API
-            response = textract_client.detect_document_text(
-                Document={'S3Object': {'Bucket': bucket, 'Name': key}}
-            )
-            
-            # Extract text blocks
-            extracted_text = ""
-            for item in response["Blocks"]:
-                if item["BlockType"] == "LINE":
-                    extracted_text += item["Text"] + "\n"
-        
-        if extracted_text.strip():
-            # Generate embeddings using Bedrock
-            print(f"Generating embeddings for extracted text from {key}")
-            vector_embedding = get_embeddings(extracted_text)
-            
-            if not vector_embedding:
-                print(f"Failed to generate embeddings for {key}, skipping indexing")
-                return
-                
-            # Index the extracted text and embeddings in OpenSearch
-            document = {
-                "filename": os.path.basename(key),  # Just use the filename without path
-                "text": extracted_text,  # Text field for search
-                "vector": vector_embedding,  # Vector field for semantic search
-                "text-metadata": json.dumps({  # Metadata about the document
-                    "source_bucket": bucket,
-                    "source_key": key,
-                    "extraction_time": datetime.datetime.now().isoformat(),
-                    "file_type": os.path.splitext(key)[1][1:].lower()
-                })
-            }
-            
-            # Check if OpenSearch endpoint is configured
-            if not opensearch_endpoint:
-                print("ERROR: OpenSearch endpoint is not configured. Cannot index document.")
-                return
-                
-            # Create a safe document ID using just the filename
-            index_id = sanitize_id(os.path.basename(key))
-            
-            # Force the https:// scheme if not present
-            endpoint = opensearch_endpoint
-            if not endpoint.startswith(('http://', 'https://')):
-                endpoint = f"https://{endpoint}"
-                
-            # Ensure the URL is properly formed
-            url = f"{endpoint}/documents/_doc/{index_id}"
-            
-            print(f"Indexing document with embeddings to OpenSearch URL: {url}")
-            headers = {"Content-Type": "application/json"}
-            
-            try:
-                response = requests.put(url, headers=headers, data=json.dumps(document))
-                if response.status_code >= 200 and response.status_code < 300:
-                    print(f"Successfully indexed text and embeddings from {key}")
-                else:
-                    print(f"Failed to index text from {key}: {response.status_code} - {response.text}")
-            except requests.exceptions.RequestException as e:
-                print(f"ERROR: Failed to connect to OpenSearch: {str(e)}")
-        else:
+            pages = detect_pages({'S3Object': {'Bucket': bucket, 'Name': key}})
+
+        save_sidecar(bucket, key, pages)
+        indexed = index_pages(bucket, key, pages)
+        if indexed is None:
             print(f"No text extracted from {key}")
+        elif not indexed and raise_errors:
+            raise Exception(f"Failed to index text from {key}")
     except Exception as e:
         print(f"Error extracting or indexing text from {key}: {str(e)}")
+        if raise_errors:
+            raise
         # Don't raise the exception to allow processing to continue
 
-def move_to_failed_bucket(source_bucket, key):
-    """Move failed files to the failed ingestion bucket"""
+_created_indices = set()
+
+def index_pages(bucket, key, pages, extraction_time=None, targets=None):
+    """
+    Index extracted pages: as one document, or for a transcribed recording
+    one document per segment, with the segment's position and time range.
+    Returns True if everything was written and None if there was no text.
+    """
+    if not pages_text(pages).strip():
+        return None
+    if not all('start' in page for page in pages):
+        return index_document(bucket, key, pages_text(pages), extraction_time, targets)
+
+    def index_segment(page):
+        return index_document(bucket, key, pages_text([page]), extraction_time, targets,
+                              {"segment": page["page"], "start_time": page["start"], "end_time": page["end"]})
+
+    segments = [page for page in pages if pages_text([page]).strip()]
+    # The first write creates any missing index; the rest go in parallel
+    if not index_segment(segments[0]):
+        return False
+    with ThreadPoolExecutor(max_workers=max(1, min(INGEST_CONCURRENCY, len(segments)))) as executor:
+        indexed = executor.map(lambda page: contextvars.copy_context().run(index_segment, page), segments[1:])
+        return all(list(indexed))
+
+def index_document(bucket, key, extracted_text, extraction_time=None, targets=None, segment=None):
+    """
+    Generate embeddings for the extracted text and index it in OpenSearch.
+    The document is written once per write target, so during an embedding
+    model migration it lands in both the live index and the new one.
+    Re-index jobs pass the original extraction time and their own targets.
+    Segments of a recording pass their position and time range in `segment`;
+    each is its own document, with the segment number in its ID.
+    Near-duplicates of an indexed document are linked or skipped before any
+    embedding is generated. With tenancy on, the document goes to its
+    tenant's index or is routed by tenant (see common/tenancy.py).
+    Returns True if every target was written.
+    """
+    # Check if OpenSearch endpoint is configured
+    if not opensearch_endpoint:
+        print("ERROR: OpenSearch endpoint is not configured. Cannot index document.")
+        return False
+
+    endpoint = normalize_endpoint(opensearch_endpoint)
+    tenant = tenant_from_key(key) if tenancy_enabled() else None
+    tenant_index, routing = tenant_scope(tenant)
+    # Create a safe document ID using just the filename
+    index_id = tenant_doc_id(tenant, sanitize_id(os.path.basename(key)))
+    if segment:
+        index_id = f"{index_id}-seg{segment['segment']:04d}"
+    headers = {"Content-Type": "application/json"}
+    indexed_all = True
+    if not targets:
+        targets = write_targets(tenant_index, endpoint)
+        # A tenant's own index is created the first time it is written to
+        if TENANT_MODE == 'index' and not ensure_tenant_index(endpoint, tenant, targets[0][1], targets[0][2]):
+            return False
+    metadata = {**metadata_fields(bucket, key, extraction_time), **tenant_fields(tenant), **(segment or {})}
+
+    dedup_fields = None
+    if DEDUP_ENABLED:
+        with span('dedup'):
+            dedup_fields = fingerprint(extracted_text)
+            # The first target is the live index every other target mirrors
+            duplicate = dedup_fields and find_duplicate(endpoint, targets[0][0], dedup_fields, exclude_id=index_id,
+                                                        tenant=tenant, routing=routing, session=http)
+        if duplicate:
+            original_id, original_filename, similarity = duplicate
+            print(f"{key} is a near-duplicate of {original_filename} (similarity {similarity:.2f})")
+            if DEDUP_ACTION == 'skip':
+                return True
+            return link_duplicate(endpoint, targets, key, index_id, metadata, original_id, similarity, routing)
+
+    for position, (index, model_id, dimension) in enumerate(targets):
+        # Generate embeddings using Bedrock
+        print(f"Generating {model_id} embeddings for extracted text from {key}")
+        with span('embedding', model=model_id):
+            vector_embedding = get_embeddings(extracted_text, model_id=model_id, dimension=dimension)
+
+        if not vector_embedding:
+            print(f"Failed to generate {model_id} embeddings for {key}, skipping index {index}")
+            indexed_all = False
+            continue
+
+        # Migration targets are created on first use with the right mapping
+        if position > 0 and index not in _created_indices:
+            if not create_index(endpoint, index, model_id, dimension):
+                indexed_all = False
+                continue
+            _created_indices.add(index)
+
+        # Index the extracted text and embeddings in OpenSearch
+        document = {
+            "filename": os.path.basename(key),  # Just use the filename without path
+            "text": extracted_text,  # Text field for search
+            "vector": vector_embedding,  # Vector field for semantic search
+            "text-metadata": json.dumps(metadata),  # Metadata about the document
+            **metadata,  # The same metadata as filterable fields
+            **embedding_fields(model_id, dimension),
+            **(dedup_fields or {})
+        }
+
+        url = f"{endpoint}/{index}/_doc/{index_id}{routing_param(routing)}"
+        print(f"Indexing document with embeddings to OpenSearch URL: {url}")
+
+        try:
+            with span('opensearch_index', index=index):
+                response = http.put(url, headers=headers, data=json.dumps(document))
+            if response.status_code >= 200 and response.status_code < 300:
+                print(f"Successfully indexed text and embeddings from {key} into {index}")
+            else:
+                print(f"Failed to index text from {key}: {response.status_code} - {response.text}")
+                indexed_all = False
+        except requests.exceptions.RequestException as e:
+            print(f"ERROR: Failed to connect to OpenSearch: {str(e)}")
+            indexed_all = False
+
+    return indexed_all
+
+def link_duplicate(endpoint, targets, key, index_id, metadata, original_id, similarity, routing=None):
+    """
+    Index a near-duplicate as a pointer to the original: no text and no
+    vector, so it stays out of search results and costs no embedding call.
+    Returns True if every target was written.
+    """
+    document = {
+        "filename": os.path.basename(key),
+        "duplicate_of": original_id,
+        "duplicate_similarity": round(similarity, 3),
+        "text-metadata": json.dumps(metadata),
+        **metadata
+    }
+    linked_all = True
+    for position, (index, model_id, dimension) in enumerate(targets):
+        if position > 0 and index not in _created_indices:
+            if not create_index(endpoint, index, model_id, dimension):
+                linked_all = False
+                continue
+            _created_indices.add(index)
+        try:
+            with span('opensearch_index', index=index):
+                response = http.put(f"{endpoint}/{index}/_doc/{index_id}{routing_param(routing)}",
+                                        headers={"Content-Type": "application/json"}, data=json.dumps(document))
+            if response.status_code >= 300:
+                print(f"Failed to link duplicate {key} in {index}: {response.status_code} - {response.text}")
+                linked_all = False
+        except requests.exceptions.RequestException as e:
+            print(f"ERROR: Failed to connect to OpenSearch: {str(e)}")
+            linked_all = False
+    if linked_all:
+        print(f"Linked {key} to {original_id} without embedding it")
+    return linked_all
+
+def classify_error(error):
+    """'transient' for errors worth retrying later, 'permanent' for files that will never ingest"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict) and 'Error' in response:
+        code = response['Error'].get('Code', '')
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return 'transient' if code in TRANSIENT_ERROR_CODES or status >= 500 else 'permanent'
+    if isinstance(error, requests.exceptions.RequestException):
+        return 'transient'
+    # Unsupported file types, and files Pillow or pypdf can't open or decode
+    if isinstance(error, (ValueError, SyntaxError, Image.UnidentifiedImageError, Image.DecompressionBombError,
+                          PyPdfError)):
+        return 'permanent'
+    if isinstance(error, OSError) and raised_in_pillow(error):
+        # Truncated or corrupt image data
+        return 'permanent'
+    return 'transient'
+
+def raised_in_pillow(error):
+    """Whether an exception was raised from inside Pillow"""
+    traceback = error.__traceback__
+    if traceback is None:
+        return False
+    while traceback.tb_next:
+        traceback = traceback.tb_next
+    return traceback.tb_frame.f_globals.get('__name__', '').startswith('PIL.')
+
+def retry_delay(attempts):
+    """Exponential backoff before the next attempt, capped at INGEST_RETRY_MAX_DELAY"""
+    return min(INGEST_RETRY_MAX_DELAY, INGEST_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+def move_to_failed_bucket(source_bucket, key, error=None):
+    """
+    Move a failed file to the failed ingestion bucket and delete the original.
+    The attempt count and error class are kept in the object metadata.
+    Transient failures go under retry/ with a backoff deadline for
+    retry_failed_files; permanent failures and files that have used up
+    INGEST_MAX_ATTEMPTS go under quarantine/ and are never retried.
+    """
     try:
         # Check if the file exists in the source bucket with retry logic
         if not check_s3_object_exists_with_retry(source_bucket, key, max_retries=2):
             print(f"File {key} does not exist in {source_bucket} after multiple attempts, skipping move to failed bucket")
             return
-            
-        # Get just the filename without any folder structure
-        filename = os.path.basename(key)
-        
-        # If we get here, the file exists and we can try to copy it
+
+        head = s3_client.head_object(Bucket=source_bucket, Key=key)
+        metadata = dict(head.get('Metadata', {}))
+        attempts = int(metadata.get('ingest-attempts', 0)) + 1
+        error_class = classify_error(error) if error is not None else 'transient'
+        if error_class == 'permanent' or attempts >= INGEST_MAX_ATTEMPTS:
+            state = QUARANTINE_PREFIX
+        else:
+            state = RETRY_PREFIX
+
+        # S3 metadata values must be ASCII
+        error_message = f"{type(error).__name__}: {str(error)}" if error is not None else 'unknown'
+        metadata.update({
+            'ingest-attempts': str(attempts),
+            'ingest-error-class': error_class,
+            'ingest-error': error_message.encode('ascii', 'ignore').decode()[:512],
+            'ingest-failed-at': str(int(time.time())),
+        })
+        if state == RETRY_PREFIX:
+            metadata['ingest-next-attempt'] = str(int(time.time() + retry_delay(attempts)))
+        else:
+            metadata.pop('ingest-next-attempt', None)
+
+        failed_key = f"{state}/{source_bucket}/{key}"
         s3_client.copy_object(
             CopySource={'Bucket': source_bucket, 'Key': key},
             Bucket=FAILED_INGESTION_BUCKET,
-            Key=filename
+            Key=failed_key,
+            Metadata=metadata,
+            MetadataDirective='REPLACE',
+            ContentType=head.get('ContentType', 'application/octet-stream')
         )
-        print(f"Moved failed file {key} to failed bucket as {filename}")
-        
-        #TODO: Delete the original file after copying to failed bucket
+        # Only delete once the copy exists: a crash in between leaves a
+        # duplicate for the next run rather than losing the file
+        s3_client.delete_object(Bucket=source_bucket, Key=key)
+        print(f"Moved failed file {key} to {FAILED_INGESTION_BUCKET}/{failed_key} "
+              f"(attempt {attempts}/{INGEST_MAX_ATTEMPTS}, {error_class})")
     except Exception as e:
-        print(f"Error moving failed file {key} to failed bucket: {str(e)}")
\ No newline at end of file
+        print(f"Error moving failed file {key} to failed bucket: {str(e)}")
+
+def retry_failed_files(now=None, deadline=None, limit=INGEST_RETRY_BATCH):
+    """
+    Requeue failed files whose backoff has elapsed by copying them back to
+    their source bucket, which triggers ingestion again. Runs on a schedule.
+    Each run stops after limit files or shortly before the deadline (epoch
+    seconds); the next run picks up the rest.
+    """
+    now = now or time.time()
+    requeued = []
+    waiting = 0
+    complete = True
+    list_args = {'Bucket': FAILED_INGESTION_BUCKET, 'Prefix': f"{RETRY_PREFIX}/"}
+
+    while complete:
+        page = s3_client.list_objects_v2(**list_args)
+        for item in page.get('Contents', []):
+            if len(requeued) >= limit or (deadline and time.time() > deadline - INGEST_RETRY_TIME_MARGIN):
+                complete = False
+                break
+            failed_key = item['Key']
+            try:
+                if requeue_failed_file(failed_key, now):
+                    requeued.append(failed_key)
+                else:
+                    waiting += 1
+            except Exception as e:
+                print(f"Error requeueing failed file {failed_key}: {str(e)}")
+        if not page.get('IsTruncated'):
+            break
+        list_args['ContinuationToken'] = page['NextContinuationToken']
+
+    print(f"Requeued {len(requeued)} failed files, {waiting} still backing off"
+          f"{'' if complete else '; stopped early, the rest wait for the next run'}")
+    return {
+        'requeued': requeued,
+        'waiting': waiting,
+        'complete': complete
+    }
+
+def requeue_failed_file(failed_key, now):
+    """Copy one retry/ file back to its source bucket if it is due. Returns True if requeued"""
+    head = s3_client.head_object(Bucket=FAILED_INGESTION_BUCKET, Key=failed_key)
+    metadata = head.get('Metadata', {})
+    if float(metadata.get('ingest-next-attempt', 0)) > now:
+        return False
+
+    _, source_bucket, source_key = failed_key.split('/', 2)
+    # Keep the attempt count so the next failure is counted against the limit
+    source_metadata = {
+        name: value for name, value in metadata.items()
+        if name == 'ingest-attempts' or not name.startswith('ingest-')
+    }
+    s3_client.copy_object(
+        CopySource={'Bucket': FAILED_INGESTION_BUCKET, 'Key': failed_key},
+        Bucket=source_bucket,
+        Key=source_key,
+        Metadata=source_metadata,
+        MetadataDirective='REPLACE',
+        ContentType=head.get('ContentType', 'application/octet-stream')
+    )
+    s3_client.delete_object(Bucket=FAILED_INGESTION_BUCKET, Key=failed_key)
+    print(f"Requeued {failed_key} to {source_bucket}/{source_key} (attempt {int(metadata.get('ingest-attempts', 0)) + 1})")
+    return True
+
+
+warm_up_on_init(__name__, warm_up_container)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Rebuild index documents from the text sidecars written at ingest.
+
+Reads every sidecar under the given prefix, re-embeds its text and writes
+the document again, without touching Textract. Documents go to the current
+write targets, or to a single index with --index (created if missing), e.g.
+when changing embedding model, chunking or index layout.
+
+    cd lambda_services
+    python -m image_conversion_service.reindex_from_sidecars --workers 8
+    python -m image_conversion_service.reindex_from_sidecars --index documents-v3 --model amazon.titan-embed-text-v2:0 --dimension 512
+"""
+
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from common.embeddings import create_index, model_dimension, normalize_endpoint, EMBEDDING_MODEL_ID
+from common.sidecars import list_sidecars, read_sidecar, SIDECAR_BUCKET
+from image_conversion_service import ingest
+
+
+def reindex_sidecar(sidecar_key, targets=None):
+    """Index one document from its sidecar. Returns 'indexed', 'empty' or 'failed'"""
+    try:
+        header, pages = read_sidecar(sidecar_key)
+        # Transcribed recordings are re-indexed segment by segment
+        indexed = ingest.index_pages(header['source_bucket'], header['source_key'], pages,
+                                     extraction_time=header.get('extracted_at'), targets=targets)
+        if indexed is None:
+            return 'empty'
+        return 'indexed' if indexed else 'failed'
+    except Exception as e:
+        print(f"Error re-indexing from {sidecar_key}: {str(e)}")
+        return 'failed'
+
+
+def reindex(prefix='', targets=None, workers=8):
+    """Re-index every sidecar under prefix with a pool of workers"""
+    counts = {'indexed': 0, 'empty': 0, 'failed': 0}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for outcome in executor.map(lambda key: reindex_sidecar(key, targets), list_sidecars(prefix)):
+            counts[outcome] += 1
+            done = sum(counts.values())
+            if done % 100 == 0:
+                print(f"Re-index progress: {counts} ({done / (time.time() - start):.1f} docs/s)")
+    return counts
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Rebuild index documents from ingest text sidecars')
+    parser.add_argument('--prefix', '-p', type=str, default='', help='Only sidecars for keys under this prefix')
+    parser.add_argument('--index', '-i', type=str, help='Write to this index instead of the current write targets')
+    parser.add_argument('--model', '-m', type=str, default=EMBEDDING_MODEL_ID, help='Embedding model for --index')
+    parser.add_argument('--dimension', '-d', type=int, help='Embedding dimension for --index')
+    parser.add_argument('--workers', '-w', type=int, default=8, help='Documents processed in parallel')
+    args = parser.parse_args()
+
+    targets = None
+    if args.index:
+        dimension = model_dimension(args.model, args.dimension)
+        if not create_index(normalize_endpoint(ingest.opensearch_endpoint), args.index, args.model, dimension):
+            return
+        targets = [(args.index, args.model, dimension)]
+
+    print(f"Re-indexing sidecars from {SIDECAR_BUCKET} with {args.workers} workers")
+    counts = reindex(args.prefix, targets, args.workers)
+    print(f"Re-index complete: {counts}")
+
+
+if __name__ == "__main__":
+    main()
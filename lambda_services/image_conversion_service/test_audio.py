@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Test script for splitting and stitching recordings (common/audio.py).
+Runs offline: no AWS calls are made. Run directly or with pytest.
+"""
+
+import os
+import sys
+import tempfile
+
+# The shared modules live in lambda_services/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import common.audio as audio
+from common.audio import plan_segments, mp3_frame, mp3_frames, split_mp3, transcript_lines, LEVEL_WINDOW
+
+# MPEG-1 layer III, 128 kbit/s, 44.1 kHz, no CRC: 417 bytes (418 padded) and 1152 samples per frame
+MP3_HEADER = 0xFFFB9000
+MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def levels_with_pauses(duration, pauses, loud=-10.0, quiet=-60.0):
+    """A LEVEL_WINDOW level track at `loud` dBFS with silences at the given (start, end) seconds"""
+    levels = [loud] * int(duration / LEVEL_WINDOW)
+    for start, end in pauses:
+        for i in range(int(start / LEVEL_WINDOW), int(end / LEVEL_WINDOW)):
+            levels[i] = quiet
+    return levels
+
+
+def mp3_bytes(frame_count, id3_size=0):
+    """An MP3 stream of frame_count silent frames, after an ID3v2 tag with id3_size bytes of body"""
+    data = b''
+    if id3_size:
+        size = bytes([(id3_size >> shift) & 0x7f for shift in (21, 14, 7, 0)])
+        data = b'ID3\x04\x00\x00' + size + b'\x00' * id3_size
+    length, _ = mp3_frame(MP3_HEADER)
+    frame = MP3_HEADER.to_bytes(4, 'big') + b'\x00' * (length - 4)
+    return data + frame * frame_count
+
+
+def test_plan_segments_cuts_in_pauses():
+    """Cuts land in the pause nearest each AUDIO_SEGMENT_SECONDS boundary, and segments tile the recording"""
+    duration = 900.0
+    pauses = [(290.0, 292.0), (318.0, 320.0), (612.0, 613.0)]
+    segments = plan_segments(levels_with_pauses(duration, pauses), duration)
+
+    assert segments[0][0] == 0.0 and segments[-1][1] == duration
+    for (_, end), (start, _) in zip(segments, segments[1:]):
+        assert end == start
+    cuts = [end for _, end in segments[:-1]]
+    assert len(cuts) == 2, segments
+    # 292 is nearer the 300 s boundary than 318, and the second cut is measured from the first
+    assert 290.0 <= cuts[0] <= 292.0, cuts
+    assert 612.0 <= cuts[1] <= 613.0, cuts
+
+
+def test_plan_segments_quietest_point_without_pause():
+    """With nothing under AUDIO_SILENCE_DB, the cut goes at the quietest window within AUDIO_CUT_WINDOW"""
+    duration = 400.0
+    levels = levels_with_pauses(duration, [])
+    quietest = int(310.0 / LEVEL_WINDOW)
+    levels[quietest] = -30.0
+    segments = plan_segments(levels, duration)
+    assert segments == [(0.0, (quietest + 0.5) * LEVEL_WINDOW), ((quietest + 0.5) * LEVEL_WINDOW, duration)]
+
+
+def test_plan_segments_keeps_short_remainder():
+    """A recording up to AUDIO_SEGMENT_SECONDS + AUDIO_CUT_WINDOW long stays one segment"""
+    duration = audio.AUDIO_SEGMENT_SECONDS + audio.AUDIO_CUT_WINDOW
+    assert plan_segments(levels_with_pauses(duration, [(150.0, 151.0)]), duration) == [(0.0, duration)]
+
+
+def test_mp3_frame():
+    """Frame length and duration from the header; padding adds a byte, invalid headers give (0, 0)"""
+    assert mp3_frame(MP3_HEADER) == (417, MP3_FRAME_SECONDS)
+    assert mp3_frame(MP3_HEADER | 1 << 9) == (418, MP3_FRAME_SECONDS)
+    # MPEG-2 layer III frames hold 576 samples
+    assert mp3_frame(0xFFF39000)[1] == 576 / 22050
+    assert mp3_frame(0x12345678) == (0, 0)
+    # Free-format bitrate and the reserved sample rate aren't supported
+    assert mp3_frame(0xFFFB0000) == (0, 0)
+    assert mp3_frame(0xFFFB9C00) == (0, 0)
+
+
+def test_mp3_frames_skip_id3_and_junk():
+    """Frames are found after an ID3 tag and resynchronised after junk bytes"""
+    data = mp3_bytes(3, id3_size=100)
+    frames = mp3_frames(data[:110 + 417] + b'junk' + data[110 + 417:])
+    assert [offset for offset, _ in frames] == [110, 110 + 417 + 4, 110 + 2 * 417 + 4]
+
+
+def test_split_mp3_segments():
+    """MP3 segments are cut between frames, cover the whole file in order and keep short remainders"""
+    saved = audio.AUDIO_SEGMENT_SECONDS, audio.AUDIO_CUT_WINDOW
+    audio.AUDIO_SEGMENT_SECONDS, audio.AUDIO_CUT_WINDOW = 1.0, 0.3
+    with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
+        # 3.2 s: segments of 1 s, and a 0.2 s remainder joins the last one
+        f.write(mp3_bytes(int(3.2 / MP3_FRAME_SECONDS), id3_size=20))
+    try:
+        segments = split_mp3(f.name)
+        assert len(segments) == 3, [(start, end) for start, end, _ in segments]
+        assert segments[0][0] == 0.0
+        for (_, end, _), (start, _, _) in zip(segments, segments[1:]):
+            assert end == start
+        assert abs(segments[-1][1] - int(3.2 / MP3_FRAME_SECONDS) * MP3_FRAME_SECONDS) < 1e-9
+
+        chunks = [read() for _, _, read in segments]
+        # Every segment starts on a frame header, and together they hold every frame
+        assert all(int.from_bytes(chunk[:4], 'big') == MP3_HEADER for chunk in chunks)
+        with open(f.name, 'rb') as original:
+            assert b''.join(chunks) == original.read()[30:]
+    finally:
+        audio.AUDIO_SEGMENT_SECONDS, audio.AUDIO_CUT_WINDOW = saved
+        os.unlink(f.name)
+
+
+def test_transcript_lines_offsets():
+    """Lines end at sentences, pauses and LINE_MAX_WORDS, with times shifted by the segment offset"""
+    words = [
+        {"text": "Hello", "start": 0.0, "end": 0.4, "conf": 90.0},
+        {"text": "there.", "start": 0.5, "end": 0.9, "conf": 100.0},
+        {"text": "After", "start": 1.0, "end": 1.3, "conf": 80.0},
+        {"text": "a", "start": 1.4, "end": 1.5, "conf": 80.0},
+        # Over LINE_PAUSE_SECONDS after the previous word
+        {"text": "pause", "start": 4.0, "end": 4.5, "conf": 70.0},
+    ]
+    lines = transcript_lines(words, offset=300.0)
+    assert [line["text"] for line in lines] == ["Hello there.", "After a", "pause"]
+    assert (lines[0]["start"], lines[0]["end"], lines[0]["conf"]) == (300.0, 300.9, 95.0)
+    assert (lines[1]["start"], lines[1]["end"]) == (301.0, 301.5)
+    assert (lines[2]["start"], lines[2]["end"]) == (304.0, 304.5)
+
+    run_on = [{"text": f"w{i}", "start": i * 0.1, "end": i * 0.1 + 0.05} for i in range(audio.LINE_MAX_WORDS + 5)]
+    assert [len(line["text"].split()) for line in transcript_lines(run_on)] == [audio.LINE_MAX_WORDS, 5]
+
+
+def main():
+    """Run all tests"""
+    print("======= TESTING AUDIO SEGMENTATION AND TRANSCRIPT STITCHING =======")
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print("\n======= TEST SUMMARY =======")
+    print(f"{len(tests) - failed} passed, {failed} failed")
+    return failed == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Test script for near-duplicate detection (common/dedup.py): MinHash
+signatures, LSH band matching and the candidate lookup.
+Runs offline: OpenSearch is replaced by a stub session. Run directly or with pytest.
+"""
+
+import os
+import sys
+import json
+
+# The shared modules live in lambda_services/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import common.dedup as dedup
+from common.dedup import fingerprint, estimate_similarity, find_duplicate
+
+RECEIPT = (
+    "Corner Hardware Store, 12 Mill Lane. Receipt number 48213, 14 March 2024. "
+    "Two boxes of wood screws 4.50 each, one claw hammer 18.99, a tin of exterior paint 32.00, "
+    "paint brushes 7.25. Subtotal 67.24, VAT 13.45, total 80.69 paid by card ending 4417. "
+    "Returns accepted within 30 days with this receipt. Thank you for shopping with us."
+)
+# The same receipt rescanned: a few OCR misreads and different spacing and case
+RESCAN = RECEIPT.replace("Receipt number", "Receipt  nurnber").replace("hammer", "harnmer").upper()
+UNRELATED = (
+    "Minutes of the residents association meeting held in the community hall. The committee "
+    "discussed the spring garden plan, street lighting repairs and the summer fair budget. "
+    "Volunteers are needed for the litter pick on Saturday morning; the next meeting is in May."
+)
+
+
+class StubResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StubSession:
+    """Records the lookup query and answers it with fixed hits"""
+
+    def __init__(self, hits, status_code=200):
+        self.hits = hits
+        self.status_code = status_code
+        self.queries = []
+
+    def post(self, url, headers=None, data=None):
+        self.queries.append((url, json.loads(data)))
+        return StubResponse(self.status_code, {"hits": {"hits": self.hits}})
+
+
+def hit(doc_id, filename, signature):
+    return {"_id": doc_id, "_source": {"filename": filename, "minhash": signature}}
+
+
+def test_fingerprint_shape_and_determinism():
+    """A fingerprint holds DEDUP_NUM_PERM signature values and one keyword per band, the same every time"""
+    fields = fingerprint(RECEIPT)
+    assert len(fields["minhash"]) == dedup.DEDUP_NUM_PERM
+    assert [band.split('-')[0] for band in fields["lsh_bands"]] == [f"b{i}" for i in range(dedup.DEDUP_BANDS)]
+    assert fingerprint(RECEIPT) == fields
+
+
+def test_fingerprint_ignores_case_spacing_and_punctuation():
+    """Normalisation makes formatting-only differences identical"""
+    reformatted = RECEIPT.upper().replace(". ", " ... ").replace(",", " ")
+    assert fingerprint(reformatted) == fingerprint(RECEIPT)
+
+
+def test_short_text_has_no_fingerprint():
+    """Texts under DEDUP_MIN_CHARS are never deduplicated"""
+    assert fingerprint("Page 3") is None
+    assert fingerprint(" " * 500) is None
+
+
+def test_near_duplicate_shares_bands():
+    """A rescan estimates above DEDUP_THRESHOLD and shares at least one LSH band"""
+    original, rescan = fingerprint(RECEIPT), fingerprint(RESCAN)
+    assert estimate_similarity(original["minhash"], rescan["minhash"]) >= dedup.DEDUP_THRESHOLD
+    assert set(original["lsh_bands"]) & set(rescan["lsh_bands"])
+
+
+def test_unrelated_text_shares_no_band():
+    """Unrelated documents estimate well below the threshold and share no band"""
+    original, other = fingerprint(RECEIPT), fingerprint(UNRELATED)
+    assert estimate_similarity(original["minhash"], other["minhash"]) < 0.3
+    assert not set(original["lsh_bands"]) & set(other["lsh_bands"])
+
+
+def test_estimate_similarity_mismatched_signatures():
+    """Missing or differently sized signatures never match"""
+    signature = fingerprint(RECEIPT)["minhash"]
+    assert estimate_similarity(signature, None) == 0.0
+    assert estimate_similarity(signature, signature[:64]) == 0.0
+    assert estimate_similarity(signature, signature) == 1.0
+
+
+def test_find_duplicate_query_ranks_by_shared_bands():
+    """The lookup scores one point per shared band and asks for DEDUP_MAX_CANDIDATES originals"""
+    fields = fingerprint(RECEIPT)
+    session = StubSession([])
+    assert find_duplicate("http://search", "documents", fields, tenant="acme", session=session) is None
+
+    url, query = session.queries[0]
+    assert url == "http://search/documents/_search"
+    assert query["size"] == dedup.DEDUP_MAX_CANDIDATES
+    clauses = query["query"]["bool"]
+    assert [c["constant_score"]["filter"]["term"]["lsh_bands"] for c in clauses["should"]] == fields["lsh_bands"]
+    assert clauses["minimum_should_match"] == 1
+    assert clauses["filter"] == [{"term": {"tenant": "acme"}}]
+    assert clauses["must_not"] == [{"exists": {"field": "duplicate_of"}}]
+
+
+def test_find_duplicate_picks_best_match():
+    """The most similar candidate at or above DEDUP_THRESHOLD wins; the document itself is skipped"""
+    fields = fingerprint(RECEIPT)
+    session = StubSession([
+        hit("self", "receipt.jpg", fields["minhash"]),
+        hit("other", "minutes.jpg", fingerprint(UNRELATED)["minhash"]),
+        hit("rescan", "receipt-rescan.heic", fingerprint(RESCAN)["minhash"]),
+        hit("copy", "receipt-copy.png", fields["minhash"]),
+    ])
+    doc_id, filename, similarity = find_duplicate("http://search", "documents", fields, exclude_id="self",
+                                                  session=session)
+    assert (doc_id, filename, similarity) == ("copy", "receipt-copy.png", 1.0)
+
+    session.hits = session.hits[:3]
+    assert find_duplicate("http://search", "documents", fields, exclude_id="self", session=session)[0] == "rescan"
+    session.hits = session.hits[:2]
+    assert find_duplicate("http://search", "documents", fields, exclude_id="self", session=session) is None
+
+
+def test_find_duplicate_lookup_errors_are_no_match():
+    """A failed lookup never fails ingest"""
+    fields = fingerprint(RECEIPT)
+    assert find_duplicate("http://search", "documents", fields, session=StubSession([], status_code=404)) is None
+    assert find_duplicate("http://search", "documents", fields, session=StubSession([], status_code=500)) is None
+
+
+def main():
+    """Run all tests"""
+    print("======= TESTING NEAR-DUPLICATE DETECTION =======")
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print("\n======= TEST SUMMARY =======")
+    print(f"{len(tests) - failed} passed, {failed} failed")
+    return failed == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
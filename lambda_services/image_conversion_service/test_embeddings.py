@@ -1,6 +1,12 @@
 import boto3
 import json
 import os
+import sys
+
+# ingest imports the shared modules in lambda_services/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 from ingest import get_embeddings
 
 def test_bedrock_embeddings():
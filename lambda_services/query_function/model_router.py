@@ -0,0 +1,239 @@
+"""
+Model router for Bedrock LLM invocation.
+
+Picks the fastest healthy model that meets the request's quality tier,
+falls back through the remaining candidates in order, hedges slow calls
+with a second model, and opens a circuit on a model that keeps throttling.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Quality tiers, lowest to highest
+QUALITY_TIERS = ['fast', 'standard', 'high']
+
+# Default model catalogue: tier and per-call timeout in seconds
+DEFAULT_MODELS = {
+    'anthropic.claude-3-sonnet-20240229-v1:0': {'tier': 'high', 'timeout': 45.0},
+    'anthropic.claude-3-haiku-20240307-v1:0': {'tier': 'standard', 'timeout': 20.0},
+    'amazon.titan-text-express-v1': {'tier': 'fast', 'timeout': 20.0},
+}
+
+# Circuit breaker and hedging settings
+THROTTLE_THRESHOLD = int(os.environ.get('ROUTER_THROTTLE_THRESHOLD', 3))
+CIRCUIT_COOLDOWN = float(os.environ.get('ROUTER_CIRCUIT_COOLDOWN', 30.0))
+HEDGE_AFTER = float(os.environ.get('ROUTER_HEDGE_AFTER', 0))  # 0 = use the model's rolling p95
+LATENCY_WINDOW = int(os.environ.get('ROUTER_LATENCY_WINDOW', 100))
+
+
+class ModelUnavailable(Exception):
+    """Raised when every candidate model failed, timed out or is circuit-broken"""
+
+
+def is_throttling(error):
+    """True if the error is a Bedrock ThrottlingException"""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') == 'ThrottlingException'
+
+
+class ModelStats:
+    """Rolling latency window and circuit breaker state for one model"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.consecutive_throttles = 0
+        self.open_until = 0.0
+        # Whether the single trial call of a half-open circuit is in flight
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def percentile(self, pct):
+        """Latency percentile over the rolling window, or None without samples"""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def is_available(self):
+        """Closed, or half-open with no trial call in flight yet"""
+        with self.lock:
+            if time.time() < self.open_until:
+                return False
+            return not (self.open_until and self.probing)
+
+    def acquire(self):
+        """
+        Claim a call. Always granted while the circuit is closed; a half-open
+        circuit admits a single trial call until it succeeds or fails.
+        """
+        with self.lock:
+            if time.time() < self.open_until:
+                return False
+            if not self.open_until:
+                return True
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        """A call failed or timed out without a throttle; let another trial through"""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.consecutive_throttles = 0
+            self.open_until = 0.0
+            self.probing = False
+
+    def record_throttle(self):
+        with self.lock:
+            self.consecutive_throttles += 1
+            self.probing = False
+            if self.consecutive_throttles >= THROTTLE_THRESHOLD:
+                self.open_until = time.time() + CIRCUIT_COOLDOWN
+                print(f"Circuit opened for {CIRCUIT_COOLDOWN}s after {self.consecutive_throttles} throttles")
+
+
+class ModelRouter:
+    """
+    Routes LLM calls across models.
+    invoke(prompt, model_id, max_tokens, temperature, top_p) must raise on
+    failure; whatever it returns is passed back to the caller unchanged.
+    """
+
+    def __init__(self, invoke, models=None, hedge_after=HEDGE_AFTER, max_workers=8):
+        self.invoke = invoke
+        self.models = models or DEFAULT_MODELS
+        self.hedge_after = hedge_after
+        self.stats = {model_id: ModelStats() for model_id in self.models}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get_stats(self, model_id):
+        if model_id not in self.stats:
+            self.stats[model_id] = ModelStats()
+        return self.stats[model_id]
+
+    def candidates(self, tier='standard', preferred=None):
+        """
+        Ordered candidate models: the preferred model first (if healthy), then
+        healthy models meeting the tier, fastest rolling p50 first. Models with
+        no samples keep their configured order after the measured ones.
+        A preferred model outside the catalogue is ignored.
+        """
+        minimum = QUALITY_TIERS.index(tier) if tier in QUALITY_TIERS else 0
+        eligible = [
+            model_id for model_id, config in self.models.items()
+            if QUALITY_TIERS.index(config.get('tier', 'standard')) >= minimum
+        ]
+
+        def sort_key(item):
+            position, model_id = item
+            p50 = self.get_stats(model_id).percentile(50)
+            return (p50 is None, p50 or 0, position)
+
+        ordered = [model_id for _, model_id in sorted(enumerate(eligible), key=sort_key)]
+        if preferred and preferred not in self.models:
+            print(f"Ignoring requested model {preferred}: not in the router catalogue")
+        elif preferred:
+            ordered = [preferred] + [m for m in ordered if m != preferred]
+        return [m for m in ordered if self.get_stats(m).is_available()]
+
+    def timeout_for(self, model_id):
+        return self.models.get(model_id, {}).get('timeout', 30.0)
+
+    def hedge_delay(self, model_id):
+        """How long to wait on a call before hedging with the next candidate"""
+        if self.hedge_after:
+            return self.hedge_after
+        return self.get_stats(model_id).percentile(95)
+
+    def _timed_invoke(self, model_id, *args):
+        start = time.time()
+        completion = self.invoke(args[0], model_id, *args[1:])
+        return completion, time.time() - start
+
+    def route(self, prompt, max_tokens, temperature, top_p, tier='standard', preferred=None, deadline=None):
+        """
+        Invoke the best candidate, hedging and falling back as needed.
+        deadline (epoch seconds) caps every call, so fallbacks only get the
+        time left. Returns (completion, model_id). Raises ModelUnavailable if
+        nothing succeeded.
+        """
+        queue = self.candidates(tier, preferred)
+        errors = []
+        in_flight = {}
+
+        def call_deadline(model_id, started):
+            end = started + self.timeout_for(model_id)
+            return min(end, deadline) if deadline else end
+
+        def launch_next():
+            # A half-open model may already have its trial call from another request
+            while queue and not (deadline and time.time() >= deadline):
+                model_id = queue.pop(0)
+                if self.get_stats(model_id).acquire():
+                    future = self.executor.submit(self._timed_invoke, model_id, prompt, max_tokens, temperature, top_p)
+                    in_flight[future] = (model_id, time.time())
+                    return True
+            return False
+
+        if not launch_next():
+            raise ModelUnavailable(f"No healthy model available for tier '{tier}'")
+        while in_flight:
+            # Wait until a call finishes, the hedge delay passes or a call times out
+            now = time.time()
+            deadlines = [call_deadline(m, started) - now for m, started in in_flight.values()]
+            wait_for = max(0.0, min(deadlines))
+            hedge_model = None
+            if queue and len(in_flight) == 1:
+                (model_id, started), = in_flight.values()
+                delay = self.hedge_delay(model_id)
+                if delay is not None:
+                    hedge_in = max(0.0, started + delay - now)
+                    if hedge_in < wait_for:
+                        wait_for, hedge_model = hedge_in, model_id
+
+            done, _ = wait(list(in_flight), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                model_id, _ = in_flight.pop(future)
+                try:
+                    completion, latency = future.result()
+                    self.get_stats(model_id).record_success(latency)
+                    # Calls still running are abandoned; don't leave a trial slot held by one
+                    for other, _ in in_flight.values():
+                        self.get_stats(other).release()
+                    return completion, model_id
+                except Exception as e:
+                    if is_throttling(e):
+                        self.get_stats(model_id).record_throttle()
+                    else:
+                        self.get_stats(model_id).release()
+                    print(f"Model {model_id} failed: {str(e)}")
+                    errors.append(f"{model_id}: {str(e)}")
+
+            if not done:
+                now = time.time()
+                for future, (model_id, started) in list(in_flight.items()):
+                    if now >= call_deadline(model_id, started):
+                        in_flight.pop(future)
+                        self.get_stats(model_id).release()
+                        print(f"Model {model_id} timed out after {now - started:.1f}s")
+                        errors.append(f"{model_id}: timed out")
+                if hedge_model and queue and in_flight:
+                    print(f"Hedging slow call to {hedge_model}")
+                    launch_next()
+
+            # Fall back to the next candidate once nothing is in flight
+            if not in_flight:
+                launch_next()
+
+        raise ModelUnavailable("All models failed: " + "; ".join(errors))
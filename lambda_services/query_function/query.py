@@ -1,55 +1,382 @@
+"""
+Story generation over the document index as a map-reduce pipeline.
+
+1. Retrieve the top STORY_TOP_K documents for the query (hybrid search).
+2. Map: split each document into chunks of at most STORY_CHUNK_CHARS and
+   summarise every chunk with respect to the query, STORY_MAP_WORKERS calls at
+   a time on a fast model tier.
+3. Reduce: if the notes are still longer than STORY_REDUCE_MAX_CHARS, condense
+   them in groups (again in parallel) until they fit, then write the story
+   from the notes.
+
+The final prompt is bounded by STORY_REDUCE_MAX_CHARS whatever the size of
+the result set, and the map stage runs in ceil(chunks / workers) rounds, so
+latency grows with STORY_MAX_CHUNKS / STORY_MAP_WORKERS rather than with the
+amount of retrieved text. With `stream` set, progress and the story text are
+returned as NDJSON events (streamed to the client by the ASGI server).
+"""
+
 import os
 import json
-import boto3
-import requests
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def lambda_handler(event, context):
-    # Step 1: Extract user query from the event
-    user_query = event.get("query", "default query")
-    
-    # Step 2: Search OpenSearch for relevant context
-    opensearch_endpoint = os.environ.get("OPENSEARCH_ENDPOINT")
-    search_results = search_opensearch(opensearch_endpoint, user_query)
-    
-    # Step 3: Aggregate results into context
-    context_text = aggregate_context(search_results)
-    
-    # Step 4: Combine the user query and context
-    prompt = f"Using the following context, generate a creative story:\n\nContext:\n{context_text}\n\nQuery: {user_query}"
-    
-    # Step 5: Call AWS Bedrock (or your chosen LLM service) with the prompt
-    bedrock_endpoint = os.environ.get("BEDROCK_ENDPOINT")
-    generated_story = call_bedrock(bedrock_endpoint, prompt)
-    
-    # Step 6: Return the generated story to the user
+from semantic_search import search_documents, build_filter_clauses, parse_filters
+from rag_service import (
+    bedrock_runtime, call_llm, load_router_models, warm_up_container, DEFAULT_TOP_P, DEFAULT_MAX_TOKENS
+)
+from model_router import ModelRouter, ModelUnavailable, is_throttling
+from common.tracing import span
+from common.responses import json_response, dumps, NDJSON_CONTENT_TYPE, CORS_HEADERS
+from common.handler import lambda_entry, warm_up_on_init
+
+# Retrieval and map-reduce settings
+STORY_TOP_K = int(os.environ.get('STORY_TOP_K', 20))
+STORY_MAP_WORKERS = int(os.environ.get('STORY_MAP_WORKERS', 8))
+STORY_CHUNK_CHARS = int(os.environ.get('STORY_CHUNK_CHARS', 6000))
+# Upper bound on map calls per request, however much text was retrieved
+STORY_MAX_CHUNKS = int(os.environ.get('STORY_MAX_CHUNKS', 32))
+STORY_SUMMARY_TOKENS = int(os.environ.get('STORY_SUMMARY_TOKENS', 400))
+# Longest set of notes the final story prompt takes; longer notes are condensed first
+STORY_REDUCE_MAX_CHARS = int(os.environ.get('STORY_REDUCE_MAX_CHARS', 12000))
+STORY_MAX_TOKENS = int(os.environ.get('STORY_MAX_TOKENS', DEFAULT_MAX_TOKENS))
+STORY_TEMPERATURE = float(os.environ.get('STORY_TEMPERATURE', 0.9))
+# Summaries only need the fast tier; the story itself is written by a standard-tier model or better
+STORY_MAP_TIER = os.environ.get('STORY_MAP_TIER', 'fast')
+STORY_REDUCE_TIER = os.environ.get('STORY_REDUCE_TIER', 'standard')
+
+MAP_SYSTEM_PROMPT = """You take notes from documents for a writer.
+Summarise only what in the document is relevant to the writer's request: characters, places, events, facts and tone.
+Be concise. If nothing in the document is relevant, reply with "Nothing relevant."."""
+
+REDUCE_SYSTEM_PROMPT = """You are a creative writer.
+Write a story for the user's request, drawing on the notes taken from their documents.
+Stay consistent with the facts in the notes."""
+
+# The map calls run on their own pool, and the router gets as many threads,
+# so the map stage isn't throttled by the RAG router's smaller pool
+story_executor = ThreadPoolExecutor(max_workers=STORY_MAP_WORKERS)
+story_router = ModelRouter(call_llm, load_router_models(), max_workers=STORY_MAP_WORKERS)
+
+
+def split_text(text, size=STORY_CHUNK_CHARS):
+    """Split text into chunks of at most size characters, breaking at whitespace where possible"""
+    chunks = []
+    text = text.strip()
+    while len(text) > size:
+        cut = text.rfind(' ', size // 2, size)
+        if cut <= 0:
+            cut = size
+        chunks.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def map_inputs(search_result):
+    """(filename, chunk) pairs to summarise, in rank order, at most STORY_MAX_CHUNKS"""
+    inputs = []
+    for doc in search_result.get("results", []):
+        for chunk in split_text(doc.get("text", "")):
+            if len(inputs) >= STORY_MAX_CHUNKS:
+                return inputs
+            inputs.append((doc.get("filename", "unknown"), chunk))
+    return inputs
+
+
+def llm_prompt(system, context, question):
+    """Prompt dict in the shape call_llm takes"""
     return {
-        "statusCode": 200,
-        "body": json.dumps({"story": generated_story})
+        "system": system,
+        "context_blocks": [context],
+        "cached_blocks": 0,
+        "question": question,
+        "text": f"{system}\n\n{context}\n\n{question}"
     }
 
-def search_opensearch(endpoint, query):
-    # Construct a search query against your OpenSearch index
-    url = f"{endpoint}/documents/_search"
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "query": {
-            "match": {
-                "extracted_text": query
-            }
+
+def summarize_chunk(query, filename, text):
+    """Notes on one chunk for the story request, or None if no model could summarise it"""
+    prompt = llm_prompt(MAP_SYSTEM_PROMPT, f"Document: {filename}\n\n{text}",
+                        f"Writer's request: {query}\n\nNOTES:")
+    try:
+        with span('map_call'):
+            (summary, _), _ = story_router.route(prompt, STORY_SUMMARY_TOKENS, 0.2, DEFAULT_TOP_P, STORY_MAP_TIER)
+    except ModelUnavailable as e:
+        print(f"Could not summarise {filename}: {str(e)}")
+        return None
+    summary = summary.strip()
+    if not summary or summary.lower().startswith("nothing relevant"):
+        return None
+    return f"From {filename}: {summary}"
+
+
+def submit(func, *args):
+    """Run func on the story pool with the current trace"""
+    return story_executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def map_stage(query, inputs):
+    """
+    Summarise every input concurrently. Yields notes as they complete; their
+    order is restored by the caller.
+    """
+    futures = {submit(summarize_chunk, query, filename, text): position
+               for position, (filename, text) in enumerate(inputs)}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+def note_groups(notes, limit):
+    """Consecutive groups of notes whose joined length stays within limit"""
+    groups, current, length = [], [], 0
+    for note in notes:
+        if current and length + len(note) > limit:
+            groups.append(current)
+            current, length = [], 0
+        current.append(note)
+        length += len(note) + 2
+    if current:
+        groups.append(current)
+    return groups
+
+
+def reduce_notes(query, notes):
+    """
+    Condense the notes in parallel groups until they fit in
+    STORY_REDUCE_MAX_CHARS. A round that can't shrink them (e.g. a single
+    oversized note) truncates instead of looping.
+    """
+    while len("\n\n".join(notes)) > STORY_REDUCE_MAX_CHARS:
+        groups = note_groups(notes, STORY_REDUCE_MAX_CHARS)
+        if len(groups) == 1 and len(notes) == 1:
+            return [notes[0][:STORY_REDUCE_MAX_CHARS]]
+        with span('reduce_round', groups=len(groups)):
+            futures = [submit(summarize_chunk, query, "earlier notes", "\n\n".join(group)) for group in groups]
+            condensed = [note for note in (future.result() for future in futures) if note]
+        if not condensed or len("\n\n".join(condensed)) >= len("\n\n".join(notes)):
+            return [("\n\n".join(notes))[:STORY_REDUCE_MAX_CHARS]]
+        notes = condensed
+    return notes
+
+
+def story_prompt(query, notes):
+    context = "NOTES FROM THE DOCUMENTS:\n\n" + ("\n\n".join(notes) if notes else "No relevant notes.")
+    return llm_prompt(REDUCE_SYSTEM_PROMPT, context, f"USER REQUEST: {query}\n\nSTORY:")
+
+
+def collect_notes(query, search_result):
+    """Map and reduce the retrieved documents into notes for the story prompt"""
+    inputs = map_inputs(search_result)
+    with span('map', chunks=len(inputs)):
+        notes = [None] * len(inputs)
+        for position, note in map_stage(query, inputs):
+            notes[position] = note
+    with span('reduce'):
+        return reduce_notes(query, [note for note in notes if note]), len(inputs)
+
+
+def sources_for(search_result):
+    return [{"filename": doc.get("filename"), "score": doc.get("score")} for doc in search_result.get("results", [])]
+
+
+def generate_story(query, top_k=STORY_TOP_K, model_id=None, hybrid_search=True, filters=None):
+    """
+    Retrieve, map and reduce, then write the story in one call.
+    Returns (result, status_code).
+    """
+    try:
+        with span('retrieval'):
+            search_result, status_code = search_documents(query, top_k, hybrid_search, filters)
+        if status_code != 200:
+            return {"error": search_result.get("error", "Search failed")}, status_code
+
+        notes, chunks = collect_notes(query, search_result)
+        with span('llm') as llm_span:
+            (story, usage), used_model = story_router.route(
+                story_prompt(query, notes), STORY_MAX_TOKENS, STORY_TEMPERATURE, DEFAULT_TOP_P,
+                STORY_REDUCE_TIER, preferred=model_id
+            )
+            llm_span.set(model=used_model)
+        return {
+            "query": query,
+            "story": story,
+            "model": used_model,
+            "chunks_summarized": chunks,
+            "notes": len(notes),
+            "sources": sources_for(search_result)
+        }, 200
+
+    except ModelUnavailable as e:
+        print(f"No model available for story: {str(e)}")
+        return {"error": f"No model available: {str(e)}"}, 503
+    except Exception as e:
+        print(f"Error generating story: {str(e)}")
+        return {"error": f"Story generation failed: {str(e)}"}, 500
+
+
+def stream_request_body(prompt, model_id, max_tokens, temperature, top_p):
+    if "titan" in model_id.lower():
+        return {
+            "inputText": prompt["text"],
+            "textGenerationConfig": {"maxTokenCount": max_tokens, "temperature": temperature, "topP": top_p}
         }
+    content = [{"type": "text", "text": block} for block in prompt["context_blocks"]]
+    content.append({"type": "text", "text": prompt["question"]})
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "system": prompt["system"],
+        "messages": [{"role": "user", "content": content}]
     }
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    return response.json()
-
-def aggregate_context(search_results):
-    # Combine relevant document excerpts from search results
-    hits = search_results.get("hits", {}).get("hits", [])
-    context_parts = [hit["_source"]["extracted_text"] for hit in hits]
-    return "\n".join(context_parts)
-
-def call_bedrock(endpoint, prompt):
-    # Send the prompt to Bedrock and get the generated text
-    headers = {"Content-Type": "application/json"}
-    payload = {"prompt": prompt}
-    response = requests.post(endpoint, headers=headers, data=json.dumps(payload))
-    return response.json().get("generated_text", "No text generated")
\ No newline at end of file
+
+
+def stream_llm(prompt, model_id, max_tokens, temperature, top_p):
+    """Yield the completion text of a Bedrock streaming call as it arrives"""
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=model_id,
+        body=json.dumps(stream_request_body(prompt, model_id, max_tokens, temperature, top_p))
+    )
+    for event in response.get("body", []):
+        chunk = json.loads(event.get("chunk", {}).get("bytes", b"{}"))
+        if chunk.get("type") == "content_block_delta":
+            text = chunk.get("delta", {}).get("text", "")
+        else:
+            text = chunk.get("outputText", "")
+        if text:
+            yield text
+
+
+def story_events(query, top_k=STORY_TOP_K, model_id=None, hybrid_search=True, filters=None):
+    """
+    generate_story as a stream of events: "sources", one "note" per map result
+    as it completes, "story" text deltas, then "done" (or "error"). A model
+    that fails before producing any text falls back to the next candidate;
+    a stream can't be hedged or retried once it has started.
+    """
+    with span('retrieval'):
+        search_result, status_code = search_documents(query, top_k, hybrid_search, filters)
+    if status_code != 200:
+        yield {"type": "error", "error": search_result.get("error", "Search failed"), "status": status_code}
+        return
+    yield {"type": "sources", "sources": sources_for(search_result)}
+
+    inputs = map_inputs(search_result)
+    notes = [None] * len(inputs)
+    with span('map', chunks=len(inputs)):
+        for position, note in map_stage(query, inputs):
+            notes[position] = note
+            if note:
+                yield {"type": "note", "filename": inputs[position][0], "text": note}
+    with span('reduce'):
+        notes = reduce_notes(query, [note for note in notes if note])
+
+    prompt = story_prompt(query, notes)
+    errors = []
+    for candidate in story_router.candidates(STORY_REDUCE_TIER, model_id):
+        # Streaming bypasses route(), so it takes the circuit's trial slot itself
+        stats = story_router.get_stats(candidate)
+        if not stats.acquire():
+            continue
+        started = False
+        call_start = time.time()
+        try:
+            with span('llm', model=candidate):
+                for text in stream_llm(prompt, candidate, STORY_MAX_TOKENS, STORY_TEMPERATURE, DEFAULT_TOP_P):
+                    started = True
+                    yield {"type": "story", "text": text}
+            stats.record_success(time.time() - call_start)
+            yield {"type": "done", "model": candidate, "chunks_summarized": len(inputs), "notes": len(notes)}
+            return
+        except Exception as e:
+            if is_throttling(e):
+                stats.record_throttle()
+            print(f"Streaming from {candidate} failed: {str(e)}")
+            if started:
+                yield {"type": "error", "error": f"Story generation failed: {str(e)}", "status": 500}
+                return
+            errors.append(f"{candidate}: {str(e)}")
+        finally:
+            # Also runs if the client stops reading mid-stream
+            stats.release()
+    yield {"type": "error", "error": "No model available: " + "; ".join(errors), "status": 503}
+
+
+def parse_story_request(event):
+    """
+    Story parameters from an API Gateway GET/POST event or a direct invocation
+    ({"query": ...}). Raises ValueError for a missing query or a bad filter.
+    """
+    if event.get('httpMethod') == 'GET' and event.get('queryStringParameters'):
+        params = event['queryStringParameters']
+        query_text = params.get('q', '')
+        options = {
+            "top_k": int(params.get('k', STORY_TOP_K)),
+            "model_id": params.get('model'),
+            "hybrid_search": params.get('hybrid', 'true').lower() == 'true',
+            "filters": parse_filters(params)
+        }
+        stream = params.get('stream', 'false').lower() == 'true'
+    else:
+        body = json.loads(event['body']) if event.get('httpMethod') == 'POST' and event.get('body') else event
+        query_text = body.get('query', '')
+        options = {
+            "top_k": int(body.get('top_k', STORY_TOP_K)),
+            "model_id": body.get('model'),
+            "hybrid_search": body.get('hybrid', True),
+            "filters": parse_filters(body)
+        }
+        stream = bool(body.get('stream', False))
+    if not query_text:
+        raise ValueError("Query text is required")
+    build_filter_clauses(options["filters"])
+    return query_text, options, stream
+
+
+@lambda_entry('story', warm_up_container)
+def lambda_handler(event, context):
+    """
+    Lambda handler for the story generation API.
+    With a debug flag set, the response body includes per-stage timings.
+    Warm-up pings prime the container and return without a story.
+    """
+    return handle_story_request(event)
+
+
+def handle_story_request(event):
+    """
+    Parse and run a story request
+    Accepts query parameters:
+    - q: The story request (required; "query" in POST bodies and direct invocations)
+    - k: Documents to retrieve (optional, default STORY_TOP_K)
+    - model: Bedrock model ID to write the story with first (optional)
+    - hybrid: Whether to use hybrid search (optional, default true)
+    - stream: Return NDJSON events instead of one JSON object (optional, default false)
+    - file_type, source_bucket, source_prefix, extracted_after, extracted_before, tenant:
+      Restrict retrieval to matching documents (optional, a "filter" object in POST bodies)
+    """
+    try:
+        try:
+            query_text, options, stream = parse_story_request(event)
+        except ValueError as e:
+            return json_response(400, {"error": str(e)})
+
+        if stream:
+            # Buffered here; the ASGI server sends the same events as they happen
+            with span('stream'):
+                body = "".join(dumps(item) + "\n" for item in story_events(query_text, **options))
+            return {'statusCode': 200, 'headers': {'Content-Type': NDJSON_CONTENT_TYPE, **CORS_HEADERS}, 'body': body}
+
+        result, status_code = generate_story(query_text, **options)
+        return json_response(status_code, result, event)
+
+    except Exception as e:
+        print(f"Error in lambda_handler: {str(e)}")
+        return json_response(500, {"error": f"Internal server error: {str(e)}"})
+
+
+warm_up_on_init(__name__, warm_up_container)
@@ -1,7 +1,21 @@
 import os
 import json
+import time
 import boto3
-from semantic_search import search_documents
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from semantic_search import (
+    search_documents, keyword_search, execute_search, build_search_query, fetch_documents,
+    build_filter_clauses, parse_filters, search_scope, opensearch_endpoint, index_name, http
+)
+from common.embeddings import get_query_embeddings, normalize_endpoint, EmbeddingModelMismatch
+from model_router import ModelRouter, ModelUnavailable, DEFAULT_MODELS
+from common.tracing import span
+from common.responses import json_response
+from common.warmup import warm_up
+from common.handler import lambda_entry, warm_up_on_init
 
 # Initialize Bedrock client for LLM
 bedrock_runtime = boto3.client(
@@ -14,6 +28,42 @@ DEFAULT_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet
 DEFAULT_MAX_TOKENS = int(os.environ.get('MAX_TOKENS', 4096))
 DEFAULT_TEMPERATURE = float(os.environ.get('TEMPERATURE', 0.7))
 DEFAULT_TOP_P = float(os.environ.get('TOP_P', 0.9))
+# Minimum quality tier ("fast", "standard" or "high") the router may answer with
+DEFAULT_QUALITY_TIER = os.environ.get('QUALITY_TIER', 'standard')
+
+# Bedrock prompt caching for the fixed instructions and stable document prefixes
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', 'true').lower() == 'true'
+# Model ID fragments for Claude models that accept cache points on Bedrock.
+# Claude 3 Sonnet and Claude 3 Haiku (the default model and router catalogue)
+# do not, so caching stays inactive until a listed model is configured.
+PROMPT_CACHE_MODELS = [m.strip() for m in os.environ.get(
+    'PROMPT_CACHE_MODELS',
+    'claude-3-5-haiku,claude-3-7-sonnet,claude-sonnet-4,claude-opus-4,claude-haiku-4'
+).split(',') if m.strip()]
+# Models already reported as sent without cache points
+_uncached_models = set()
+
+SYSTEM_PROMPT = """You are a helpful AI assistant that answers questions based on the provided documents.
+Use ONLY the information from the provided documents to answer the question.
+If the documents don't contain the answer, say "I don't have enough information to answer this question."
+Don't make up information that's not in the documents."""
+
+# Pipelined RAG settings: "async" overlaps retrieval stages, "sequential" runs rag_query
+RAG_PIPELINE = os.environ.get('RAG_PIPELINE', 'async')
+RAG_EMBEDDING_TIMEOUT = float(os.environ.get('RAG_EMBEDDING_TIMEOUT', 2.0))
+RAG_SEARCH_TIMEOUT = float(os.environ.get('RAG_SEARCH_TIMEOUT', 3.0))
+RAG_LLM_TIMEOUT = float(os.environ.get('RAG_LLM_TIMEOUT', 60.0))
+
+# Blocking boto3/requests calls run here rather than in asyncio's default
+# executor, which asyncio.run would wait on even after a stage timed out
+_pipeline_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('RAG_PIPELINE_WORKERS', 8)))
+
+def run_blocking(func, *args):
+    """Run a blocking call on the pipeline executor and return an awaitable future"""
+    loop = asyncio.get_running_loop()
+    # Carry the current trace into the worker thread
+    context = contextvars.copy_context()
+    return loop.run_in_executor(_pipeline_executor, context.run, functools.partial(func, *args))
 
 def format_context(search_results, max_context_length=10000):
     """
@@ -57,14 +107,45 @@ def format_context(search_results, max_context_length=10000):
     else:
         return "No relevant document content could be extracted."
 
+def supports_prompt_caching(model_id):
+    """
+    Whether prompt caching is enabled and the model accepts cache points.
+    Logs once per model when caching is enabled but the model isn't listed.
+    """
+    if not PROMPT_CACHING:
+        return False
+    if any(fragment in model_id.lower() for fragment in PROMPT_CACHE_MODELS):
+        return True
+    if model_id not in _uncached_models:
+        _uncached_models.add(model_id)
+        print(f"Prompt caching inactive for {model_id}: not in PROMPT_CACHE_MODELS")
+    return False
+
 def invoke_claude(prompt, model_id=DEFAULT_MODEL_ID, max_tokens=DEFAULT_MAX_TOKENS, 
-                 temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P):
+                 temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P, raise_errors=False,
+                 system=None, context_blocks=None, cached_blocks=0, return_usage=False):
     """
     Invoke Claude model via Amazon Bedrock
+    With raise_errors=True failures propagate instead of being returned as text.
+    system is sent as the system prompt and context_blocks as content blocks
+    ahead of the prompt. On models that support it the first cached_blocks
+    context blocks get a cache point, so that prefix (system prompt included)
+    is served from Bedrock's prompt cache; later blocks are sent uncached.
+    The system prompt gets no cache point of its own: on its own it is far
+    below Bedrock's minimum cacheable length.
+    With return_usage=True returns (completion, usage).
     """
+    usage = {}
     try:
         # Prepare request body based on model
         if "claude" in model_id.lower():
+            cache = {"cache_control": {"type": "ephemeral"}} if supports_prompt_caching(model_id) else {}
+            content = prompt
+            if context_blocks:
+                content = [{"type": "text", "text": block, **(cache if i < cached_blocks else {})}
+                           for i, block in enumerate(context_blocks) if block]
+                content.append({"type": "text", "text": prompt})
+
             # Claude-specific request format
             request_body = {
                 "anthropic_version": "bedrock-2023-05-31",
@@ -72,9 +153,11 @@ def invoke_claude(prompt, model_id=DEFAULT_MODEL_ID, max_tokens=DEFAULT_MAX_TOKE
                 "temperature": temperature,
                 "top_p": top_p,
                 "messages": [
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": content}
                 ]
             }
+            if system:
+                request_body["system"] = [{"type": "text", "text": system}]
         else:
             # Generic request format for other models
             request_body = {
@@ -97,20 +180,26 @@ def invoke_claude(prompt, model_id=DEFAULT_MODEL_ID, max_tokens=DEFAULT_MAX_TOKE
         if "claude" in model_id.lower():
             # Claude response format
             completion = response_body.get("content", [{}])[0].get("text", "")
+            # Token usage, including prompt cache reads and writes
+            usage = response_body.get("usage", {})
         else:
             # Generic response format
             completion = response_body.get("completion", "")
             
-        return completion
+        return (completion, usage) if return_usage else completion
         
     except Exception as e:
         print(f"Error invoking LLM: {str(e)}")
-        return f"Error generating response: {str(e)}"
+        if raise_errors:
+            raise
+        error = f"Error generating response: {str(e)}"
+        return (error, usage) if return_usage else error
 
 def invoke_titan(prompt, model_id="amazon.titan-text-express-v1", max_tokens=DEFAULT_MAX_TOKENS,
-                temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P):
+                temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P, raise_errors=False):
     """
     Invoke Titan model via Amazon Bedrock
+    With raise_errors=True failures propagate instead of being returned as text
     """
     try:
         # Titan-specific request format
@@ -138,16 +227,44 @@ def invoke_titan(prompt, model_id="amazon.titan-text-express-v1", max_tokens=DEF
         
     except Exception as e:
         print(f"Error invoking Titan LLM: {str(e)}")
+        if raise_errors:
+            raise
         return f"Error generating response: {str(e)}"
 
+def call_llm(prompt, model_id, max_tokens, temperature, top_p):
+    """
+    Invoke a model by family, raising on failure so the router can fall back.
+    prompt is the dict from build_rag_prompt; returns (completion, usage).
+    """
+    if "titan" in model_id.lower():
+        completion = invoke_titan(prompt["text"], model_id, max_tokens, temperature, top_p, raise_errors=True)
+        return completion, {}
+    if "claude" not in model_id.lower():
+        # The generic request format has no system prompt or content blocks
+        return invoke_claude(prompt["text"], model_id, max_tokens, temperature, top_p, raise_errors=True,
+                             return_usage=True)
+    return invoke_claude(
+        prompt["question"], model_id, max_tokens, temperature, top_p, raise_errors=True,
+        system=prompt["system"], context_blocks=prompt["context_blocks"],
+        cached_blocks=prompt["cached_blocks"], return_usage=True
+    )
+
+def load_router_models():
+    """
+    Model catalogue for the router: ROUTER_MODELS (JSON of model_id -> {tier, timeout})
+    or the defaults, always including the configured default model
+    """
+    models = json.loads(os.environ['ROUTER_MODELS']) if os.environ.get('ROUTER_MODELS') else dict(DEFAULT_MODELS)
+    models.setdefault(DEFAULT_MODEL_ID, {'tier': 'high', 'timeout': 45.0})
+    return models
+
+model_router = ModelRouter(call_llm, load_router_models())
+
 def generate_prompt(query, context):
     """
     Generate a prompt for the LLM using the query and document context
     """
-    return f"""You are a helpful AI assistant that answers questions based on the provided documents.
-Use ONLY the information from the provided documents to answer the question.
-If the documents don't contain the answer, say "I don't have enough information to answer this question."
-Don't make up information that's not in the documents.
+    return f"""{SYSTEM_PROMPT}
 
 CONTEXT DOCUMENTS:
 {context}
@@ -156,70 +273,277 @@ USER QUESTION: {query}
 
 ANSWER:"""
 
-def rag_query(query, top_k=5, model_id=DEFAULT_MODEL_ID, hybrid_search=True, 
+def build_rag_prompt(query, search_result, pinned=None):
+    """
+    Split the RAG prompt into parts: the fixed instructions, the pinned
+    documents (from fetch_documents, in a fixed order, so the block is the
+    same across queries), the remaining retrieved documents and the question.
+    Only the prefix up to the pinned block is cached; "cached_blocks" counts
+    the leading context blocks to cache. "text" holds the single-string
+    prompt for models without system prompts.
+    """
+    pinned = pinned or []
+    pinned_filenames = {doc.get("filename") for doc in pinned}
+    retrieved = [doc for doc in search_result.get("results", []) if doc.get("filename") not in pinned_filenames]
+
+    context_blocks = []
+    if pinned:
+        context_blocks.append(format_context({"results": pinned}))
+    if retrieved or not pinned:
+        context_blocks.append(format_context({"results": retrieved}))
+    context = "".join(context_blocks)
+
+    # The header goes on the first block, which is the cached pinned block when there is one
+    context_blocks[0] = f"CONTEXT DOCUMENTS:\n{context_blocks[0]}"
+    return {
+        "system": SYSTEM_PROMPT,
+        "context_blocks": context_blocks,
+        "cached_blocks": 1 if pinned else 0,
+        "question": f"USER QUESTION: {query}\n\nANSWER:",
+        "text": generate_prompt(query, context)
+    }
+
+def generate_answer(query, search_result, model_id=None, max_tokens=DEFAULT_MAX_TOKENS,
+                    temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P, include_sources=True,
+                    quality_tier=DEFAULT_QUALITY_TIER, pinned_documents=None, filters=None, deadline=None):
+    """
+    Build the prompt from search results, invoke the LLM and format the response
+    Pinned documents are fetched by filename within the filters' scope.
+    deadline (epoch seconds) bounds the router's calls and fallbacks.
+    Raises ModelUnavailable if no model could answer
+    """
+    pinned = []
+    if pinned_documents:
+        with span('pinned_fetch'):
+            pinned_result, status_code = fetch_documents(pinned_documents, filters)
+        if status_code == 200:
+            pinned = pinned_result["results"]
+        else:
+            print(f"Could not fetch pinned documents: {pinned_result.get('error')}")
+
+    # Step 2 & 3: Format the context and split the prompt into cacheable parts
+    with span('prompt_build'):
+        prompt = build_rag_prompt(query, search_result, pinned)
+    
+    # Step 4: Invoke the LLM through the router; an explicitly requested model
+    # is tried first, then the fastest healthy models meeting the quality tier
+    with span('llm') as llm_span:
+        (response_text, usage), used_model = model_router.route(
+            prompt, max_tokens, temperature, top_p, quality_tier, preferred=model_id, deadline=deadline
+        )
+        llm_span.set(model=used_model)
+    
+    # Step 5: Format and return the response
+    result = {
+        "query": query,
+        "response": response_text,
+        "model": used_model
+    }
+    
+    # Report token usage, including prompt cache hits
+    if usage:
+        result["usage"] = {
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cache_read_input_tokens": usage.get("cache_read_input_tokens", 0),
+            "cache_creation_input_tokens": usage.get("cache_creation_input_tokens", 0)
+        }
+    
+    # Include sources if requested
+    if include_sources:
+        sources = []
+        for doc in search_result.get("results", []):
+            sources.append({
+                "filename": doc.get("filename"),
+                "score": doc.get("score"),
+                "metadata": doc.get("metadata", {})
+            })
+        # Pinned documents the search didn't return are in the prompt too
+        retrieved = {doc.get("filename") for doc in search_result.get("results", [])}
+        for doc in pinned:
+            if doc.get("filename") not in retrieved:
+                sources.append({
+                    "filename": doc.get("filename"),
+                    "score": None,
+                    "metadata": doc.get("metadata", {}),
+                    "pinned": True
+                })
+        result["sources"] = sources
+        
+    return result
+
+def rag_query(query, top_k=5, model_id=None, hybrid_search=True, 
              max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE, 
-             top_p=DEFAULT_TOP_P, include_sources=True):
+             top_p=DEFAULT_TOP_P, include_sources=True, quality_tier=DEFAULT_QUALITY_TIER,
+             pinned_documents=None, filters=None):
     """
     Perform a RAG query: search for relevant documents and generate a response using an LLM
+    Filters restrict retrieval to matching documents, as in search_documents
     """
     try:
         # Step 1: Search for relevant documents
-        search_result, status_code = search_documents(query, top_k, hybrid_search)
+        with span('retrieval'):
+            search_result, status_code = search_documents(query, top_k, hybrid_search, filters)
         
         if status_code != 200:
             return {"error": search_result.get("error", "Search failed")}, status_code
             
-        # Step 2: Format the context from search results
-        context = format_context(search_result)
-        
-        # Step 3: Generate the prompt for the LLM
-        prompt = generate_prompt(query, context)
-        
-        # Step 4: Invoke the LLM based on model type
-        if "claude" in model_id.lower():
-            # Use Claude-specific invocation
-            response_text = invoke_claude(prompt, model_id, max_tokens, temperature, top_p)
-        elif "titan" in model_id.lower():
-            # Use Titan-specific invocation
-            response_text = invoke_titan(prompt, model_id, max_tokens, temperature, top_p)
-        else:
-            # Use default Claude invocation
-            response_text = invoke_claude(prompt, DEFAULT_MODEL_ID, max_tokens, temperature, top_p)
-        
-        # Step 5: Format and return the response
-        result = {
-            "query": query,
-            "response": response_text
-        }
-        
-        # Include sources if requested
-        if include_sources:
-            sources = []
-            for doc in search_result.get("results", []):
-                sources.append({
-                    "filename": doc.get("filename"),
-                    "score": doc.get("score"),
-                    "metadata": doc.get("metadata", {})
-                })
-            result["sources"] = sources
-            
+        result = generate_answer(query, search_result, model_id, max_tokens,
+                                 temperature, top_p, include_sources, quality_tier,
+                                 pinned_documents, filters)
         return result, 200
             
+    except ModelUnavailable as e:
+        print(f"No model available for RAG query: {str(e)}")
+        return {"error": f"No model available: {str(e)}"}, 503
+    except Exception as e:
+        print(f"Error in RAG query: {str(e)}")
+        return {"error": f"RAG query failed: {str(e)}"}, 500
+
+def merge_results(primary, secondary, top_k):
+    """
+    Top up primary search results with secondary hits for files not already present
+    """
+    results = list(primary.get("results", []))
+    seen = {doc.get("filename") for doc in results}
+    for doc in secondary.get("results", []):
+        if len(results) >= top_k:
+            break
+        if doc.get("filename") not in seen:
+            results.append(doc)
+            seen.add(doc.get("filename"))
+    return {"query": primary.get("query"), "results": results}
+
+async def retrieve_async(query, top_k=5, hybrid_search=True, filters=None):
+    """
+    Retrieve context with the query embedding and a BM25-only prefetch running
+    concurrently. Each stage has its own timeout: if the embedding or vector
+    search is slow or fails we answer from the keyword hits instead.
+    Returns (search_result, status_code, degraded_reason).
+    """
+    # Kick off the keyword prefetch and the query embedding together
+    prefetch = run_blocking(keyword_search, query, top_k, filters)
+    embedding_task = run_blocking(
+        get_query_embeddings, query, normalize_endpoint(opensearch_endpoint), search_scope(filters)[0]
+    )
+
+    degraded = None
+    try:
+        with span('embedding'):
+            query_embedding = await asyncio.wait_for(embedding_task, RAG_EMBEDDING_TIMEOUT)
+        if not query_embedding:
+            degraded = "embedding_failed"
+    except asyncio.TimeoutError:
+        query_embedding, degraded = None, "embedding_timeout"
+    except EmbeddingModelMismatch:
+        query_embedding, degraded = None, "embedding_model_mismatch"
+
+    if query_embedding:
+        search_query = build_search_query(query, query_embedding, top_k, hybrid_search, filters)
+        try:
+            search_result, status_code = await asyncio.wait_for(
+                run_blocking(execute_search, query, search_query, filters), RAG_SEARCH_TIMEOUT
+            )
+            if status_code == 200:
+                # Enough context already: start the LLM without waiting on the prefetch
+                if len(search_result.get("results", [])) >= top_k or not prefetch.done():
+                    prefetch.cancel()
+                    return search_result, status_code, None
+                keyword_result, keyword_status = prefetch.result()
+                if keyword_status == 200:
+                    search_result = merge_results(search_result, keyword_result, top_k)
+                return search_result, status_code, None
+            degraded = "vector_search_failed"
+        except asyncio.TimeoutError:
+            degraded = "vector_search_timeout"
+
+    # Degrade gracefully to the keyword hits
+    print(f"Answering from keyword prefetch: {degraded}")
+    try:
+        with span('keyword_prefetch_wait', degraded=degraded):
+            search_result, status_code = await asyncio.wait_for(prefetch, RAG_SEARCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {"error": "Document retrieval timed out"}, 504, degraded
+    return search_result, status_code, degraded
+
+async def rag_query_async(query, top_k=5, model_id=None, hybrid_search=True,
+                          max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE,
+                          top_p=DEFAULT_TOP_P, include_sources=True, quality_tier=DEFAULT_QUALITY_TIER,
+                          pinned_documents=None, filters=None):
+    """
+    Pipelined RAG query: overlapped retrieval with per-stage timeouts, then
+    the LLM call offloaded to a thread with its own timeout
+    """
+    try:
+        build_filter_clauses(filters)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        with span('retrieval'):
+            search_result, status_code, degraded = await retrieve_async(query, top_k, hybrid_search, filters)
+
+        if status_code != 200:
+            return {"error": search_result.get("error", "Search failed")}, status_code
+
+        try:
+            # The router stops at the deadline, so a fallback gets only the time left;
+            # the outer timeout is a backstop a little after it
+            deadline = time.time() + RAG_LLM_TIMEOUT
+            result = await asyncio.wait_for(
+                run_blocking(generate_answer, query, search_result, model_id, max_tokens,
+                             temperature, top_p, include_sources, quality_tier, pinned_documents, filters,
+                             deadline),
+                RAG_LLM_TIMEOUT + 1.0
+            )
+        except asyncio.TimeoutError:
+            return {"error": "LLM response timed out"}, 504
+        except ModelUnavailable as e:
+            print(f"No model available for RAG query: {str(e)}")
+            return {"error": f"No model available: {str(e)}"}, 503
+
+        if degraded:
+            result["degraded"] = degraded
+        return result, 200
+
     except Exception as e:
         print(f"Error in RAG query: {str(e)}")
         return {"error": f"RAG query failed: {str(e)}"}, 500
 
+def rag_query_pipelined(*args, **kwargs):
+    """
+    Synchronous entry point for rag_query_async, same arguments as rag_query
+    """
+    return asyncio.run(rag_query_async(*args, **kwargs))
+
+def warm_up_container():
+    """Open pooled OpenSearch and Bedrock (embedding and LLM) connections and pre-embed the popular queries"""
+    return warm_up(opensearch_endpoint, index_name, session=http, llm_client=bedrock_runtime, queries=True)
+
+@lambda_entry('rag', warm_up_container)
 def lambda_handler(event, context):
     """
-    Lambda handler for the RAG service API
+    Lambda handler for the RAG service API.
+    With a debug flag set, the response body includes per-stage timings.
+    Warm-up pings prime the container and return without a query.
+    """
+    return handle_rag_request(event)
+
+def handle_rag_request(event):
+    """
+    Parse and run a RAG request
     Accepts query parameters:
     - q: Query text (required)
     - k: Top K results (optional, default 5)
-    - model: Bedrock model ID (optional)
+    - model: Bedrock model ID to try first (optional, otherwise routed by tier)
+    - tier: Minimum quality tier: fast, standard or high (optional)
+    - pinned: Filenames whose content is kept first in a cached prompt prefix (optional)
     - hybrid: Whether to use hybrid search (optional, default true)
     - max_tokens: Maximum tokens in response (optional)
     - temperature: LLM temperature (optional)
     - include_sources: Whether to include source documents (optional, default true)
+    - file_type, source_bucket, source_prefix, extracted_after, extracted_before, tenant:
+      Restrict retrieval to matching documents (optional, a "filter" object in POST bodies)
     """
     try:
         # Parse different types of events (API Gateway, direct invocation)
@@ -228,71 +552,66 @@ def lambda_handler(event, context):
             params = event.get('queryStringParameters', {})
             query_text = params.get('q', '')
             top_k = int(params.get('k', '5'))
-            model_id = params.get('model', DEFAULT_MODEL_ID)
+            model_id = params.get('model')
+            quality_tier = params.get('tier', DEFAULT_QUALITY_TIER)
+            pinned_documents = [f for f in params.get('pinned', '').split(',') if f]
             hybrid = params.get('hybrid', 'true').lower() == 'true'
             max_tokens = int(params.get('max_tokens', DEFAULT_MAX_TOKENS))
             temperature = float(params.get('temperature', DEFAULT_TEMPERATURE))
             top_p = float(params.get('top_p', DEFAULT_TOP_P))
             include_sources = params.get('include_sources', 'true').lower() == 'true'
+            filters = parse_filters(params)
             
         elif event.get('body') and event.get('httpMethod') == 'POST':
             # API Gateway POST request
             body = json.loads(event.get('body', '{}'))
             query_text = body.get('query', '')
             top_k = int(body.get('top_k', 5))
-            model_id = body.get('model', DEFAULT_MODEL_ID)
+            model_id = body.get('model')
+            quality_tier = body.get('tier', DEFAULT_QUALITY_TIER)
+            pinned_documents = body.get('pinned', [])
             hybrid = body.get('hybrid', True)
             max_tokens = int(body.get('max_tokens', DEFAULT_MAX_TOKENS))
             temperature = float(body.get('temperature', DEFAULT_TEMPERATURE))
             top_p = float(body.get('top_p', DEFAULT_TOP_P))
             include_sources = body.get('include_sources', True)
+            filters = parse_filters(body)
             
         elif event.get('querytext'):
             # Direct invocation with parameters
             query_text = event.get('querytext', '')
             top_k = int(event.get('top_k', 5))
-            model_id = event.get('model', DEFAULT_MODEL_ID)
+            model_id = event.get('model')
+            quality_tier = event.get('tier', DEFAULT_QUALITY_TIER)
+            pinned_documents = event.get('pinned', [])
             hybrid = event.get('hybrid', True)
             max_tokens = int(event.get('max_tokens', DEFAULT_MAX_TOKENS))
             temperature = float(event.get('temperature', DEFAULT_TEMPERATURE))
             top_p = float(event.get('top_p', DEFAULT_TOP_P))
             include_sources = event.get('include_sources', True)
+            filters = parse_filters(event)
             
         else:
             # Unknown event format
-            return {
-                'statusCode': 400,
-                'body': json.dumps({"error": "Invalid request format"})
-            }
+            return json_response(400, {"error": "Invalid request format"})
         
         # Validate query text
         if not query_text:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({"error": "Query text is required"})
-            }
+            return json_response(400, {"error": "Query text is required"})
             
         # Execute the RAG query
-        result, status_code = rag_query(
+        run_query = rag_query_pipelined if RAG_PIPELINE == 'async' else rag_query
+        result, status_code = run_query(
             query_text, top_k, model_id, hybrid, 
-            max_tokens, temperature, top_p, include_sources
+            max_tokens, temperature, top_p, include_sources, quality_tier,
+            pinned_documents, filters
         )
         
         # Return the response
-        return {
-            'statusCode': status_code,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': json.dumps(result)
-        }
+        return json_response(status_code, result, event)
         
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({"error": f"Internal server error: {str(e)}"})
-        } 
\ No newline at end of file
+        return json_response(500, {"error": f"Internal server error: {str(e)}"})
+
+warm_up_on_init(__name__, warm_up_container)
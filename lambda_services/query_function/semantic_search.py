@@ -1,159 +1,577 @@
 import os
 import json
-import boto3
+import hmac
+import base64
+import struct
+import hashlib
+import datetime
 import requests
 from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
 
-# Initialize Bedrock client for embeddings
-bedrock_runtime = boto3.client(
-    service_name='bedrock-runtime',
-    region_name=os.environ.get('AWS_REGION', 'us-east-1')
+from common.embeddings import (
+    get_query_embeddings, normalize_endpoint, EmbeddingModelMismatch, INDEX_ALIAS
 )
-
-# Constants for embedding model
-EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
-EMBEDDING_DIMENSION = 1536  # Titan model dimension
+from common.tracing import span
+from common.responses import json_response
+from common.tenancy import tenancy_enabled, normalize_tenant, tenant_scope, routing_param
+from common.warmup import warm_up
+from common.handler import lambda_entry, warm_up_on_init
 
 # Get OpenSearch endpoint from environment variable
 opensearch_endpoint = os.environ.get('OPENSEARCH_ENDPOINT')
-index_name = os.environ.get('OPENSEARCH_INDEX', 'documents')
+index_name = INDEX_ALIAS
+
+# One pooled session per process, so warm containers and the server reuse OpenSearch connections
+OPENSEARCH_POOL_SIZE = int(os.environ.get('OPENSEARCH_POOL_SIZE', 32))
+http = requests.Session()
+for _scheme in ('http://', 'https://'):
+    http.mount(_scheme, requests.adapters.HTTPAdapter(pool_maxsize=OPENSEARCH_POOL_SIZE))
+
+# Cursor pagination: how long an idle point in time stays open between pages
+SEARCH_PIT_KEEP_ALIVE = os.environ.get('SEARCH_PIT_KEEP_ALIVE', '5m')
+# Paged vector searches always fetch this many neighbours, so every page costs the same; results end there
+SEARCH_MAX_DEPTH = int(os.environ.get('SEARCH_MAX_DEPTH', 200))
+# Score order with the point in time's shard doc as a unique (and cheap) tiebreaker for search_after
+PAGINATION_SORT = [{"_score": {"order": "desc"}}, {"_shard_doc": {"order": "asc"}}]
+CURSOR_VERSION = 2
+# Key that signs cursors, so clients can't change the query, page size or filters of a search.
+# Every container serving a search must share it; without one each process signs with its own random key
+SEARCH_CURSOR_SECRET = os.environ.get('SEARCH_CURSOR_SECRET', '').encode('utf-8')
+if not SEARCH_CURSOR_SECRET:
+    print("SEARCH_CURSOR_SECRET is not set; cursors only work on the process that issued them")
+    SEARCH_CURSOR_SECRET = os.urandom(32)
+
+# Batch search limits
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', 100))
+BATCH_EMBEDDING_WORKERS = int(os.environ.get('BATCH_EMBEDDING_WORKERS', 8))
+
+# Stored fields the API never returns; leaving them out keeps search responses small
+SOURCE_EXCLUDES = ["vector", "minhash", "lsh_bands"]
 
-def get_embeddings(text, max_chunk_size=8000):
+# Most documents (e.g. the segments of a recording) fetched per pinned filename
+PINNED_MAX_DOCUMENTS = int(os.environ.get('PINNED_MAX_DOCUMENTS', 20))
+
+# Structured metadata fields callers can filter on; tenant also picks the index or routing key
+FILTER_FIELDS = ('file_type', 'source_bucket', 'source_prefix', 'extracted_after', 'extracted_before', 'tenant')
+
+def parse_filters(params):
     """
-    Generate embeddings using Amazon Bedrock Titan Embeddings model.
+    Pick the filter fields out of request parameters, or out of a "filter"
+    object if the request has one. Comma-separated strings are split into
+    lists. Returns None if no filter is set.
     """
-    if not text or not text.strip():
-        print("Empty text provided for embeddings")
-        return None
-        
-    try:
-        # Ensure we don't exceed the model's maximum input size
-        if len(text) > max_chunk_size:
-            print(f"Text exceeds maximum size, truncating to {max_chunk_size} characters")
-            text = text[:max_chunk_size]
-            
-        # Prepare request body
-        request_body = json.dumps({
-            "inputText": text
+    params = params or {}
+    if isinstance(params.get('filter'), dict):
+        params = params['filter']
+    filters = {}
+    for field in FILTER_FIELDS:
+        value = params.get(field)
+        if isinstance(value, str) and field in ('file_type', 'source_bucket'):
+            value = [v.strip() for v in value.split(',') if v.strip()]
+        if value:
+            filters[field] = value
+    return filters or None
+
+def build_filter_clauses(filters):
+    """
+    Translate filters into OpenSearch filter clauses on the structured
+    metadata fields. Raises ValueError for unknown fields or bad dates.
+    """
+    if not filters:
+        return []
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown filter fields: {', '.join(sorted(unknown))}")
+
+    clauses = []
+    if filters.get('tenant'):
+        if not tenancy_enabled():
+            raise ValueError("Tenant filters need TENANT_MODE index or routing")
+        clauses.append({"term": {"tenant": normalize_tenant(filters['tenant'])}})
+    if filters.get('file_type'):
+        file_types = filters['file_type']
+        file_types = [file_types] if isinstance(file_types, str) else file_types
+        clauses.append({"terms": {"file_type": [t.lower().lstrip('.') for t in file_types]}})
+    if filters.get('source_bucket'):
+        buckets = filters['source_bucket']
+        clauses.append({"terms": {"source_bucket": [buckets] if isinstance(buckets, str) else list(buckets)}})
+    if filters.get('source_prefix'):
+        clauses.append({"prefix": {"source_key": filters['source_prefix']}})
+
+    time_range = {}
+    for field, operator in (('extracted_after', 'gte'), ('extracted_before', 'lt')):
+        if filters.get(field):
+            try:
+                # fromisoformat only accepts a Z suffix from Python 3.11
+                datetime.datetime.fromisoformat(filters[field].replace('Z', '+00:00'))
+            except (AttributeError, TypeError, ValueError):
+                raise ValueError(f"{field} must be an ISO 8601 date or time")
+            time_range[operator] = filters[field]
+    if time_range:
+        clauses.append({"range": {"extraction_time": time_range}})
+    return clauses
+
+def build_search_query(query_text, query_embedding, top_k=5, hybrid_search=True, filters=None):
+    """
+    Build the OpenSearch query body for a single query.
+    Filters restrict the candidates before scoring: inside the k-NN search
+    itself for vector queries, and in the scored bool query for hybrid ones.
+    """
+    filter_clauses = build_filter_clauses(filters)
+    if hybrid_search:
+        # Combined vector and text search for better results
+        keyword_query = {"should": [{"match": {"text": query_text}}]}
+        if filter_clauses:
+            # With a filter the match would otherwise become optional
+            keyword_query.update({"filter": filter_clauses, "minimum_should_match": 1})
+        search_query = {
+            "size": top_k,
+            "_source": {"excludes": SOURCE_EXCLUDES},
+            "query": {
+                "script_score": {
+                    "query": {
+                        "bool": keyword_query
+                    },
+                    "script": {
+                        "source": "knn_score",
+                        "params": {
+                            "field": "vector",
+                            "query_value": query_embedding,
+                            "space_type": "cosinesimil"
+                        }
+                    }
+                }
+            }
+        }
+    else:
+        # Pure vector search
+        search_query = {
+            "size": top_k,
+            "_source": {"excludes": SOURCE_EXCLUDES},
+            "query": {
+                "knn": {
+                    "vector": {
+                        "vector": query_embedding,
+                        "k": top_k
+                    }
+                }
+            }
+        }
+        if filter_clauses:
+            # Efficient k-NN filtering: the engine only walks matching documents
+            search_query["query"]["knn"]["vector"]["filter"] = {"bool": {"filter": filter_clauses}}
+    return search_query
+
+def format_hits(hits):
+    """
+    Convert raw OpenSearch hits into the API result format
+    """
+    formatted_results = []
+    for hit in hits:
+        doc = hit.get("_source", {})
+        formatted_results.append({
+            "score": hit.get("_score"),
+            "filename": doc.get("filename"),
+            "text": doc.get("text"),
+            "metadata": json.loads(doc.get("text-metadata", "{}"))
         })
-        
-        # Call Bedrock to get embeddings
-        response = bedrock_runtime.invoke_model(
-            modelId=EMBEDDING_MODEL_ID,
-            body=request_body
-        )
-        
-        # Parse the response
-        response_body = json.loads(response.get("body").read())
-        embedding = response_body.get("embedding")
-        
-        return embedding
+    return formatted_results
+
+def search_scope(filters=None):
+    """
+    (index, routing) a search reads from: the tenant's index or routing key
+    when the filters name a tenant, otherwise the shared or cross-tenant alias
+    """
+    tenant = (filters or {}).get('tenant')
+    return tenant_scope(normalize_tenant(tenant) if tenant else None, index_name)
+
+def execute_search(query_text, search_query, filters=None):
+    """
+    Run a search body against the index (or the filters' tenant) and format the hits
+    """
+    # Construct search URL
+    index, routing = search_scope(filters)
+    search_url = f"{normalize_endpoint(opensearch_endpoint)}/{index}/_search{routing_param(routing)}"
+    headers = {"Content-Type": "application/json"}
+
+    with span('opensearch_search', size=search_query.get('size')):
+        response = http.post(search_url, headers=headers, data=json.dumps(search_query))
+
+    if response.status_code != 200:
+        return {"error": f"OpenSearch query failed: {response.text}"}, response.status_code
+
+    # Parse search results
+    results = json.loads(response.text)
+    hits = results.get("hits", {}).get("hits", [])
+
+    # Format the results
+    return {"query": query_text, "results": format_hits(hits)}, 200
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode((text + '=' * (-len(text) % 4)).encode('ascii'))
+
+def encode_embedding(embedding):
+    """Pack a query embedding as float32, the precision OpenSearch scores with"""
+    return _b64encode(struct.pack(f'<{len(embedding)}f', *embedding))
+
+def decode_embedding(text):
+    """Unpack an embedding packed by encode_embedding"""
+    data = _b64decode(text)
+    if not data or len(data) % 4:
+        raise ValueError("Invalid embedding")
+    return list(struct.unpack(f'<{len(data) // 4}f', data))
+
+def _sign(message):
+    return _b64encode(hmac.new(SEARCH_CURSOR_SECRET, message.encode('ascii'), hashlib.sha256).digest())
+
+def encode_cursor(state, embedding):
+    """
+    Opaque continuation token for the next page: the search state and the
+    packed query embedding, signed with SEARCH_CURSOR_SECRET
+    """
+    payload = _b64encode(json.dumps({"v": CURSOR_VERSION, **state}, separators=(',', ':')).encode('utf-8'))
+    message = f"{payload}.{encode_embedding(embedding)}"
+    return f"{message}.{_sign(message)}"
+
+def decode_cursor(token):
+    """
+    Read a continuation token into (state, embedding); raises ValueError if
+    it isn't one of ours or was altered
+    """
+    try:
+        message, signature = token.rsplit('.', 1)
+        if not hmac.compare_digest(signature, _sign(message)):
+            raise ValueError("Invalid cursor")
+        payload, embedding = message.split('.')
+        state = json.loads(_b64decode(payload))
+        embedding = decode_embedding(embedding)
+    except (AttributeError, TypeError, ValueError, UnicodeError, struct.error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(state, dict) or state.get("v") != CURSOR_VERSION or not state.get("pit"):
+        raise ValueError("Invalid cursor")
+    return state, embedding
+
+def open_point_in_time(endpoint, index=None, routing=None):
+    """Open a point in time on the index so every page sees the same documents"""
+    response = http.post(f"{endpoint}/{index or index_name}/_search/point_in_time"
+                         f"?keep_alive={SEARCH_PIT_KEEP_ALIVE}{routing_param(routing, '&')}")
+    if response.status_code != 200:
+        raise Exception(f"Could not open point in time: {response.text}")
+    return json.loads(response.text)["pit_id"]
+
+def close_point_in_time(endpoint, pit_id):
+    """Release a point in time after the last page; it would expire on its own anyway"""
+    try:
+        http.delete(f"{endpoint}/_search/point_in_time", headers={"Content-Type": "application/json"},
+                    data=json.dumps({"pit_id": [pit_id]}))
+    except requests.exceptions.RequestException as e:
+        print(f"Could not close point in time: {str(e)}")
+
+def fetch_documents(filenames, filters=None):
+    """
+    The documents with exactly these filenames within the filters' scope,
+    whether or not a search would rank them, sorted by filename and segment
+    so the same filenames always come back in the same order
+    """
+    filenames = sorted(set(filenames))
+    search_query = {
+        "size": PINNED_MAX_DOCUMENTS * len(filenames),
+        "_source": {"excludes": SOURCE_EXCLUDES},
+        "query": {
+            "bool": {
+                "filter": build_filter_clauses(filters) + [{
+                    "bool": {
+                        "should": [{"match_phrase": {"filename": filename}} for filename in filenames],
+                        "minimum_should_match": 1
+                    }
+                }]
+            }
+        }
+    }
+    result, status_code = execute_search(None, search_query, filters)
+    if status_code != 200:
+        return result, status_code
+    # filename is analysed text, so the phrase match can also hit longer names
+    wanted = set(filenames)
+    documents = [doc for doc in result["results"] if doc.get("filename") in wanted]
+    documents.sort(key=lambda doc: (doc["filename"], doc["metadata"].get("segment", 0)))
+    return {"results": documents}, 200
+
+def keyword_search(query_text, top_k=5, filters=None):
+    """
+    BM25-only search that needs no embedding, used to prefetch context
+    while the query embedding is still being generated
+    """
+    if not query_text:
+        return {"error": "Query text is required"}, 400
+
+    if not opensearch_endpoint:
+        return {"error": "OpenSearch endpoint is not configured"}, 500
+
+    try:
+        search_query = {
+            "size": top_k,
+            "_source": {"excludes": SOURCE_EXCLUDES},
+            "query": {
+                "bool": {
+                    "must": [{"match": {"text": query_text}}],
+                    "filter": build_filter_clauses(filters)
+                }
+            }
+        }
+        return execute_search(query_text, search_query, filters)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     except Exception as e:
-        print(f"Error generating embeddings: {str(e)}")
-        return None
+        print(f"Error in keyword search: {str(e)}")
+        return {"error": f"Failed to search documents: {str(e)}"}, 500
 
-def search_documents(query_text, top_k=5, hybrid_search=True):
+def search_documents(query_text, top_k=5, hybrid_search=True, filters=None):
     """
     Search documents in OpenSearch using semantic search with vector embeddings
     If hybrid_search is True, combines vector search with keyword search for better results
+    Filters (see FILTER_FIELDS) restrict the search to matching documents
     """
     if not query_text:
         return {"error": "Query text is required"}, 400
         
     if not opensearch_endpoint:
         return {"error": "OpenSearch endpoint is not configured"}, 500
+
+    # Reject bad filters before paying for an embedding
+    try:
+        build_filter_clauses(filters)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     
     try:
-        # Generate embeddings for the query
-        query_embedding = get_embeddings(query_text)
+        # Ensure OpenSearch endpoint has the correct scheme
+        endpoint = normalize_endpoint(opensearch_endpoint)
+
+        # Generate embeddings for the query with the model the index was built with
+        try:
+            with span('embedding'):
+                query_embedding = get_query_embeddings(query_text, endpoint, search_scope(filters)[0])
+        except EmbeddingModelMismatch as e:
+            return {"error": str(e)}, 409
         
         if not query_embedding:
             return {"error": "Failed to generate embeddings for the query"}, 500
-        
-        # Ensure OpenSearch endpoint has the correct scheme
-        endpoint = opensearch_endpoint
-        if not endpoint.startswith(('http://', 'https://')):
-            endpoint = f"https://{endpoint}"
             
-        # Construct search URL
-        search_url = f"{endpoint}/{index_name}/_search"
-        headers = {"Content-Type": "application/json"}
-        
         # Build the search query
-        if hybrid_search:
-            # Combined vector and text search for better results
-            search_query = {
-                "size": top_k,
-                "query": {
-                    "script_score": {
-                        "query": {
-                            "bool": {
-                                "should": [
-                                    {"match": {"text": query_text}}
-                                ]
-                            }
-                        },
-                        "script": {
-                            "source": "knn_score",
-                            "params": {
-                                "field": "vector",
-                                "query_value": query_embedding,
-                                "space_type": "cosinesimil"
-                            }
-                        }
-                    }
-                }
-            }
-        else:
-            # Pure vector search
-            search_query = {
-                "size": top_k,
-                "query": {
-                    "knn": {
-                        "vector": {
-                            "vector": query_embedding,
-                            "k": top_k
-                        }
-                    }
-                }
-            }
+        search_query = build_search_query(query_text, query_embedding, top_k, hybrid_search, filters)
             
         # Execute the search
-        response = requests.post(search_url, headers=headers, data=json.dumps(search_query))
+        return execute_search(query_text, search_query, filters)
         
+    except Exception as e:
+        print(f"Error searching documents: {str(e)}")
+        return {"error": f"Failed to search documents: {str(e)}"}, 500
+
+def search_page(query_text=None, top_k=5, hybrid_search=True, filters=None, cursor=None):
+    """
+    One page of a paginated search. Without a cursor this opens a point in
+    time and returns the first page; with the cursor from a previous page it
+    continues with search_after on the same point in time, taking the query,
+    its embedding, page size and filters from the cursor, so only the first
+    page calls the embedding model. Each page only fetches its own hits, so
+    page N costs about the same as page 1. A `next_token` is returned while
+    there may be more results.
+    """
+    if not opensearch_endpoint:
+        return {"error": "OpenSearch endpoint is not configured"}, 500
+
+    endpoint = normalize_endpoint(opensearch_endpoint)
+    if cursor:
+        try:
+            # The cursor carries the query embedding, so the scores search_after continues from can't move
+            state, query_embedding = decode_cursor(cursor)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        query_text, top_k, hybrid_search, filters = state["q"], state["k"], state["h"], state.get("f")
+        pit_id, search_after = state["pit"], state["after"]
+    else:
+        if not query_text:
+            return {"error": "Query text is required"}, 400
+        try:
+            build_filter_clauses(filters)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        search_after = None
+
+    try:
+        if not cursor:
+            index, routing = search_scope(filters)
+            with span('embedding'):
+                query_embedding = get_query_embeddings(query_text, endpoint, index)
+            if not query_embedding:
+                return {"error": "Failed to generate embeddings for the query"}, 500
+            # Every page searches with the float32 values the cursor carries
+            query_embedding = decode_embedding(encode_embedding(query_embedding))
+            with span('opensearch_open_pit'):
+                pit_id = open_point_in_time(endpoint, index, routing)
+
+        search_query = build_search_query(query_text, query_embedding, top_k, hybrid_search, filters)
+        if not hybrid_search:
+            search_query["query"]["knn"]["vector"]["k"] = max(SEARCH_MAX_DEPTH, top_k)
+        # Point in time searches name no index; the PIT pins it
+        search_query.update({
+            "pit": {"id": pit_id, "keep_alive": SEARCH_PIT_KEEP_ALIVE},
+            "sort": PAGINATION_SORT,
+            "track_total_hits": False
+        })
+        if search_after:
+            search_query["search_after"] = search_after
+
+        with span('opensearch_search', size=top_k):
+            response = http.post(f"{endpoint}/_search", headers={"Content-Type": "application/json"},
+                                 data=json.dumps(search_query))
+        if response.status_code == 404:
+            return {"error": "Cursor expired, start the search again"}, 410
         if response.status_code != 200:
             return {"error": f"OpenSearch query failed: {response.text}"}, response.status_code
-            
-        # Parse search results
+
         results = json.loads(response.text)
         hits = results.get("hits", {}).get("hits", [])
-        
-        # Format the results
-        formatted_results = []
-        for hit in hits:
-            doc = hit.get("_source", {})
-            formatted_results.append({
-                "score": hit.get("_score"),
-                "filename": doc.get("filename"),
-                "text": doc.get("text"),
-                "metadata": json.loads(doc.get("text-metadata", "{}"))
-            })
-        
-        return {"query": query_text, "results": formatted_results}, 200
-        
+        # OpenSearch may hand back a new PIT ID; later pages must use it
+        pit_id = results.get("pit_id", pit_id)
+
+        result = {"query": query_text, "results": format_hits(hits)}
+        if len(hits) == top_k:
+            result["next_token"] = encode_cursor({
+                "q": query_text, "k": top_k, "h": hybrid_search, "f": filters,
+                "pit": pit_id, "after": hits[-1]["sort"]
+            }, query_embedding)
+        else:
+            close_point_in_time(endpoint, pit_id)
+        return result, 200
+
+    except EmbeddingModelMismatch as e:
+        return {"error": str(e)}, 409
     except Exception as e:
-        print(f"Error searching documents: {str(e)}")
+        print(f"Error in paginated search: {str(e)}")
         return {"error": f"Failed to search documents: {str(e)}"}, 500
 
+def search_documents_batch(queries, top_k=5, hybrid_search=True, filters=None):
+    """
+    Search many queries at once: embed them concurrently, then run every
+    search in a single OpenSearch _msearch request.
+    Returns results keyed by query text; duplicate queries are searched once.
+    The same filters apply to every query.
+    """
+    queries = [q for q in dict.fromkeys(queries or []) if q]
+    if not queries:
+        return {"error": "At least one query is required"}, 400
+
+    if len(queries) > MAX_BATCH_QUERIES:
+        return {"error": f"Batch size exceeds the limit of {MAX_BATCH_QUERIES} queries"}, 400
+
+    try:
+        build_filter_clauses(filters)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    if not opensearch_endpoint:
+        return {"error": "OpenSearch endpoint is not configured"}, 500
+
+    try:
+        endpoint = normalize_endpoint(opensearch_endpoint)
+        index, routing = search_scope(filters)
+        header = {"index": index, **({"routing": routing} if routing else {})}
+
+        # Step 1: Embed all queries concurrently
+        workers = min(BATCH_EMBEDDING_WORKERS, len(queries))
+        with span('embedding_batch', queries=len(queries)), ThreadPoolExecutor(max_workers=workers) as executor:
+            embeddings = list(executor.map(
+                lambda q: get_query_embeddings(q, endpoint, index), queries
+            ))
+
+        # Step 2: Build one NDJSON _msearch body for every query we could embed
+        results = {}
+        searchable = []
+        msearch_lines = []
+        for query_text, query_embedding in zip(queries, embeddings):
+            if not query_embedding:
+                results[query_text] = {"error": "Failed to generate embeddings for the query"}
+                continue
+            searchable.append(query_text)
+            msearch_lines.append(json.dumps(header))
+            msearch_lines.append(json.dumps(build_search_query(query_text, query_embedding, top_k, hybrid_search,
+                                                               filters)))
+
+        # Step 3: Run every search in a single round trip
+        if searchable:
+            with span('opensearch_msearch', queries=len(searchable)):
+                response = http.post(
+                    f"{endpoint}/_msearch",
+                    headers={"Content-Type": "application/x-ndjson"},
+                    data="\n".join(msearch_lines) + "\n"
+                )
+
+            if response.status_code != 200:
+                return {"error": f"OpenSearch query failed: {response.text}"}, response.status_code
+
+            responses = json.loads(response.text).get("responses", [])
+            for query_text, item in zip(searchable, responses):
+                if item.get("error"):
+                    results[query_text] = {"error": f"OpenSearch query failed: {json.dumps(item['error'])}"}
+                else:
+                    results[query_text] = {"results": format_hits(item.get("hits", {}).get("hits", []))}
+
+        return {"results": results}, 200
+
+    except EmbeddingModelMismatch as e:
+        return {"error": str(e)}, 409
+    except Exception as e:
+        print(f"Error in batch search: {str(e)}")
+        return {"error": f"Failed to search documents: {str(e)}"}, 500
+
+def warm_up_container():
+    """Open pooled OpenSearch and Bedrock connections and pre-embed the popular queries"""
+    return warm_up(opensearch_endpoint, index_name, session=http, queries=True)
+
+@lambda_entry('search', warm_up_container)
 def lambda_handler(event, context):
     """
-    Lambda handler for the semantic search API
+    Lambda handler for the semantic search API.
+    With a debug flag set, the response body includes per-stage timings.
+    Warm-up pings prime the container and return without a search.
+    """
+    return handle_search_request(event)
+
+def handle_search_request(event):
+    """
+    Parse and run a semantic search request
     Accepts query parameters:
     - q: Query text (required)
     - k: Top K results (optional, default 5)
     - hybrid: Whether to use hybrid search (optional, default true)
+    - file_type, source_bucket: Comma-separated values to restrict results to (optional)
+    - source_prefix: Only documents whose source key starts with this (optional)
+    - extracted_after, extracted_before: ISO 8601 bounds on the extraction time (optional)
+    - tenant: Only search this tenant's documents, with TENANT_MODE index or routing (optional)
+    - paginate: Return a next_token for fetching the following page (optional, default false)
+    - cursor: A next_token from a previous page; replaces every other parameter (optional)
+    POST bodies and direct invocations pass the filters as a "filter" object,
+    and may send "queries" (a list) instead of a single query to run a batch search.
     """
     try:
+        # Batch requests carry a list of queries instead of a single one
+        if event.get('httpMethod') == 'POST' and event.get('body'):
+            payload = json.loads(event.get('body', '{}'))
+        else:
+            payload = event
+        if isinstance(payload.get('queries'), list):
+            result, status_code = search_documents_batch(
+                payload['queries'], int(payload.get('top_k', 5)), payload.get('hybrid', True),
+                parse_filters(payload)
+            )
+            return json_response(status_code, result, event)
+
         # Parse different types of events (API Gateway, direct invocation)
         if event.get('httpMethod') == 'GET' and event.get('queryStringParameters'):
             # API Gateway GET request
@@ -161,6 +579,9 @@ def lambda_handler(event, context):
             query_text = params.get('q', '')
             top_k = int(params.get('k', '5'))
             hybrid = params.get('hybrid', 'true').lower() == 'true'
+            filters = parse_filters(params)
+            paginate = params.get('paginate', 'false').lower() == 'true'
+            cursor = params.get('cursor')
             
         elif event.get('body') and event.get('httpMethod') == 'POST':
             # API Gateway POST request
@@ -168,45 +589,38 @@ def lambda_handler(event, context):
             query_text = body.get('query', '')
             top_k = int(body.get('top_k', 5))
             hybrid = body.get('hybrid', True)
+            filters = parse_filters(body)
+            paginate = body.get('paginate', False)
+            cursor = body.get('cursor')
             
-        elif event.get('querytext'):
+        elif event.get('querytext') or event.get('cursor'):
             # Direct invocation with parameters
             query_text = event.get('querytext', '')
             top_k = int(event.get('top_k', 5))
             hybrid = event.get('hybrid', True)
+            filters = parse_filters(event)
+            paginate = event.get('paginate', False)
+            cursor = event.get('cursor')
             
         else:
             # Unknown event format
-            return {
-                'statusCode': 400,
-                'body': json.dumps({"error": "Invalid request format"})
-            }
+            return json_response(400, {"error": "Invalid request format"})
         
         # Validate query text
-        if not query_text:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({"error": "Query text is required"})
-            }
+        if not query_text and not cursor:
+            return json_response(400, {"error": "Query text is required"})
             
         # Execute the search
-        result, status_code = search_documents(query_text, top_k, hybrid)
+        if paginate or cursor:
+            result, status_code = search_page(query_text, top_k, hybrid, filters, cursor)
+        else:
+            result, status_code = search_documents(query_text, top_k, hybrid, filters)
         
         # Return the response
-        return {
-            'statusCode': status_code,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': json.dumps(result)
-        }
+        return json_response(status_code, result, event)
         
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({"error": f"Internal server error: {str(e)}"})
-        } 
\ No newline at end of file
+        return json_response(500, {"error": f"Internal server error: {str(e)}"}) 
+
+warm_up_on_init(__name__, warm_up_container)
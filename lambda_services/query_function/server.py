@@ -0,0 +1,343 @@
+"""
+Long-running ASGI server for the search and RAG APIs.
+
+Serves the same requests as semantic_search.lambda_handler and
+rag_service.lambda_handler, by building the equivalent API Gateway event and
+calling the handlers, so both deployments behave identically. In one
+long-lived process the pooled OpenSearch session, the boto3 clients, the
+index model lookup and the query embedding cache are shared by every request
+instead of living only as long as a warm Lambda container. On top of that:
+
+- Identical requests in flight at the same time are coalesced (singleflight):
+  the first one does the work and the others wait for its response.
+- Successful responses are cached for SERVER_CACHE_TTL seconds, except for
+  paged searches.
+- Compressed handler responses are sent as bytes, and NDJSON bodies are
+  streamed to the client a chunk of lines at a time.
+- Streaming story requests send each event as the pipeline produces it.
+- On startup the connection pools and query embedding cache are warmed up
+  (common/warmup.py) before the server accepts requests.
+
+The app has no framework dependency; run it with any ASGI server, e.g.
+
+    pip install uvicorn
+    cd lambda_services
+    PYTHONPATH=.:query_function QUERY_EMBEDDING_CACHE_SIZE=10000 uvicorn server:app --host 0.0.0.0 --port 8080
+
+Routes: GET/POST /search, GET/POST /rag, GET/POST /story and GET /health.
+"""
+
+import os
+import json
+import time
+import base64
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+# Compressed handler responses are decoded back to bytes below, so unlike
+# behind API Gateway they need no binary media types
+os.environ.setdefault('RESPONSE_COMPRESSION', 'true')
+
+import semantic_search
+import rag_service
+import query
+from common.tracing import event_debug_flag
+
+# Threads running the blocking handlers; bounds concurrent Bedrock/OpenSearch work per process
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 32))
+# Seconds a successful response is reused for an identical request; 0 disables the cache
+SERVER_CACHE_TTL = float(os.environ.get('SERVER_CACHE_TTL', 30))
+SERVER_CACHE_SIZE = int(os.environ.get('SERVER_CACHE_SIZE', 1024))
+MAX_BODY_BYTES = 1024 * 1024
+# Bytes per body message when streaming NDJSON
+STREAM_CHUNK_BYTES = 16 * 1024
+# Warm up connections and the query embedding cache before accepting requests
+SERVER_WARMUP = os.environ.get('SERVER_WARMUP', 'true').lower() == 'true'
+# Request headers passed through to the handlers; they select the response format and encoding
+FORWARDED_HEADERS = ('accept', 'accept-encoding')
+
+ROUTES = {
+    '/search': semantic_search.lambda_handler,
+    '/rag': rag_service.lambda_handler,
+    '/story': query.lambda_handler,
+}
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self.in_flight = {}
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """Await func(), or the result of an identical call already running"""
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(func())
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # A waiter that disconnects must not cancel the call the others are waiting on
+        return await asyncio.shield(future)
+
+
+class ResponseCache:
+    """Small LRU of handler responses with a fixed time to live"""
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, response = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def put(self, key, response):
+        if self.ttl <= 0 or self.size <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+executor = ThreadPoolExecutor(max_workers=SERVER_WORKERS, thread_name_prefix='query')
+singleflight = SingleFlight()
+response_cache = ResponseCache(SERVER_CACHE_TTL, SERVER_CACHE_SIZE)
+stats = {'requests': 0, 'handler_calls': 0}
+
+
+def build_event(method, path, query_string, body, headers=None):
+    """The API Gateway proxy event the Lambda handlers expect"""
+    params = dict(parse_qsl(query_string, keep_blank_values=True))
+    event = {'httpMethod': method, 'path': path, 'queryStringParameters': params or None}
+    forwarded = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in headers or []}
+    forwarded = {name: value for name, value in forwarded.items() if name in FORWARDED_HEADERS}
+    if forwarded:
+        event['headers'] = forwarded
+    if body:
+        event['body'] = body.decode('utf-8')
+    return event
+
+
+def request_key(event):
+    """Identity of a request for coalescing and caching; JSON bodies are compared by content"""
+    body = event.get('body') or ''
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True) if body else ''
+    except ValueError:
+        pass
+    params = tuple(sorted((event.get('queryStringParameters') or {}).items()))
+    headers = tuple(sorted((event.get('headers') or {}).items()))
+    return (event['httpMethod'], event['path'], params, headers, body)
+
+
+def is_paginated(event):
+    """Paged searches hold a point in time that the last page closes, so their responses aren't reused"""
+    params = event.get('queryStringParameters') or {}
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        body = {}
+    return any(isinstance(source, dict) and (source.get('cursor') or str(source.get('paginate')).lower() == 'true')
+               for source in (params, body))
+
+
+async def call_handler(handler, event):
+    """Run a blocking Lambda handler on the worker pool"""
+    stats['handler_calls'] += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, handler, event, None)
+
+
+async def handle(handler, event):
+    """Serve from cache, join an identical in-flight request, or run the handler"""
+    # Debug requests report their own timings, so they always run
+    if event_debug_flag(event):
+        return await call_handler(handler, event)
+
+    key = request_key(event)
+    cacheable = not is_paginated(event)
+    cached = response_cache.get(key) if cacheable else None
+    if cached is not None:
+        return cached
+
+    async def run():
+        response = await call_handler(handler, event)
+        if cacheable and response.get('statusCode') == 200:
+            response_cache.put(key, response)
+        return response
+
+    return await singleflight.do(key, run)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status, body, headers=None):
+    payload = body.encode('utf-8') if isinstance(body, str) else body
+    headers = {'Content-Type': 'application/json', **(headers or {})}
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode(), str(value).encode()) for name, value in headers.items()]
+                   + [(b'content-length', str(len(payload)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def stream_response(send, status, body, headers):
+    """Send an uncompressed NDJSON body in chunks of whole lines, without a content length"""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode(), str(value).encode()) for name, value in headers.items()]
+    })
+    chunk = ''
+    for line in body.splitlines(keepends=True):
+        chunk += line
+        if len(chunk) >= STREAM_CHUNK_BYTES:
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            chunk = ''
+    await send({'type': 'http.response.body', 'body': chunk.encode('utf-8')})
+
+
+async def stream_events(send, events):
+    """Send events from a blocking generator as NDJSON lines, each as soon as it is produced"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'application/x-ndjson')]
+                   + [(name.lower().encode(), value.encode()) for name, value in CORS_HEADERS.items()]
+    })
+    loop = asyncio.get_running_loop()
+    finished = object()
+    while True:
+        try:
+            event = await loop.run_in_executor(executor, next, events, finished)
+        except Exception as e:
+            # Headers are already sent, so the error goes out as the last event
+            print(f"Error streaming events: {str(e)}")
+            event = {"type": "error", "error": f"Internal server error: {str(e)}", "status": 500}
+            await send({'type': 'http.response.body', 'body': (json.dumps(event) + '\n').encode('utf-8')})
+            return
+        if event is finished:
+            break
+        await send({'type': 'http.response.body', 'body': (json.dumps(event) + '\n').encode('utf-8'),
+                    'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_handler_response(send, response):
+    """Send a handler's API Gateway response, decoding base64 (compressed) bodies back to bytes"""
+    status = response.get('statusCode', 500)
+    headers = response.get('headers') or {}
+    body = response.get('body', '')
+    if response.get('isBase64Encoded'):
+        await send_response(send, status, base64.b64decode(body), headers)
+    elif headers.get('Content-Type') == 'application/x-ndjson':
+        await stream_response(send, status, body, headers)
+    else:
+        await send_response(send, status, body, headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if SERVER_WARMUP:
+                # rag_service warms the search session too, as it is the same one
+                await asyncio.get_running_loop().run_in_executor(executor, rag_service.warm_up_container)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    path = scope['path'].rstrip('/') or '/'
+    stats['requests'] += 1
+
+    if path == '/health':
+        await send_response(send, 200, json.dumps({
+            "status": "ok",
+            "in_flight": len(singleflight.in_flight),
+            "coalesced": singleflight.coalesced,
+            "cache_hits": response_cache.hits,
+            **stats
+        }))
+        return
+
+    handler = ROUTES.get(path)
+    if handler is None:
+        await send_response(send, 404, json.dumps({"error": f"Unknown path {path}"}))
+        return
+    if method == 'OPTIONS':
+        await send_response(send, 204, b'', CORS_HEADERS)
+        return
+    if method not in ('GET', 'POST'):
+        await send_response(send, 405, json.dumps({"error": f"Method {method} not allowed"}), CORS_HEADERS)
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        await send_response(send, 413, json.dumps({"error": "Request body too large"}))
+        return
+
+    event = build_event(method, path, scope.get('query_string', b'').decode('latin-1'), body, scope.get('headers'))
+    if path == '/story':
+        try:
+            query_text, options, stream = query.parse_story_request(event)
+        except ValueError:
+            # The handler reports the error
+            stream = False
+        if stream:
+            await stream_events(send, query.story_events(query_text, **options))
+            return
+
+    try:
+        response = await handle(handler, event)
+    except Exception as e:
+        print(f"Error serving {method} {path}: {str(e)}")
+        response = {'statusCode': 500, 'body': json.dumps({"error": f"Internal server error: {str(e)}"})}
+    await send_handler_response(send, response)
@@ -14,6 +14,9 @@ else
   echo "Using existing AWS_REGION: $AWS_REGION"
 fi
 
+# Shared modules (common/) live one level up
+export PYTHONPATH="$(cd .. && pwd):$PYTHONPATH"
+
 # Ask for OpenSearch endpoint if not already set
 if [ -z "$OPENSEARCH_ENDPOINT" ]; then
   echo -n "Enter your OpenSearch endpoint (without http/https): "
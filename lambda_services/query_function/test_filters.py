@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Test script for search filters: request parsing and the OpenSearch filter clauses.
+Runs offline, without calling OpenSearch. Run directly or with pytest.
+"""
+
+import os
+import sys
+
+# The query modules import each other flat, and the shared modules live in lambda_services/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import common.tenancy as tenancy
+from semantic_search import parse_filters, build_filter_clauses, build_search_query
+
+
+def expect_error(filters, message):
+    try:
+        build_filter_clauses(filters)
+    except ValueError as e:
+        assert message in str(e), str(e)
+        return
+    assert False, f"accepted {filters}"
+
+
+def test_no_filters():
+    """No filters means no clauses"""
+    assert build_filter_clauses(None) == []
+    assert build_filter_clauses({}) == []
+
+
+def test_metadata_clauses():
+    """Each filter field maps to its clause on the indexed metadata"""
+    clauses = build_filter_clauses({
+        "file_type": [".PDF", "jpg"],
+        "source_bucket": "scans",
+        "source_prefix": "2024/receipts/",
+    })
+    assert clauses == [
+        {"terms": {"file_type": ["pdf", "jpg"]}},
+        {"terms": {"source_bucket": ["scans"]}},
+        {"prefix": {"source_key": "2024/receipts/"}},
+    ]
+    assert build_filter_clauses({"file_type": "PNG"}) == [{"terms": {"file_type": ["png"]}}]
+
+
+def test_extraction_time_range():
+    """extracted_after is inclusive, extracted_before exclusive; both go in one range clause"""
+    clauses = build_filter_clauses({"extracted_after": "2024-01-01", "extracted_before": "2024-02-01T00:00:00Z"})
+    assert clauses == [{"range": {"extraction_time": {"gte": "2024-01-01", "lt": "2024-02-01T00:00:00Z"}}}]
+    assert build_filter_clauses({"extracted_before": "2024-03-01"}) == [
+        {"range": {"extraction_time": {"lt": "2024-03-01"}}}]
+
+
+def test_invalid_filters():
+    """Unknown fields and dates that aren't ISO 8601 are rejected"""
+    expect_error({"author": "someone"}, "Unknown filter fields: author")
+    expect_error({"extracted_after": "last tuesday"}, "extracted_after must be an ISO 8601")
+    expect_error({"extracted_before": 20240101}, "extracted_before must be an ISO 8601")
+
+
+def test_tenant_filter():
+    """A tenant becomes a term on the normalised name, and needs tenancy turned on"""
+    saved = tenancy.TENANT_MODE
+    try:
+        tenancy.TENANT_MODE = 'none'
+        expect_error({"tenant": "acme"}, "TENANT_MODE")
+        tenancy.TENANT_MODE = 'index'
+        assert build_filter_clauses({"tenant": " ACME "}) == [{"term": {"tenant": "acme"}}]
+        expect_error({"tenant": "../other"}, "Invalid tenant")
+    finally:
+        tenancy.TENANT_MODE = saved
+
+
+def test_parse_filters():
+    """Query string values are split on commas, a "filter" object is used as is, empty values are dropped"""
+    assert parse_filters({"q": "x", "file_type": "pdf, jpg", "source_bucket": "a,b", "source_prefix": ""}) == {
+        "file_type": ["pdf", "jpg"], "source_bucket": ["a", "b"]}
+    assert parse_filters({"filter": {"file_type": ["pdf"], "extracted_after": "2024-01-01"}, "file_type": "png"}) == {
+        "file_type": ["pdf"], "extracted_after": "2024-01-01"}
+    assert parse_filters({"q": "x"}) is None
+    assert parse_filters(None) is None
+
+
+def test_filters_reach_both_searches():
+    """Hybrid searches filter the scored bool query; vector searches filter inside the k-NN query"""
+    filters = {"file_type": ["pdf"], "source_prefix": "2024/"}
+    clauses = build_filter_clauses(filters)
+    vector = [0.1] * 4
+
+    keyword = build_search_query("invoice", vector, 5, True, filters)["query"]["script_score"]["query"]["bool"]
+    assert keyword["filter"] == clauses
+    # Otherwise the filter would make the text match optional
+    assert keyword["minimum_should_match"] == 1
+    assert "filter" not in build_search_query("invoice", vector, 5, True, None)["query"]["script_score"]["query"]["bool"]
+
+    knn = build_search_query("invoice", vector, 5, False, filters)["query"]["knn"]["vector"]
+    assert knn["filter"] == {"bool": {"filter": clauses}}
+    assert "filter" not in build_search_query("invoice", vector, 5, False, None)["query"]["knn"]["vector"]
+
+
+def main():
+    """Run all tests"""
+    print("======= TESTING SEARCH FILTERS =======")
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print("\n======= TEST SUMMARY =======")
+    print(f"{len(tests) - failed} passed, {failed} failed")
+    return failed == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Test script for search pagination cursors.
+Runs offline: cursors are encoded and decoded without calling OpenSearch. Run directly or with pytest.
+"""
+
+import os
+import sys
+import json
+import struct
+
+# The query modules import each other flat, and the shared modules live in lambda_services/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('SEARCH_CURSOR_SECRET', 'test-secret')
+
+import semantic_search
+from semantic_search import encode_cursor, decode_cursor, encode_embedding, decode_embedding, search_page
+
+STATE = {
+    "q": "invoice total", "k": 20, "h": True,
+    "f": {"file_type": ["pdf"], "tenant": "acme"},
+    "pit": "pit-abc123", "after": [1.25, 8589934597],
+}
+EMBEDDING = [0.1, -0.25, 0.333333333, 1e-7, 0.0]
+
+
+def float32(values):
+    """The values OpenSearch scores with"""
+    return list(struct.unpack(f'<{len(values)}f', struct.pack(f'<{len(values)}f', *values)))
+
+
+def test_cursor_round_trip():
+    """A cursor gives back the search state and the float32 query embedding"""
+    state, embedding = decode_cursor(encode_cursor(STATE, EMBEDDING))
+    assert state == {"v": semantic_search.CURSOR_VERSION, **STATE}
+    assert embedding == float32(EMBEDDING)
+
+
+def test_embedding_round_trip_is_stable():
+    """Repacking a decoded embedding changes nothing, so every page searches with the same vector"""
+    packed = encode_embedding(EMBEDDING)
+    assert encode_embedding(decode_embedding(packed)) == packed
+    assert len(packed) < len(json.dumps(EMBEDDING)) * 2
+
+
+def test_altered_cursor_is_rejected():
+    """Changing the page size, filters or embedding breaks the signature"""
+    token = encode_cursor(STATE, EMBEDDING)
+    payload, embedding, signature = token.split('.')
+    for changes in ({"k": 1000}, {"f": None}, {"q": "salaries"}):
+        forged = semantic_search._b64encode(json.dumps({"v": semantic_search.CURSOR_VERSION, **STATE, **changes})
+                                            .encode('utf-8'))
+        try:
+            decode_cursor(f"{forged}.{embedding}.{signature}")
+            assert False, f"accepted a cursor with {changes}"
+        except ValueError:
+            pass
+    other_embedding = encode_embedding([0.9] * len(EMBEDDING))
+    for forged in (f"{payload}.{other_embedding}.{signature}", f"{payload}.{embedding}", payload, "", "not.a.cursor"):
+        try:
+            decode_cursor(forged)
+            assert False, f"accepted {forged[:40]}"
+        except ValueError:
+            pass
+
+
+def test_cursor_from_another_secret_is_rejected():
+    """Cursors only verify with the key that signed them"""
+    token = encode_cursor(STATE, EMBEDDING)
+    saved = semantic_search.SEARCH_CURSOR_SECRET
+    semantic_search.SEARCH_CURSOR_SECRET = b'another-secret'
+    try:
+        decode_cursor(token)
+        assert False, "accepted a cursor signed with another key"
+    except ValueError:
+        pass
+    finally:
+        semantic_search.SEARCH_CURSOR_SECRET = saved
+
+
+def test_old_cursor_version_is_rejected():
+    """Version 1 cursors (unsigned, no embedding) are refused"""
+    legacy = semantic_search._b64encode(json.dumps({"v": 1, **STATE}).encode('utf-8'))
+    for token in (legacy, encode_cursor({**STATE, "v": 1}, EMBEDDING)):
+        try:
+            decode_cursor(token)
+            assert False, "accepted a version 1 cursor"
+        except ValueError:
+            pass
+
+
+def test_search_page_rejects_bad_cursor():
+    """search_page answers an invalid cursor with 400 before touching OpenSearch"""
+    saved = semantic_search.opensearch_endpoint
+    semantic_search.opensearch_endpoint = "http://search.invalid"
+    try:
+        result, status_code = search_page(cursor="garbage")
+        assert status_code == 400, result
+    finally:
+        semantic_search.opensearch_endpoint = saved
+
+
+def test_pagination_sort_uses_shard_doc():
+    """Score ties are broken by the point in time's _shard_doc"""
+    assert [list(clause)[0] for clause in semantic_search.PAGINATION_SORT] == ["_score", "_shard_doc"]
+
+
+def main():
+    """Run all tests"""
+    print("======= TESTING SEARCH PAGINATION CURSORS =======")
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print("\n======= TEST SUMMARY =======")
+    print(f"{len(tests) - failed} passed, {failed} failed")
+    return failed == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -65,7 +65,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
       },
       {
         Effect   = "Allow",
-        Action   = ["textract:*", "rekognition:*"],
+        Action   = ["textract:*", "rekognition:*", "transcribe:*"],
         Resource = "*"
       },
       {
@@ -75,7 +75,12 @@ resource "aws_iam_role_policy" "lambda_policy" {
       },
       {
         Effect   = "Allow",
-        Action   = "bedrock:InvokeModel",
+        Action   = ["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
+        Resource = "*"
+      },
+      {
+        Effect   = "Allow",
+        Action   = ["sqs:ReceiveMessage", "sqs:DeleteMessage", "sqs:GetQueueAttributes"],
         Resource = "*"
       },
       {
@@ -98,6 +103,7 @@ module "s3" {
   ingestion_bucket_name = var.ingestion_bucket_name
   processed_ingestion_bucket_name = var.processed_ingestion_bucket_name
   failed_ingestion_bucket_name = var.failed_ingestion_bucket_name
+  enable_ingestion_queue = var.enable_ingestion_queue
 }
 
 module "opensearch" {
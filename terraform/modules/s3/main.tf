@@ -33,3 +33,69 @@ resource "aws_s3_bucket_lifecycle_configuration" "failed_ingestion_lifecycle" {
 }
 
 
+
+# Optional SQS buffer between S3 and the ingest Lambda. Bulk uploads queue up
+# here and are drained in batches instead of fanning out one Lambda per object.
+resource "aws_sqs_queue" "ingestion_dlq" {
+  count                     = var.enable_ingestion_queue ? 1 : 0
+  name                      = "${var.ingestion_bucket_name}-ingest-dlq"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "ingestion_queue" {
+  count                      = var.enable_ingestion_queue ? 1 : 0
+  name                       = "${var.ingestion_bucket_name}-ingest"
+  visibility_timeout_seconds = var.ingestion_queue_visibility_timeout
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.ingestion_dlq[0].arn
+    maxReceiveCount     = var.ingestion_queue_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue_policy" "ingestion_queue_policy" {
+  count     = var.enable_ingestion_queue ? 1 : 0
+  queue_url = aws_sqs_queue.ingestion_queue[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect    = "Allow",
+      Principal = { Service = "s3.amazonaws.com" },
+      Action    = "sqs:SendMessage",
+      Resource  = aws_sqs_queue.ingestion_queue[0].arn,
+      Condition = {
+        ArnLike = {
+          "aws:SourceArn" = [
+            aws_s3_bucket.ingestion_bucket.arn,
+            aws_s3_bucket.processed_ingestion_bucket.arn
+          ]
+        }
+      }
+    }]
+  })
+}
+
+resource "aws_s3_bucket_notification" "ingestion_queue_notification" {
+  count  = var.enable_ingestion_queue ? 1 : 0
+  bucket = aws_s3_bucket.ingestion_bucket.id
+
+  queue {
+    queue_arn = aws_sqs_queue.ingestion_queue[0].arn
+    events    = ["s3:ObjectCreated:*"]
+  }
+
+  depends_on = [aws_sqs_queue_policy.ingestion_queue_policy]
+}
+
+resource "aws_s3_bucket_notification" "processed_queue_notification" {
+  count  = var.enable_ingestion_queue ? 1 : 0
+  bucket = aws_s3_bucket.processed_ingestion_bucket.id
+
+  queue {
+    queue_arn = aws_sqs_queue.ingestion_queue[0].arn
+    events    = ["s3:ObjectCreated:*"]
+  }
+
+  depends_on = [aws_sqs_queue_policy.ingestion_queue_policy]
+}
@@ -27,3 +27,13 @@ output "failed_ingestion_bucket_arn" {
   description = "ARN of the failed ingestion S3 bucket"
   value       = aws_s3_bucket.failed_ingestion_bucket.arn
 }
+
+output "ingestion_queue_arn" {
+  description = "ARN of the ingestion SQS queue, if enabled"
+  value       = var.enable_ingestion_queue ? aws_sqs_queue.ingestion_queue[0].arn : null
+}
+
+output "ingestion_dlq_arn" {
+  description = "ARN of the ingestion dead-letter queue, if enabled"
+  value       = var.enable_ingestion_queue ? aws_sqs_queue.ingestion_dlq[0].arn : null
+}
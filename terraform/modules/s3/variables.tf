@@ -20,3 +20,21 @@ variable "failed_ingestion_retention_days" {
 }
 
 
+
+variable "enable_ingestion_queue" {
+  description = "Deliver S3 notifications to an SQS queue instead of invoking the ingest Lambda directly"
+  type        = bool
+  default     = false
+}
+
+variable "ingestion_queue_visibility_timeout" {
+  description = "Visibility timeout for the ingestion queue; must be at least the ingest Lambda timeout"
+  type        = number
+  default     = 900
+}
+
+variable "ingestion_queue_max_receive_count" {
+  description = "Receives before an ingestion message is moved to the dead-letter queue"
+  type        = number
+  default     = 5
+}
@@ -28,3 +28,8 @@ output "opensearch_dashboard_endpoint" {
   value = module.opensearch.dashboard_endpoint
 }
 
+
+output "ingestion_queue_arn" {
+  value       = module.s3.ingestion_queue_arn
+  description = "ARN of the ingestion SQS queue for INGESTION_QUEUE_ARN in serverless.yml"
+}
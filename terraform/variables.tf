@@ -22,6 +22,12 @@ variable "failed_ingestion_bucket_name" {
 
 }
 
+variable "enable_ingestion_queue" {
+  description = "Buffer S3 ingestion events through SQS (deploy the ingest-from-queue function)"
+  type        = bool
+  default     = false
+}
+
 
 
 variable "bedrock_endpoint_url" {